@@ -11,14 +11,32 @@ def custom_altair_chart_to_json(*args, **kwargs):
 
 """Vega-Lite post processor to run after LLM-generated altair is executed."""
 
+import collections
+from collections.abc import Callable
+import dataclasses
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
 import re
+import time
 from typing import Any
 from typing import Union
 
 import altair as alt
+import numpy as np
 import pandas as pd
 import pandas.api.types
 
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+except ImportError:
+  # Type conversions fall back to pandas and python's `re`.
+  pa = None
+  pc = None
+
 is_datetime = pandas.api.types.is_datetime64_any_dtype
 is_numeric = pandas.api.types.is_numeric_dtype
 guess_datetime_format = pd._libs.tslibs.parsing.guess_datetime_format  # pylint: disable=protected-access
@@ -39,7 +57,52 @@ DISTANCE_OF_LABEL_FROM_WEDGE = 20
 MAX_PIE_WEDGES = 24
 MAX_VERTICAL_BARS = 25
 MIN_POINTS_NEEDED_FOR_TYPE_CONVERSION = 10
+CURRENCY_REGEX = r'(?:^\s*(\$|€|£|¥))|(?:(\$|€|£|¥)\s*$)'
+PERCENT_REGEX = r'\s*%$'
+# RE2 (Arrow) equivalents of the regexes above. RE2's `\s` only matches ASCII
+# whitespace and its `$` never matches before a trailing newline, unlike
+# python's, so both are spelled out.
+ARROW_WHITESPACE = r'[\t-\r\x{1c}-\x{1f}\x{85}\p{Z}]'
+ARROW_CURRENCY_REGEX = (
+    rf'^{ARROW_WHITESPACE}*(?P<before>[$€£¥])'
+    rf'|(?P<after>[$€£¥]){ARROW_WHITESPACE}*$'
+)
+ARROW_PERCENT_REGEX = rf'{ARROW_WHITESPACE}*%\n?$'
 MAX_HEATMAP_LABELED_X_VALUES = 20
+ROWS_SAMPLED_FOR_SIZE_ESTIMATE = 1000
+# String columns of frames with at least this many rows, with at most
+# MAX_CATEGORY_RATIO distinct values per row, are stored as categories while
+# post-processing.
+MIN_ROWS_FOR_CATEGORIES = 1000
+MAX_CATEGORY_RATIO = 0.5
+# Matches `datum.field` and `datum['field']` references in Vega expressions.
+DATUM_REFERENCE_REGEX = re.compile(
+    r'\bdatum\s*\.\s*([A-Za-z_$][\w$]*)|\bdatum\s*\[\s*([\'"])(.*?)\2\s*\]'
+)
+DATUM_REGEX = re.compile(r'\bdatum\b')
+MIN_ROWS_FOR_PRE_AGGREGATION = 5000
+PRE_AGGREGATION_MARK_TYPES = {'arc', 'bar', 'rect'}
+# Vega-Lite aggregate ops we can evaluate in pandas, mapped to pandas names.
+PRE_AGGREGATION_OPS = {
+    'count': 'size',
+    'sum': 'sum',
+    'mean': 'mean',
+    'average': 'mean',
+    'median': 'median',
+    'min': 'min',
+    'max': 'max',
+}
+DEFAULT_MAX_POINTS = 5000
+DOWNSAMPLED_LINE_MARK_TYPES = {'area', 'line', 'trail'}
+DOWNSAMPLED_POINT_MARK_TYPES = {'circle', 'point', 'square'}
+# Channels whose discrete fields split the data into separate series.
+SERIES_CHANNELS = ['color', 'detail', 'fill', 'shape', 'stroke', 'strokeDash']
+# LTTB always keeps the first and last point, plus one point per bucket.
+MIN_POINTS_PER_SERIES = 3
+# Largest number of grid cells per axis of density preserving sampling.
+DENSITY_SAMPLING_GRID_SIZE = 64
+# Upper bounds (in seconds) of the processor duration histogram buckets.
+PROCESSOR_SECONDS_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, math.inf)
 DEFAULT_COLORS = [
     '#1A73E8',
     '#12B5CB',
@@ -492,6 +555,76 @@ def format_labeled_pie_chart(
     text_layer.encoding.theta.stack = 'normalize' if uses_normalize else True
 
 
+def merge_extra_wedges(
+    pie_data: pd.DataFrame, theta_column: str, color_column: str
+) -> None:
+  """Merges the smallest wedges of a pie into a single "Other" wedge in place.
+
+  Args:
+    pie_data: DataFrame referenced by the pie layer.
+    theta_column: Field encoded as the pie's theta.
+    color_column: Field encoded as the pie's color.
+  """
+  colors = pie_data[color_column]
+  # Return if the number of wedges is less than `MAX_PIE_WEDGES` + 1
+  if colors.nunique(dropna=False) < MAX_PIE_WEDGES + 1:
+    return
+
+  def is_summed(column):
+    return is_numeric(pie_data[column]) and not pandas.api.types.is_bool_dtype(
+        pie_data[column]
+    )
+
+  # Wedges sharing a color are drawn as one, so group them first.
+  wedges = pie_data
+  if not colors.is_unique:
+    wedges = pie_data.groupby(
+        color_column, sort=False, dropna=False, observed=True
+    ).agg({
+        column: 'sum' if is_summed(column) else 'first'
+        for column in pie_data.columns
+        if column != color_column
+    }).reset_index()[pie_data.columns]
+
+  # Keep the `MAX_PIE_WEDGES` - 1 largest wedges, in descending order, without
+  # sorting all of them. NaNs count as the smallest wedges.
+  theta = wedges[theta_column].to_numpy(dtype=float, na_value=np.nan)
+  sort_keys = np.where(np.isnan(theta), np.inf, -theta)
+  largest = np.argpartition(sort_keys, MAX_PIE_WEDGES - 2)[: MAX_PIE_WEDGES - 1]
+  largest = largest[np.argsort(sort_keys[largest], kind='stable')]
+  rest = np.ones(len(wedges), dtype=bool)
+  rest[largest] = False
+
+  # Sum the numeric fields of the remaining wedges into a single "Other" wedge.
+  summed_columns = [
+      column
+      for column in wedges.columns
+      if column != color_column and is_summed(column)
+  ]
+  rest_wedges = wedges.loc[rest, summed_columns]
+  other = {column: rest_wedges[column].sum() for column in summed_columns}
+  for column in wedges.columns:
+    # Label columns may have been stored as categories by compact_string_columns
+    if (
+        column == color_column
+        or pandas.api.types.is_object_dtype(wedges[column])
+        or is_string_category_column(wedges[column])
+    ):
+      other[column] = 'Other'
+  merged = pd.concat(
+      [wedges.iloc[largest], pd.DataFrame([other])],
+      ignore_index=True,
+  )
+
+  # Replace pie_data with merged in place. Rows are dropped by position, as
+  # index labels may repeat (e.g. after concatenating DataFrames).
+  pie_data.reset_index(drop=True, inplace=True)
+  pie_data.drop(pie_data.index[len(merged):], inplace=True)
+  pie_data.index = merged.index
+  for column in pie_data.columns:
+    pie_data[column] = merged[column]
+
+
 def remove_extra_wedges(
     layers: list[tuple[alt.TopLevelMixin, pd.DataFrame]],
 ) -> None:
@@ -526,34 +659,7 @@ def remove_extra_wedges(
   ):
     return
 
-  # Get the number of unique wedges in the pie chart based on the "color" field
-  num_wedges = pie_data[color_column].nunique()
-
-  # Return if the number of wedges is less than `MAX_PIE_WEDGES` + 1
-  if num_wedges < MAX_PIE_WEDGES + 1:
-    return
-
-  # Sort the `data` in descending order of `theta_column` and keep the first
-  # `MAX_PIE_WEDGES` - 1 rows.
-  sorted_df = pie_data.sort_values(
-      by=theta_column, ascending=False
-  ).reset_index(drop=True)
-  subset_df = sorted_df.head(MAX_PIE_WEDGES - 1)
-  # Aggregate remaining rows into a single row.
-  aggregated_row = sorted_df.iloc[MAX_PIE_WEDGES - 1 :].sum()
-  # Replace object/str type fields with "Other".
-  aggregated_row = aggregated_row.apply(
-      lambda x: 'Other' if isinstance(x, str) else x
-  )
-  aggregated_row.name = 'Aggregated'
-  new_data = pd.concat(
-      [subset_df, aggregated_row.to_frame().T], ignore_index=True
-  ).reset_index(drop=True)
-
-  # Replace pie_data with new_data in place.
-  pie_data.update(new_data)
-  # Update will only replace as many rows as are in new_data, so drop the rest.
-  pie_data.drop(range(len(new_data), len(pie_data)), inplace=True)
+  merge_extra_wedges(pie_data, theta_column, color_column)
 
 
 def maybe_make_bar_or_box_chart_horizontal(
@@ -681,136 +787,330 @@ def match_bar_grouping_with_orientation(chart: alt.TopLevelMixin) -> None:
         chart.encoding.row.header.labelOrient = 'left'
 
 
-def maybe_update_types_and_formats(
-    layers: list[tuple[alt.TopLevelMixin, pd.DataFrame]],
-) -> None:
-  """Corrects type and updates format of mis-types fields in `chart`.
+def is_string_category_column(column):
+  """True if `column` is a categorical of strings (see compact_string_columns)."""
+  return isinstance(
+      column.dtype, pd.CategoricalDtype
+  ) and pd.api.types.is_object_dtype(column.cat.categories)
 
-  Args:
-    layers: Flattened list of all layers in a chart as (chart object, DataFrame)
-      tuples.
-  """
-  # Do not try to change the data type of any field in heat maps. Heatmaps do
-  # not support continuous axes values, and converting strings into continuous
-  # values is basically all we are doing here.
-  deny_list_mark_types = {'rect'}
-  for layer, _ in layers:
-    if get_mark_type(layer) in deny_list_mark_types:
-      return
 
-  def is_not_string_column(column):
-    return column.dtype != 'object' and column.dtypes != pd.StringDtype()
+def is_not_string_column(column):
+  """True if `column` holds neither python nor pandas strings."""
+  return (
+      column.dtype != 'object'
+      and column.dtypes != pd.StringDtype()
+      and not is_string_category_column(column)
+  )
 
-  def convert_date(column):
-    """Attempt to convert column to datetime."""
-    if is_datetime(column):
-      # If column is date time, do nothing
-      return None, None, None
-    try:
-      if is_numeric(column):
-        # Make sure the first value looks like a year before trying to convert
-        # them all to years.
-        pd.to_datetime(column[0], errors='raise', format='%Y')
+
+def convert_date(column):
+  """Attempt to convert column to datetime."""
+  if is_datetime(column):
+    # If column is date time, do nothing
+    return None, None, None
+  try:
+    if is_numeric(column):
+      # Make sure the first value looks like a year before trying to convert
+      # them all to years.
+      pd.to_datetime(column[0], errors='raise', format='%Y')
+      return (
+          pd.to_datetime(column, errors='raise', format='%Y'),
+          'temporal',
+          '%Y',
+      )
+    else:
+      datetime_format = guess_datetime_format(column[0])
+      if datetime_format:
         return (
-            pd.to_datetime(column, errors='raise', format='%Y'),
+            pd.to_datetime(column, errors='raise', format=datetime_format),
             'temporal',
-            '%Y',
+            datetime_format,
         )
-      else:
-        datetime_format = guess_datetime_format(column[0])
-        if datetime_format:
-          return (
-              pd.to_datetime(column, errors='raise', format=datetime_format),
-              'temporal',
-              datetime_format,
-          )
-    except ValueError:
-      return None, None, None
+  except ValueError:
     return None, None, None
+  return None, None, None
 
-  def convert_number(column):
-    """Attempt to convert column to float."""
-    if is_not_string_column(column):
-      # If column is numerical, do nothing
-      return None, None, None
-    try:
-      float_column = column.astype(float)
-      return float_column, 'quantitative', None
-    except ValueError:
-      return None, None, None
 
-  def convert_currency(column):
-    """Attempt to convert column with leading currency symbol to float."""
-    if is_not_string_column(column):
-      # If columns is not a string, do nothing
-      return None, None, None
-    # If any non-empty values of column don't contain currency, do nothing.
-    currency_regex = r'(?:^\s*(\$|€|£|¥))|(?:(\$|€|£|¥)\s*$)'
-    regex_searches = []
-    for value in column.dropna().astype(str):
-      search = re.search(currency_regex, value)
-      if not search:
-        return None, None, None
-      regex_searches.append(search)
-    # If more than one currency symbol is featured, do nothing. (We can't format
-    # them consistently otherwise.)
-    currencies = set()
-    for search in regex_searches:
-      if search is None:
-        continue
-      if search.group(1) is not None:  # Currency symbol before number
-        currencies.add(search.group(1))
-      elif search.group(2) is not None:  # Currency symbol after number
-        currencies.add(search.group(2))
-    if len(currencies) != 1:
-      return None, None, None
-    currency = list(currencies)[0]
-    try:
-      column = (
-          column.astype(str)
-          .str.replace(currency_regex, '', regex=True)
-          .astype(float)
-      )
-      return column, 'quantitative', '{}.2f'.format(currency)
-    except ValueError:
+def convert_number(column):
+  """Attempt to convert column to float."""
+  if is_not_string_column(column):
+    # If column is numerical, do nothing
+    return None, None, None
+  try:
+    float_column = column.astype(float)
+    return float_column, 'quantitative', None
+  except ValueError:
+    return None, None, None
+
+
+def convert_currency(column):
+  """Attempt to convert column with leading currency symbol to float."""
+  if is_not_string_column(column):
+    # If columns is not a string, do nothing
+    return None, None, None
+  # If any non-empty values of column don't contain currency, do nothing.
+  regex_searches = []
+  for value in column.dropna().astype(str):
+    search = re.search(CURRENCY_REGEX, value)
+    if not search:
       return None, None, None
+    regex_searches.append(search)
+  # If more than one currency symbol is featured, do nothing. (We can't format
+  # them consistently otherwise.)
+  currencies = set()
+  for search in regex_searches:
+    if search is None:
+      continue
+    if search.group(1) is not None:  # Currency symbol before number
+      currencies.add(search.group(1))
+    elif search.group(2) is not None:  # Currency symbol after number
+      currencies.add(search.group(2))
+  if len(currencies) != 1:
+    return None, None, None
+  currency = list(currencies)[0]
+  try:
+    column = (
+        column.astype(str)
+        .str.replace(CURRENCY_REGEX, '', regex=True)
+        .astype(float)
+    )
+    return column, 'quantitative', '{}.2f'.format(currency)
+  except ValueError:
+    return None, None, None
+
 
-  def convert_percentage(column):
-    if is_not_string_column(column):
-      # If columns is not a string, do nothing
+def convert_percentage(column):
+  """Attempt to convert column with trailing percent sign to float."""
+  if is_not_string_column(column):
+    # If columns is not a string, do nothing
+    return None, None, None
+  # If any non-empty values of column don't contain percentages, do nothing.
+  for value in column.dropna().astype(str):
+    if not re.search(PERCENT_REGEX, value):
       return None, None, None
-    # If any non-empty values of column don't contain percentages, do nothing.
-    percent_regex = r'\s*%$'
-    for value in column.dropna().astype(str):
-      if not re.search(percent_regex, value):
-        return None, None, None
-    try:
-      column = (
-          column.astype(str)
-          .str.replace(percent_regex, '', regex=True)
-          .astype(float)
-          / 100
+  try:
+    column = (
+        column.astype(str)
+        .str.replace(PERCENT_REGEX, '', regex=True)
+        .astype(float)
+        / 100
+    )
+    return column, 'quantitative', '%'
+  except ValueError:
+    return None, None, None
+
+
+def encode_strings(column: pd.Series) -> Union['pa.DictionaryArray', None]:
+  """Dictionary-encodes a column of strings as an Arrow array.
+
+  Returns None if pyarrow isn't installed, or if `column` holds anything but
+  strings (including missing values, which the pandas converters treat
+  differently).
+  """
+  if pa is None or is_not_string_column(column):
+    return None
+  if is_string_category_column(column):
+    # Only keep the categories that are actually used.
+    column = column.cat.remove_unused_categories()
+  try:
+    strings = pa.array(column, type=pa.string())
+  except (pa.ArrowInvalid, pa.ArrowTypeError):
+    return None
+  if strings.null_count:
+    return None
+  return strings.dictionary_encode()
+
+
+def count_distinct(
+    column: pd.Series, encoded: Union['pa.DictionaryArray', None]
+) -> int:
+  """Number of distinct non-missing values in `column`."""
+  if encoded is not None:
+    return len(encoded.dictionary)
+  return column.nunique()
+
+
+def expand_dictionary(
+    column: pd.Series, encoded: 'pa.DictionaryArray', values: 'pa.Array'
+) -> pd.Series:
+  """Column of `values` (one per dictionary entry) in the order of `column`."""
+  return pd.Series(
+      values.take(encoded.indices).to_numpy(zero_copy_only=False),
+      index=column.index,
+      name=column.name,
+  )
+
+
+def parse_floats(
+    strings: 'pa.StringArray', chunk_size: int = 1024
+) -> 'pa.DoubleArray':
+  """Parses `strings` the same way python's `float` does.
+
+  Raises:
+    ValueError: If any of the strings isn't a number.
+  """
+  try:
+    return pc.cast(strings, pa.float64())
+  except pa.ArrowInvalid:
+    # Arrow is stricter than python (e.g. about surrounding whitespace), so let
+    # python decide. Chunks keep failing columns from being copied whole.
+    chunks = [
+        pa.array(
+            [float(value) for value in strings.slice(i, chunk_size).to_pylist()],
+            pa.float64(),
+        )
+        for i in range(0, len(strings), chunk_size)
+    ]
+    return pa.concat_arrays(chunks)
+
+
+def convert_encoded_number(column, encoded):
+  """`convert_number` that parses each distinct string once, with Arrow."""
+  try:
+    numbers = parse_floats(encoded.dictionary)
+  except ValueError:
+    return None, None, None
+  return expand_dictionary(column, encoded, numbers), 'quantitative', None
+
+
+def convert_encoded_currency(column, encoded):
+  """`convert_currency` that runs on the distinct strings, with Arrow."""
+  values = encoded.dictionary
+  if not pc.all(pc.match_substring_regex(values, ARROW_CURRENCY_REGEX)).as_py():
+    return None, None, None
+  # Only one of the groups matches, the other one is empty.
+  symbols = pc.extract_regex(values, ARROW_CURRENCY_REGEX)
+  currencies = pc.unique(
+      pc.binary_join_element_wise(
+          symbols.field('before'), symbols.field('after'), ''
       )
-      return column, 'quantitative', '%'
-    except ValueError:
-      return None, None, None
+  )
+  if len(currencies) != 1:
+    return None, None, None
+  try:
+    numbers = parse_floats(
+        pc.replace_substring_regex(values, ARROW_CURRENCY_REGEX, '')
+    )
+  except ValueError:
+    return None, None, None
+  return (
+      expand_dictionary(column, encoded, numbers),
+      'quantitative',
+      '{}.2f'.format(currencies[0].as_py()),
+  )
+
+
+def convert_encoded_percentage(column, encoded):
+  """`convert_percentage` that runs on the distinct strings, with Arrow."""
+  values = encoded.dictionary
+  if not pc.all(pc.match_substring_regex(values, ARROW_PERCENT_REGEX)).as_py():
+    return None, None, None
+  try:
+    numbers = parse_floats(
+        pc.replace_substring_regex(values, ARROW_PERCENT_REGEX, '')
+    )
+  except ValueError:
+    return None, None, None
+  fractions = pc.divide(numbers, 100.0)
+  return expand_dictionary(column, encoded, fractions), 'quantitative', '%'
 
-  def try_convert_data(field, data):
-    """Run the various conversion functions in the order specified."""
 
-    # Each conversion function should return the modified data, the new data
-    # type, and the new format. If no change is made, returns None for each.
+def try_convert_data(field, data, encoded=None):
+  """Run the various conversion functions in the order specified.
+
+  Args:
+    field: Column of `data` to convert.
+    data: DataFrame holding the column.
+    encoded: The column as returned by `encode_strings`, if already computed.
+      Columns of strings are converted from their distinct values, with Arrow
+      compute kernels; anything else goes through pandas.
+
+  Returns:
+    The converted column, its new Vega-Lite type and its new format, or None
+    for each if no conversion applies.
+  """
+  column = data[field]
+  if encoded is None:
+    encoded = encode_strings(column)
+  if encoded is None and is_string_category_column(column):
+    column = column.astype(object)
+
+  # Each conversion function should return the modified data, the new data
+  # type, and the new format. If no change is made, returns None for each.
+  # pd.to_datetime already parses each distinct date only once.
+  if encoded is None:
     conversion_functions = [
         convert_date,
         convert_number,
         convert_currency,
         convert_percentage,
     ]
-    for func in conversion_functions:
-      fixed_data, data_type, new_format = func(data[field])
-      if data_type:
-        return fixed_data, data_type, new_format
-    return None, None, None
+  else:
+    conversion_functions = [convert_date] + [
+        functools.partial(func, encoded=encoded)
+        for func in [
+            convert_encoded_number,
+            convert_encoded_currency,
+            convert_encoded_percentage,
+        ]
+    ]
+  for func in conversion_functions:
+    fixed_data, data_type, new_format = func(column)
+    if data_type:
+      return fixed_data, data_type, new_format
+  return None, None, None
+
+
+def infer_field_conversion(
+    field: str,
+    data: pd.DataFrame,
+    shared_cache: Union['SharedDataCache', None] = None,
+) -> tuple[Any, Any, Any]:
+  """Profiles `field` and picks the conversion its values need, if any.
+
+  Args:
+    field: Column of `data` to profile.
+    data: DataFrame holding the column.
+    shared_cache: Cache to reuse the decision of an identical column from.
+
+  Returns:
+    The converted column, its new type and its new format (see
+    `try_convert_data`), or None for each.
+  """
+
+  def infer():
+    # Strings are converted to Arrow once, for both counting and converting.
+    encoded = encode_strings(data[field])
+    if (
+        count_distinct(data[field], encoded)
+        < MIN_POINTS_NEEDED_FOR_TYPE_CONVERSION
+    ):
+      return None, None, None
+    return try_convert_data(field, data, encoded)
+
+  if shared_cache is None:
+    return infer()
+  return shared_cache.conversion(data[field], infer)
+
+
+def maybe_update_types_and_formats(
+    layers: list[tuple[alt.TopLevelMixin, pd.DataFrame]],
+    shared_cache: Union['SharedDataCache', None] = None,
+) -> None:
+  """Corrects type and updates format of mis-types fields in `chart`.
+
+  Args:
+    layers: Flattened list of all layers in a chart as (chart object, DataFrame)
+      tuples.
+    shared_cache: Cache of type-inference decisions shared with other charts.
+  """
+  # Do not try to change the data type of any field in heat maps. Heatmaps do
+  # not support continuous axes values, and converting strings into continuous
+  # values is basically all we are doing here.
+  deny_list_mark_types = {'rect'}
+  for layer, _ in layers:
+    if get_mark_type(layer) in deny_list_mark_types:
+      return
 
   # Keep track of all fields (in a specific DataFrame) that need converting, and
   # the new dataframe column, new type name and new format for each of them.
@@ -841,13 +1141,13 @@ def maybe_update_types_and_formats(
         continue
       field = variable.field
 
-      if data[field].nunique() < MIN_POINTS_NEEDED_FOR_TYPE_CONVERSION:
-        continue
       # Check if we already marked `field` in `data` to be converted.
       if already_found_field(field, data, fields_to_convert):
         continue
 
-      new_column, new_type, new_format = try_convert_data(field, data)
+      new_column, new_type, new_format = infer_field_conversion(
+          field, data, shared_cache
+      )
       if new_type:
         fields_to_convert.append(
             (field, data, new_column, new_type, new_format)
@@ -995,44 +1295,680 @@ def maybe_remove_heatmap_labels(
     layered_chart.layer.remove(text_layer)
 
 
-def post_process_chart(chart: alt.TopLevelMixin) -> None:
-  """Calls all custom Vega-Lite post-processing, altering `chart`."""
+def collect_referenced_fields(spec: Any, fields: set[str]) -> bool:
+  """Adds every field that `spec` might reference to `fields`.
+
+  Rather than tracking every place Vega-Lite accepts a field (encodings, sort,
+  tooltips, transforms, selections, repeat, ...), this over-approximates: every
+  string outside of the chart data counts as a reference. Expression strings
+  are also scanned for `datum` references.
+
+  Args:
+    spec: Vega-Lite dict (or any value nested in one).
+    fields: Running set of referenced fields.
+
+  Returns:
+    False if `spec` may reference fields we can't detect (e.g. tooltips showing
+    every data field, or `datum` used in an unrecognized way).
+  """
+  if isinstance(spec, dict):
+    if spec.get('content') == 'data':  # Tooltip showing every data field.
+      return False
+    for key, value in spec.items():
+      if key in {'data', 'datasets'}:
+        continue
+      if not collect_referenced_fields(value, fields):
+        return False
+  elif isinstance(spec, list):
+    for value in spec:
+      if not collect_referenced_fields(value, fields):
+        return False
+  elif isinstance(spec, str):
+    fields.add(spec)
+    # Escaped dots and brackets are part of a flat column name, unescaped ones
+    # access a nested field (whose root is the column).
+    fields.add(spec.replace('\\', ''))
+    fields.add(re.split(r'(?<!\\)[.\[]', spec)[0])
+    num_datum = len(DATUM_REGEX.findall(spec))
+    if num_datum:
+      references = DATUM_REFERENCE_REGEX.findall(spec)
+      if len(references) != num_datum:
+        return False
+      for name, _, quoted_name in references:
+        fields.add(name or quoted_name)
+  return True
+
+
+def chart_to_dict_with_empty_data(chart: alt.TopLevelMixin) -> dict[str, Any]:
+  """Serializes `chart` with every DataFrame in it (nested ones too) emptied.
+
+  The result has the full structure of the chart (encodings, transforms...)
+  without paying for serializing its rows.
+  """
+  emptied = []
+
+  def empty_data(node):
+    if has_defined_attr(node, 'data') and isinstance(node.data, pd.DataFrame):
+      emptied.append((node, node.data))
+      # Keeps the dtypes, which altair infers encoding types from.
+      node.data = node.data.iloc[:0]
+    for attr in ['layer', 'hconcat', 'vconcat', 'concat']:
+      if has_defined_attr(node, attr):
+        for nested_chart in getattr(node, attr):
+          empty_data(nested_chart)
+    if has_defined_attr(node, 'spec'):
+      empty_data(node.spec)
+
+  try:
+    empty_data(chart)
+    return chart.to_dict()
+  finally:
+    for node, data in emptied:
+      node.data = data
+
+
+def estimate_serialized_size(data: pd.DataFrame) -> int:
+  """Estimates the size of `data` once serialized as inline Vega-Lite values."""
+  if data.empty:
+    return 0
+  sample = data.head(ROWS_SAMPLED_FOR_SIZE_ESTIMATE)
+  sample_size = len(
+      sample.to_json(orient='records', date_format='iso', double_precision=15)
+  )
+  return int(sample_size * len(data) / len(sample))
+
+
+def prune_unused_columns(
+    spec: dict[str, Any], frames: list[Union[pd.DataFrame, Any]]
+) -> int:
+  """Drops the columns of `frames` that `spec` never references.
+
+  Charts from generated code often carry the whole source DataFrame even though
+  only a few of its columns are encoded, and all of it gets serialized into the
+  spec we render.
+
+  Args:
+    spec: Vega-Lite dict of the chart (e.g. from `chart.to_dict()`), used to
+      find referenced fields.
+    frames: DataFrames referenced by the chart, pruned in place. Anything that
+      isn't a DataFrame is skipped.
+
+  Returns:
+    Estimated number of bytes saved in the serialized spec.
+  """
+  fields = set()
+  if not collect_referenced_fields(spec, fields):
+    return 0
+
+  bytes_saved = 0
+  pruned_frames = set()
+  for data in frames:
+    if not isinstance(data, pd.DataFrame) or id(data) in pruned_frames:
+      continue
+    pruned_frames.add(id(data))
+    unused_columns = [
+        column for column in data.columns if str(column) not in fields
+    ]
+    if unused_columns and len(unused_columns) == len(data.columns):
+      # Charts encoding no field (e.g. only `count()`) still count the rows,
+      # which a frame without columns would lose, so keep the narrowest one.
+      narrowest = min(
+          range(len(unused_columns)),
+          key=lambda i: estimate_serialized_size(data.iloc[:, [i]]),
+      )
+      del unused_columns[narrowest]
+    if not unused_columns:
+      continue
+    bytes_saved += estimate_serialized_size(data[unused_columns])
+    data.drop(columns=unused_columns, inplace=True)
+  return bytes_saved
+
+
+def compact_string_columns(frames: list[Union[pd.DataFrame, Any]]) -> int:
+  """Stores the low-cardinality string columns of `frames` as categories.
+
+  Generated code often keeps labels as object columns, with one python object
+  per row for a handful of distinct values. The processors treat categorical
+  string columns like the object ones, and they serialize to the same values.
+  Columns with missing values are left alone, since the type conversions treat
+  None and NaN differently.
+
+  Args:
+    frames: DataFrames to compact in place. Anything that isn't a DataFrame is
+      skipped.
+
+  Returns:
+    Number of bytes of (deep) memory usage saved.
+  """
+  bytes_saved = 0
+  compacted_frames = set()
+  for data in frames:
+    if (
+        not isinstance(data, pd.DataFrame)
+        or id(data) in compacted_frames
+        or len(data) < MIN_ROWS_FOR_CATEGORIES
+    ):
+      continue
+    compacted_frames.add(id(data))
+    for i in range(len(data.columns)):
+      values = data.iloc[:, i]
+      if (
+          values.dtype != 'object'
+          or pd.api.types.infer_dtype(values, skipna=False) != 'string'
+          or values.nunique() > MAX_CATEGORY_RATIO * len(values)
+      ):
+        continue
+      categories = values.astype('category')
+      bytes_saved += values.memory_usage(
+          index=False, deep=True
+      ) - categories.memory_usage(index=False, deep=True)
+      data.isetitem(i, categories)
+  return bytes_saved
+
+
+@dataclasses.dataclass
+class ProcessorStats:
+  """What one post-processor did over a chart (summed over its calls)."""
+
+  calls: int = 0
+  seconds: float = 0.0
+  # Number of calls that changed the chart.
+  changes: int = 0
+  # Exception type name -> number of calls that raised it.
+  exceptions: collections.Counter[str] = dataclasses.field(
+      default_factory=collections.Counter
+  )
+
+
+@dataclasses.dataclass
+class PostProcessingReport:
+  """What post-processing did to a chart.
+
+  Per-processor stats are only recorded when post-processing is instrumented.
+  """
+
+  bytes_pruned: int = 0
+  # Reduction of the (deep) memory usage of the chart's DataFrames from
+  # storing string columns as categories.
+  bytes_compacted: int = 0
+  instrumented: bool = False
+  # Processor name -> stats, in the order the processors first ran.
+  processors: dict[str, ProcessorStats] = dataclasses.field(
+      default_factory=dict
+  )
+
+  @property
+  def seconds(self) -> float:
+    return sum(stats.seconds for stats in self.processors.values())
+
+  @property
+  def changed(self) -> bool:
+    return any(stats.changes for stats in self.processors.values())
+
+  @property
+  def exceptions(self) -> collections.Counter[str]:
+    """Exception type name -> count, over all processors."""
+    counts = collections.Counter()
+    for stats in self.processors.values():
+      counts.update(stats.exceptions)
+    return counts
+
+  def record(
+      self,
+      name: str,
+      seconds: float,
+      exception: Union[Exception, None],
+      changed: bool,
+  ) -> None:
+    stats = self.processors.setdefault(name, ProcessorStats())
+    stats.calls += 1
+    stats.seconds += seconds
+    stats.changes += changed
+    if exception is not None:
+      stats.exceptions[type(exception).__name__] += 1
+
+  def summary(self) -> str:
+    lines = []
+    for name, stats in self.processors.items():
+      line = f'{name}: {stats.seconds * 1000:.1f}ms'
+      if stats.changes:
+        line += ', changed chart'
+      if stats.exceptions:
+        line += ', raised ' + ', '.join(
+            f'{exception} x{count}'
+            for exception, count in stats.exceptions.items()
+        )
+      lines.append(line)
+    return '\n'.join(lines)
+
+
+class PostProcessingMetrics:
+  """Running per-processor counters and duration histograms over many charts.
+
+  Feed it instrumented reports with `observe`.
+  """
+
+  def __init__(self):
+    self.charts = 0
+    self.calls = collections.Counter()
+    self.changes = collections.Counter()
+    # (processor name, exception type name) -> count.
+    self.exceptions = collections.Counter()
+    # Processor name -> counts per `PROCESSOR_SECONDS_BUCKETS` bucket.
+    self.histograms = collections.defaultdict(
+        lambda: [0] * len(PROCESSOR_SECONDS_BUCKETS)
+    )
+
+  def observe(self, report: PostProcessingReport) -> None:
+    self.charts += 1
+    for name, stats in report.processors.items():
+      self.calls[name] += stats.calls
+      self.changes[name] += stats.changes
+      for exception, count in stats.exceptions.items():
+        self.exceptions[(name, exception)] += count
+      bucket = next(
+          i
+          for i, upper_bound in enumerate(PROCESSOR_SECONDS_BUCKETS)
+          if stats.seconds <= upper_bound
+      )
+      self.histograms[name][bucket] += 1
+
+  def summary(self) -> str:
+    bucket_names = [
+        f'<={upper_bound}s' if upper_bound != math.inf else '>10s'
+        for upper_bound in PROCESSOR_SECONDS_BUCKETS
+    ]
+    lines = [f'{self.charts} charts']
+    for name, histogram in self.histograms.items():
+      exceptions = sum(
+          count
+          for (processor, _), count in self.exceptions.items()
+          if processor == name
+      )
+      buckets = ' '.join(
+          f'{bucket_name}:{count}'
+          for bucket_name, count in zip(bucket_names, histogram)
+          if count
+      )
+      lines.append(
+          f'{name}: {self.calls[name]} calls, {self.changes[name]} changed,'
+          f' {exceptions} raised, [{buckets}]'
+      )
+    return '\n'.join(lines)
+
+
+def frame_fingerprint(data: Any) -> tuple[Any, ...]:
+  """Cheap summary that changes whenever a processor modifies `data`.
+
+  Every data-modifying processor either renames columns, changes a column's
+  dtype, or changes the number of rows.
+  """
+  if not isinstance(data, pd.DataFrame):
+    return ()
+  return (tuple(data.columns), tuple(data.dtypes), len(data))
+
+
+def run_processor(
+    report: Union[PostProcessingReport, None],
+    fingerprint: Callable[[], Any],
+    name: str,
+    fn: Callable[..., Any],
+    *args,
+) -> None:
+  """Calls `fn(*args)`, swallowing any exception.
+
+  Args:
+    report: If given, records the call's wall time, exception and whether it
+      changed the chart.
+    fingerprint: Returns a summary of the chart that changes whenever it is
+      modified. Only called when `report` is given.
+    name: Name of the processor, for the report.
+    fn: Processor to call.
+    *args: Arguments of `fn`.
+  """
+  if report is None:
+    try:
+      fn(*args)
+    except Exception:  # pylint: disable=broad-exception-caught
+      pass
+    return
+
+  before = fingerprint()
+  exception = None
+  start = time.perf_counter()
+  try:
+    fn(*args)
+  except Exception as e:  # pylint: disable=broad-exception-caught
+    exception = e
+  seconds = time.perf_counter() - start
+  report.record(name, seconds, exception, fingerprint() != before)
+
+
+def column_content_key(column: pd.Series) -> Union[str, None]:
+  """Hash of the name, dtype, index and values of `column`.
+
+  Returns None if the values can't be hashed (e.g. lists).
+  """
+  try:
+    hashes = pd.util.hash_pandas_object(column, index=True).to_numpy()
+  except TypeError:
+    return None
+  digest = hashlib.blake2b(hashes.tobytes(), digest_size=16)
+  digest.update(repr((column.name, str(column.dtype))).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def frame_content_key(data: pd.DataFrame) -> Union[str, None]:
+  """Hash of the columns, dtypes, index and values of `data`."""
+  try:
+    hashes = pd.util.hash_pandas_object(data, index=True).to_numpy()
+  except TypeError:
+    return None
+  digest = hashlib.blake2b(hashes.tobytes(), digest_size=16)
+  digest.update(repr(list(data.dtypes.astype(str).items())).encode('utf-8'))
+  return digest.hexdigest()
+
+
+@dataclasses.dataclass
+class SharedDataStats:
+  frames_parsed: int = 0
+  frames_reused: int = 0
+  conversions_inferred: int = 0
+  conversions_reused: int = 0
+
+
+class SharedDataCache:
+  """Work shared between charts that read the same data.
+
+  Charts in one turn (or one conversation) often plot the same uploaded
+  dataset. Data is recognized by identity first and by content hash otherwise,
+  so each distinct dataset is parsed once (every chart still gets its own
+  copy to modify), and each distinct column is profiled and type-inferred
+  once. Pass one cache to several `post_process_charts` / `post_process_specs`
+  calls to share across them; it holds on to the data it has seen, so use one
+  per conversation rather than one per process.
+  """
+
+  def __init__(self):
+    self.stats = SharedDataStats()
+    self._keys_by_id = {}
+    self._frames = {}
+    self._conversions = {}
+
+  def key(self, obj: Any, compute_key: Callable[[], Any]) -> Any:
+    """Content key of `obj`, computed only once per object."""
+    if id(obj) not in self._keys_by_id:
+      # Holding on to `obj` keeps its id from being reused.
+      self._keys_by_id[id(obj)] = (obj, compute_key())
+    return self._keys_by_id[id(obj)][1]
+
+  def frame(self, key: Any, parse: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """A copy of the DataFrame stored under `key`, parsed on first use."""
+    if key is None:
+      return parse()
+    if key in self._frames:
+      self.stats.frames_reused += 1
+    else:
+      self._frames[key] = parse()
+      self.stats.frames_parsed += 1
+    return self._frames[key].copy()
+
+  def conversion(
+      self, column: pd.Series, infer: Callable[[], tuple[Any, Any, Any]]
+  ) -> tuple[Any, Any, Any]:
+    """`infer()` for `column`, reused for any identical column."""
+    # Frames are copied per chart, so columns can only match by content.
+    key = column_content_key(column)
+    if key is None:
+      return infer()
+    if key in self._conversions:
+      self.stats.conversions_reused += 1
+    else:
+      self._conversions[key] = infer()
+      self.stats.conversions_inferred += 1
+    return self._conversions[key]
+
+  def summary(self) -> str:
+    return (
+        f'{self.stats.frames_parsed} datasets parsed,'
+        f' {self.stats.frames_reused} reused;'
+        f' {self.stats.conversions_inferred} columns type-inferred,'
+        f' {self.stats.conversions_reused} reused'
+    )
+
+
+def group_items_sharing_data(item_keys: list[set[Any]]) -> list[list[int]]:
+  """Groups the indices of items whose sets of data keys overlap."""
+  parents = list(range(len(item_keys)))
+
+  def root(i):
+    while parents[i] != i:
+      parents[i] = parents[parents[i]]
+      i = parents[i]
+    return i
+
+  first_item_with_key = {}
+  for i, keys in enumerate(item_keys):
+    for key in keys:
+      if key in first_item_with_key:
+        parents[root(i)] = root(first_item_with_key[key])
+      else:
+        first_item_with_key[key] = i
+  groups = collections.defaultdict(list)
+  for i in range(len(item_keys)):
+    groups[root(i)].append(i)
+  return list(groups.values())
+
+
+def map_groups_in_processes(
+    fn: Callable[..., list[Any]],
+    groups: list[list[Any]],
+    num_processes: int,
+    *args: Any,
+) -> Union[list[list[Any]], None]:
+  """Returns `[fn(group, *args) for group in groups]`, computed in processes.
+
+  Worker processes are forked, so scripts without a `__main__` guard aren't
+  re-imported. Returns None if forking isn't available on this platform.
+  """
+  if 'fork' not in multiprocessing.get_all_start_methods():
+    return None
+  context = multiprocessing.get_context('fork')
+  with context.Pool(min(num_processes, len(groups))) as pool:
+    return pool.starmap(fn, [(group, *args) for group in groups])
+
+
+def chart_data_frames(chart: Any) -> list[pd.DataFrame]:
+  """Every DataFrame in `chart`, including those of nested charts."""
+  frames = []
+  if has_defined_attr(chart, 'data') and isinstance(chart.data, pd.DataFrame):
+    frames.append(chart.data)
+  for attr in ['layer', 'hconcat', 'vconcat', 'concat']:
+    if has_defined_attr(chart, attr):
+      for nested_chart in getattr(chart, attr):
+        frames.extend(chart_data_frames(nested_chart))
+  if has_defined_attr(chart, 'spec'):
+    frames.extend(chart_data_frames(chart.spec))
+  return frames
+
+
+def post_process_chart_group(
+    charts: list[alt.TopLevelMixin], prune_columns: bool, instrument: bool
+) -> list[tuple[alt.TopLevelMixin, PostProcessingReport]]:
+  """Post-processes `charts` (in a worker process) with one shared cache."""
+  shared_cache = SharedDataCache()
+  return [
+      (chart, post_process_chart(chart, prune_columns, instrument, shared_cache))
+      for chart in charts
+  ]
+
+
+def post_process_charts(
+    charts: list[alt.TopLevelMixin],
+    prune_columns: bool = True,
+    instrument: bool = False,
+    shared_cache: Union[SharedDataCache, None] = None,
+    num_processes: int = 1,
+) -> list[PostProcessingReport]:
+  """Post-processes a batch of charts, sharing work on the data they share.
+
+  Args:
+    charts: Top-level Altair charts, altered in place.
+    prune_columns: Whether to drop data columns the charts never reference.
+    instrument: Whether to record per-processor timings in the reports.
+    shared_cache: Cache to share with other batches (e.g. earlier turns of the
+      conversation). A new one is used by default.
+    num_processes: If more than 1, groups of charts that share no data are
+      post-processed in that many processes. Charts sharing data always stay
+      in the same group, which shares its own cache (`shared_cache` is only
+      used in this process).
+
+  Returns:
+    Report of each chart's post-processing, in order.
+  """
+  if shared_cache is None:
+    shared_cache = SharedDataCache()
+
+  if num_processes > 1 and len(charts) > 1:
+    chart_keys = [
+        {
+            shared_cache.key(data, functools.partial(frame_content_key, data))
+            or id(data)
+            for data in chart_data_frames(chart)
+        }
+        for chart in charts
+    ]
+    groups = group_items_sharing_data(chart_keys)
+    results = None
+    if len(groups) > 1:
+      results = map_groups_in_processes(
+          post_process_chart_group,
+          [[charts[i] for i in group] for group in groups],
+          num_processes,
+          prune_columns,
+          instrument,
+      )
+    if results is not None:
+      reports = [None] * len(charts)
+      for group, group_results in zip(groups, results):
+        for i, (processed_chart, report) in zip(group, group_results):
+          # Charts come back as copies, so carry their state over.
+          charts[i].__dict__.update(processed_chart.__dict__)
+          reports[i] = report
+      return reports
+
+  return [
+      post_process_chart(chart, prune_columns, instrument, shared_cache)
+      for chart in charts
+  ]
+
+
+def layer_fingerprint(layer: alt.TopLevelMixin) -> str:
+  """Serialization of a non-nested chart, leaving out its data."""
+  kwds = {key: value for key, value in layer._kwds.items() if key != 'data'}  # pylint: disable=protected-access
+  return json.dumps(
+      alt.utils.schemapi._todict(kwds, validate=False, context={}),  # pylint: disable=protected-access
+      sort_keys=True,
+      default=str,
+  )
+
+
+def post_process_chart(
+    chart: alt.TopLevelMixin,
+    prune_columns: bool = True,
+    instrument: bool = False,
+    shared_cache: Union[SharedDataCache, None] = None,
+    compact_columns: bool = True,
+) -> PostProcessingReport:
+  """Calls all custom Vega-Lite post-processing, altering `chart`.
+
+  Args:
+    chart: Top-level Altair chart to post-process.
+    prune_columns: Whether to drop data columns the chart never references.
+    instrument: Whether to record each processor's wall time, exceptions and
+      whether it changed the chart. Costs a serialization of the chart (without
+      its data) per processor.
+    shared_cache: Cache of work shared with other charts reading the same data
+      (see `post_process_charts`).
+    compact_columns: Whether to store low-cardinality string columns as
+      categories (see `compact_string_columns`).
+
+  Returns:
+    Report of the post-processing.
+  """
   # Disable max rows, since we may have added a lot of rows in the post
   # processing. Whenever we update to altair v5, we should use VegaFusion.
   alt.data_transformers.disable_max_rows()
   # Calling chart.to_dict() will parse variable shorthand into aggregate,
-  # field, and type encodings, so we don't have to do that ourselves.
-  chart.to_dict()
+  # field, and type encodings, so we don't have to do that ourselves. The data
+  # is left out, since nothing reads it from `spec`.
+  spec = chart_to_dict_with_empty_data(chart)
+
+  report = PostProcessingReport(instrumented=instrument)
+  # Processors only record into the report when instrumented.
+  recorded_report = report if instrument else None
+
+  def fingerprint():
+    return [
+        (layer_fingerprint(layer), frame_fingerprint(data))
+        for layers in all_layers
+        for layer, data in layers
+    ]
 
   # We don't want to block on any of the post-processing. So, if anything goes
   # wrong in one post processor, just move on to the next one.
   def try_or_continue(fn, *args):
-    try:
-      fn(*args)
-    except Exception:  # pylint: disable=broad-exception-caught
-      return
+    run_processor(recorded_report, fingerprint, fn.__name__, fn, *args)
 
   def try_or_continue_for_each(fn, chart_data_pairs, pass_data=True):
-    try:
+    def for_each():
       if pass_data:
         for chart, data in chart_data_pairs:
           fn(chart, data)
       else:
         for chart, _ in chart_data_pairs:
           fn(chart)
-    except Exception:  # pylint: disable=broad-exception-caught
-      return
+
+    run_processor(recorded_report, fingerprint, fn.__name__, for_each)
 
   # Flatten `chart` into list of non-concatenated (but potentially layered)
   # charts.
   concats = flatten_concats(chart)
-  for concat, data in concats:
-    # Flatten `concat` into list of non-layered charts.
-    layers = flatten_layers(concat, data)
+  # Flatten each `concat` into list of non-layered charts.
+  all_layers = [flatten_layers(concat, data) for concat, data in concats]
+
+  if prune_columns:
 
+    def prune_columns_and_record_bytes():
+      report.bytes_pruned = prune_unused_columns(
+          spec, [data for layers in all_layers for _, data in layers]
+      )
+
+    run_processor(
+        recorded_report,
+        fingerprint,
+        'prune_unused_columns',
+        prune_columns_and_record_bytes,
+    )
+
+  if compact_columns:
+
+    def compact_columns_and_record_bytes():
+      report.bytes_compacted = compact_string_columns(
+          [data for layers in all_layers for _, data in layers]
+      )
+
+    run_processor(
+        recorded_report,
+        fingerprint,
+        'compact_string_columns',
+        compact_columns_and_record_bytes,
+    )
+
+  for layers in all_layers:
     try_or_continue_for_each(sanitize_column_names, layers)
     try_or_continue(remove_duplicate_selectors, layers)
-    try_or_continue(maybe_update_types_and_formats, layers)
+    try_or_continue(maybe_update_types_and_formats, layers, shared_cache)
     try_or_continue(maybe_remove_heatmap_labels, layers, chart)
     try_or_continue(scale_axes, layers)
     try_or_continue_for_each(remove_legend_none, layers, pass_data=False)
@@ -1052,4 +1988,524 @@ def post_process_chart(chart: alt.TopLevelMixin) -> None:
     )
   # TODO(b/337907871): Hold off on overriding default colors until we decide
   # who should own this. Also, don't re-enable without fixing b/337898806.
-  # try_or_continue_for_each(assign_default_colors, layers)
\ No newline at end of file
+  # try_or_continue_for_each(assign_default_colors, layers)
+
+  return report
+
+
+def iter_channel_definitions(encoding: dict[str, Any]):
+  """Yields (channel, definition) pairs of an encoding dict, flattening lists."""
+  for channel, definition in encoding.items():
+    definitions = definition if isinstance(definition, list) else [definition]
+    for list_definition in definitions:
+      if isinstance(list_definition, dict):
+        yield channel, list_definition
+
+
+def aggregated_field_name(op: str, field: Union[str, None]) -> str:
+  """Same name Vega-Lite gives the output of an aggregate."""
+  return '__count' if op == 'count' else f'{op}_{field}'
+
+
+def default_aggregate_title(
+    op: str, field: Union[str, None], config: dict[str, Any]
+) -> str:
+  """Title Vega-Lite would give an aggregated field definition."""
+  field_title = config.get('fieldTitle', 'verbal')
+  if field_title == 'plain':
+    return field if field else config.get('countTitle', 'Count of Records')
+  if field_title == 'functional':
+    return f'{op.upper()}({field or "*"})'
+  if op == 'count':
+    return config.get('countTitle', 'Count of Records')
+  return f'{op[0].upper()}{op[1:]} of {field}'
+
+
+def filter_predicate_mask(
+    data: pd.DataFrame, predicate: Any
+) -> Union[pd.Series, None]:
+  """Evaluates a Vega-Lite field predicate on `data`.
+
+  Args:
+    data: DataFrame the predicate filters.
+    predicate: Value of a `filter` transform.
+
+  Returns:
+    Boolean mask of the rows the predicate keeps, or None if the predicate isn't
+    a field predicate we can evaluate.
+  """
+  if (
+      not isinstance(predicate, dict)
+      or predicate.get('field') not in data.columns
+      or 'timeUnit' in predicate
+      or len(predicate) != 2
+  ):
+    return None
+  column = data[predicate['field']]
+  if is_string_category_column(column):
+    # Compare like the strings it holds (categories are unordered).
+    column = column.astype(object)
+  op = next(key for key in predicate if key != 'field')
+  value = predicate[op]
+  if isinstance(value, dict) or is_datetime(column):
+    return None
+  if op == 'valid':
+    return column.notna() if value else column.isna()
+  # Only compare numbers with numbers and strings with strings.
+  values = value if isinstance(value, list) else [value]
+  for v in values:
+    if v is None or isinstance(v, list) or isinstance(v, str) == is_numeric(
+        column
+    ):
+      return None
+  if op == 'equal':
+    return column == value
+  if op == 'oneOf':
+    return column.isin(values)
+  if op == 'range' and len(values) == 2:
+    return column.between(values[0], values[1])
+  comparison_methods = {'lt': 'lt', 'lte': 'le', 'gt': 'gt', 'gte': 'ge'}
+  if op in comparison_methods:
+    return getattr(column, comparison_methods[op])(value)
+  return None
+
+
+def pre_aggregate_data(
+    spec: dict[str, Any],
+    data: pd.DataFrame,
+    min_rows: int = MIN_ROWS_FOR_PRE_AGGREGATION,
+) -> Union[pd.DataFrame, None]:
+  """Evaluates the aggregation of a bar, pie or heatmap spec in pandas.
+
+  If supported, the encodings in `spec` are rewritten in place to read the
+  pre-aggregated fields (keeping the titles Vega-Lite would have used), and
+  any filter transforms are dropped since they have been applied.
+  Otherwise `spec` is left untouched.
+
+  Args:
+    spec: Vega-Lite dict of a single (possibly layered) view. Any data it has
+      is ignored in favor of `data`.
+    data: DataFrame `spec` reads from.
+    min_rows: Smallest number of rows worth pre-aggregating.
+
+  Returns:
+    The pre-aggregated DataFrame, or None if `spec` is not supported.
+  """
+  if len(data) < min_rows:
+    return None
+  for key in ['vconcat', 'hconcat', 'concat', 'facet', 'repeat', 'spec']:
+    if key in spec:
+      return None
+  layers = spec.get('layer', [spec])
+  encodings = [spec.get('encoding', {})]
+  for layer in layers:
+    if layer is spec:
+      continue
+    for key in ['data', 'transform', 'layer']:
+      if key in layer:
+        return None
+    encodings.append(layer.get('encoding', {}))
+  for layer in [spec] + layers:
+    if 'selection' in layer or 'params' in layer:
+      return None
+
+  # Filters are evaluated before aggregating, like in Vega-Lite.
+  mask = None
+  for transform in spec.get('transform', []):
+    if list(transform) != ['filter']:
+      return None
+    transform_mask = filter_predicate_mask(data, transform['filter'])
+    if transform_mask is None:
+      return None
+    mask = transform_mask if mask is None else mask & transform_mask
+
+  groupby = None
+  measures = {}  # Aggregated field name -> (op, field).
+  has_aggregated_mark = False
+  for layer in layers:
+    mark = layer.get('mark')
+    mark_type = mark.get('type') if isinstance(mark, dict) else mark
+    if mark_type in PRE_AGGREGATION_MARK_TYPES:
+      has_aggregated_mark = True
+    elif mark_type != 'text':  # Text layers can label the aggregated marks.
+      return None
+
+    layer_encoding = dict(spec.get('encoding', {}))
+    if layer is not spec:
+      layer_encoding.update(layer.get('encoding', {}))
+    layer_groupby = set()
+    layer_has_measure = False
+    for _, definition in iter_channel_definitions(layer_encoding):
+      for key in ['bin', 'timeUnit', 'impute', 'condition']:
+        if definition.get(key):
+          return None
+      sort = definition.get('sort')
+      if isinstance(sort, dict) and ('field' in sort or 'op' in sort):
+        return None
+      field = definition.get('field')
+      if 'aggregate' in definition:
+        op = definition['aggregate']
+        if op not in PRE_AGGREGATION_OPS:
+          return None
+        if op != 'count' and (
+            field not in data.columns or not is_numeric(data[field])
+        ):
+          return None
+        measures[aggregated_field_name(op, field)] = (op, field)
+        layer_has_measure = True
+      elif field is not None:
+        if not isinstance(field, str) or field not in data.columns:
+          return None
+        layer_groupby.add(field)
+    # Every layer must aggregate over the same fields.
+    if not layer_has_measure or groupby not in (None, layer_groupby):
+      return None
+    groupby = layer_groupby
+  if not has_aggregated_mark or set(measures) & groupby:
+    return None
+
+  frame = data if mask is None else data[mask]
+  if groupby:
+    grouped = frame.groupby(
+        sorted(groupby), dropna=False, sort=False, observed=True
+    )
+    aggregated = pd.DataFrame({
+        name: grouped.size() if op == 'count' else grouped[field].agg(
+            PRE_AGGREGATION_OPS[op]
+        )
+        for name, (op, field) in measures.items()
+    }).reset_index()
+  else:
+    aggregated = pd.DataFrame({
+        name: [len(frame) if op == 'count' else frame[field].agg(
+            PRE_AGGREGATION_OPS[op]
+        )]
+        for name, (op, field) in measures.items()
+    })
+
+  config = spec.get('config', {})
+  for encoding in encodings:
+    for _, definition in iter_channel_definitions(encoding):
+      if 'aggregate' not in definition:
+        continue
+      op = definition.pop('aggregate')
+      field = definition.get('field')
+      definition['field'] = aggregated_field_name(op, field)
+      definition.setdefault('title', default_aggregate_title(op, field, config))
+  spec.pop('transform', None)
+  return aggregated
+
+
+def chart_to_dict_without_data(chart: alt.TopLevelMixin) -> dict[str, Any]:
+  """Serializes `chart` to a Vega-Lite dict, leaving out its top-level data."""
+  data = chart.data
+  # An empty slice still lets altair infer the encoding types, and unlike
+  # `Undefined`, doesn't make it give every layer placeholder data.
+  chart.data = data.iloc[:0]
+  try:
+    spec = chart.to_dict()
+  finally:
+    chart.data = data
+  # Keep `data` (now naming a missing dataset), which a valid spec needs.
+  del spec['datasets'][spec['data']['name']]
+  if not spec['datasets']:
+    del spec['datasets']
+  return spec
+
+
+def pre_aggregate_chart(
+    chart: alt.TopLevelMixin, min_rows: int = MIN_ROWS_FOR_PRE_AGGREGATION
+) -> alt.TopLevelMixin:
+  """Optionally pre-aggregates a bar, pie or heatmap chart's data in pandas.
+
+  Meant to run after `post_process_chart`, so Vega-Lite gets aggregated rows
+  rather than every raw row of a large DataFrame. The rendered chart is the
+  same.
+
+  Args:
+    chart: Top-level Altair chart, with its DataFrame in `chart.data`.
+    min_rows: Smallest number of rows worth pre-aggregating.
+
+  Returns:
+    A chart reading the pre-aggregated data, or `chart` itself if its
+    aggregation isn't supported.
+  """
+  data = chart.data
+  if not isinstance(data, pd.DataFrame) or len(data) < min_rows:
+    return chart
+  spec = chart_to_dict_without_data(chart)
+  aggregated = pre_aggregate_data(spec, data, min_rows)
+  if aggregated is None:
+    return chart
+  aggregated_chart = type(chart).from_dict(spec)
+  aggregated_chart.data = aggregated
+  return aggregated_chart
+
+
+def largest_triangle_three_buckets(
+    x: np.ndarray, y: np.ndarray, max_points: int
+) -> np.ndarray:
+  """Picks at most `max_points` indices of an x-sorted series with LTTB.
+
+  Largest-Triangle-Three-Buckets keeps the first and last point, and from each
+  of `max_points - 2` equal buckets in between, the point forming the largest
+  triangle with the previously kept point and the average of the next bucket.
+  This preserves the peaks and troughs a line chart shows.
+
+  Args:
+    x: Sorted x values of the series.
+    y: y values of the series.
+    max_points: Number of points to keep.
+
+  Returns:
+    Sorted indices of the kept points.
+  """
+  n = len(x)
+  if max_points >= n or max_points < MIN_POINTS_PER_SERIES:
+    return np.arange(n)
+  edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+  kept = np.empty(max_points, dtype=int)
+  kept[0] = 0
+  kept[-1] = n - 1
+  previous = 0
+  for bucket in range(max_points - 2):
+    start, end = edges[bucket], edges[bucket + 1]
+    if bucket + 2 < len(edges):
+      next_start, next_end = end, edges[bucket + 2]
+    else:
+      next_start, next_end = n - 1, n
+    next_x = x[next_start:next_end].mean()
+    next_y = y[next_start:next_end].mean()
+    # Twice the triangle areas; the factor doesn't change the argmax.
+    areas = np.abs(
+        (x[previous] - next_x) * (y[start:end] - y[previous])
+        - (x[previous] - x[start:end]) * (next_y - y[previous])
+    )
+    previous = start + int(np.argmax(areas))
+    kept[bucket + 1] = previous
+  return kept
+
+
+def density_preserving_sample(
+    x: np.ndarray, y: np.ndarray, max_points: int
+) -> np.ndarray:
+  """Picks about `max_points` indices of a scatter series, keeping its shape.
+
+  Points are bucketed in a grid over the x/y extent, and each occupied cell
+  keeps a share of the budget proportional to how many points it holds, but at
+  least one, so sparse regions and outliers stay visible. Points are picked at
+  random with a fixed seed so renders are reproducible.
+
+  Args:
+    x: x values of the series.
+    y: y values of the series.
+    max_points: Number of points to keep (approximately).
+
+  Returns:
+    Sorted indices of the kept points.
+  """
+  n = len(x)
+  if max_points >= n:
+    return np.arange(n)
+  # At most a quarter of the budget goes to keeping one point per cell.
+  grid_size = min(
+      DENSITY_SAMPLING_GRID_SIZE, max(1, math.isqrt(max_points // 4))
+  )
+
+  def grid_coordinates(values):
+    low, high = values.min(), values.max()
+    scale = grid_size / (high - low) if high > low else 0
+    return np.minimum(((values - low) * scale).astype(int), grid_size - 1)
+
+  cells = grid_coordinates(x) * grid_size + grid_coordinates(y)
+  shuffled = np.random.default_rng(0).permutation(n)
+  by_cell = shuffled[np.argsort(cells[shuffled], kind='stable')]
+  sorted_cells = cells[by_cell]
+  starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+  counts = np.diff(np.r_[starts, n])
+  # Cells too sparse for a proportional share keep one point each, and the
+  # rest of the budget is shared among the denser cells.
+  sparse = counts * max_points < n
+  dense_budget = max(0, max_points - np.count_nonzero(sparse))
+  dense_points = max(1, counts[~sparse].sum())
+  quotas = np.where(
+      sparse, 1, np.maximum(1, counts * dense_budget // dense_points)
+  )
+  ranks = np.arange(n) - np.repeat(starts, counts)
+  return np.sort(by_cell[ranks < np.repeat(quotas, counts)])
+
+
+def numeric_positions(column: pd.Series) -> Union[np.ndarray, None]:
+  """Values of a quantitative or temporal column as floats (NaN if invalid)."""
+  if is_datetime(column):
+    values = column.to_numpy(dtype='datetime64[ns]')
+    return np.where(pd.isna(values), np.nan, values.astype('int64'))
+  if is_numeric(column) and not pandas.api.types.is_bool_dtype(column):
+    return column.to_numpy(dtype=float, na_value=np.nan)
+  return None
+
+
+def downsample_data(
+    spec: dict[str, Any],
+    data: pd.DataFrame,
+    max_points: int = DEFAULT_MAX_POINTS,
+) -> Union[tuple[pd.DataFrame, str], None]:
+  """Downsamples the data of a line, area or scatter spec.
+
+  Each series (one per value of the discrete color, detail, ... fields) gets a
+  share of `max_points` proportional to its size. Line and area series are
+  sorted by x and reduced with LTTB; scatter series are reduced with density
+  preserving sampling. Only charts with a quantitative or temporal x and y,
+  and lines drawn along x, are supported. Rows with an invalid x or y are dropped, like Vega-Lite
+  does when drawing them.
+
+  Args:
+    spec: Vega-Lite dict of a single (possibly layered) view. Any data it has
+      is ignored in favor of `data`.
+    data: DataFrame `spec` reads from.
+    max_points: Point budget of the whole chart.
+
+  Returns:
+    The downsampled DataFrame and a sentence describing the sampling, or None
+    if `data` is within budget or `spec` is not supported.
+  """
+  if len(data) <= max_points:
+    return None
+  for key in [
+      'vconcat', 'hconcat', 'concat', 'facet', 'repeat', 'spec', 'transform'
+  ]:
+    if key in spec:
+      return None
+  layers = spec.get('layer', [spec])
+  for layer in layers:
+    if layer is not spec:
+      for key in ['data', 'transform', 'layer']:
+        if key in layer:
+          return None
+
+  positions = None  # (x field, y field).
+  series_fields = set()
+  ordered = False
+  for layer in layers:
+    mark = layer.get('mark')
+    mark_type = mark.get('type') if isinstance(mark, dict) else mark
+    if mark_type in DOWNSAMPLED_LINE_MARK_TYPES:
+      ordered = True
+    elif mark_type not in DOWNSAMPLED_POINT_MARK_TYPES:
+      return None
+
+    layer_encoding = dict(spec.get('encoding', {}))
+    if layer is not spec:
+      layer_encoding.update(layer.get('encoding', {}))
+    for channel, definition in iter_channel_definitions(layer_encoding):
+      for key in ['aggregate', 'bin', 'timeUnit', 'impute']:
+        if definition.get(key):
+          return None
+      if channel == 'order' and 'field' in definition:
+        return None
+    x, y = layer_encoding.get('x'), layer_encoding.get('y')
+    if not isinstance(x, dict) or not isinstance(y, dict):
+      return None
+    if not is_continuous(x.get('type')) or not is_continuous(y.get('type')):
+      return None
+    # Lines are only sorted by x when x is their orientation axis, which is
+    # not the case if y alone is temporal, or a set orient or sort may change.
+    if isinstance(mark, dict) and 'orient' in mark:
+      return None
+    if 'sort' in x or 'sort' in y:
+      return None
+    if (
+        mark_type in DOWNSAMPLED_LINE_MARK_TYPES
+        and y.get('type') == 'temporal'
+        and x.get('type') != 'temporal'
+    ):
+      return None
+    # Every layer must plot the same points.
+    layer_positions = (x.get('field'), y.get('field'))
+    if positions not in (None, layer_positions):
+      return None
+    positions = layer_positions
+    for channel in SERIES_CHANNELS:
+      definition = layer_encoding.get(channel)
+      if (
+          isinstance(definition, dict)
+          and 'field' in definition
+          and not is_continuous(definition.get('type'))
+      ):
+        series_fields.add(definition['field'])
+
+  x_field, y_field = positions
+  if not {x_field, y_field} | series_fields <= set(data.columns):
+    return None
+  x = numeric_positions(data[x_field])
+  y = numeric_positions(data[y_field])
+  if x is None or y is None:
+    return None
+
+  valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+  if series_fields:
+    series = data.groupby(
+        sorted(series_fields), dropna=False, sort=False, observed=True
+    ).ngroup().to_numpy()[valid]
+    valid = valid[np.argsort(series, kind='stable')]
+    series_sizes = np.bincount(series)
+  else:
+    series_sizes = np.array([len(valid)])
+  kept = []
+  start = 0
+  for size in series_sizes:
+    rows = valid[start:start + size]
+    start += size
+    budget = max(MIN_POINTS_PER_SERIES, max_points * size // len(data))
+    if ordered:
+      rows = rows[np.argsort(x[rows], kind='stable')]
+      kept.append(
+          rows[largest_triangle_three_buckets(x[rows], y[rows], budget)]
+      )
+    else:
+      kept.append(rows[density_preserving_sample(x[rows], y[rows], budget)])
+  kept = np.sort(np.concatenate(kept)) if kept else np.array([], dtype=int)
+  if len(kept) >= len(data):
+    return None
+
+  method = 'LTTB' if ordered else 'density preserving sampling'
+  description = (
+      f'Downsampled from {len(data)} to {len(kept)} points with {method}'
+      f'{" per series" if len(series_sizes) > 1 else ""}.'
+  )
+  return data.iloc[kept].reset_index(drop=True), description
+
+
+def append_description(description: Any, sentence: str) -> str:
+  """Appends a sentence to a (possibly undefined) chart description."""
+  if isinstance(description, str) and description:
+    return f'{description} {sentence}'
+  return sentence
+
+
+def downsample_chart(
+    chart: alt.TopLevelMixin, max_points: int = DEFAULT_MAX_POINTS
+) -> bool:
+  """Optionally downsamples a line, area or scatter chart's data in place.
+
+  Meant to run after `post_process_chart`, for charts with more points than
+  can be told apart once rendered. The applied sampling is appended to the
+  chart's description.
+
+  Args:
+    chart: Top-level Altair chart, with its DataFrame in `chart.data`.
+    max_points: Point budget of the whole chart.
+
+  Returns:
+    True if `chart` now reads downsampled data.
+  """
+  data = chart.data
+  if not isinstance(data, pd.DataFrame) or len(data) <= max_points:
+    return False
+  spec = chart_to_dict_without_data(chart)
+  downsampled = downsample_data(spec, data, max_points)
+  if downsampled is None:
+    return False
+  chart.data, sentence = downsampled
+  chart.description = append_description(chart.description, sentence)
+  return True
@@ -0,0 +1,41 @@
+"""Writes files so readers never see them half written.
+
+Kept free of third-party imports, so the notebook baking, outputs store and
+manifest code can all use it without loading each other's dependencies.
+"""
+
+import os
+import tempfile
+
+
+def current_umask():
+    # The umask can only be read by setting it, so this is done once, at import
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Mode open() gives new files, which mkstemp's temporary files (0600) are set to
+NEW_FILE_MODE = 0o666 & ~current_umask()
+
+
+def write_atomically(filepath, content):
+    """Writes `content` (text, bytes or an iterable of text chunks) to a temporary
+    file next to `filepath`, then renames it over `filepath`, so the file on disk
+    is always complete. The file gets the same permissions open() would give it."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.', suffix='.tmp')
+    try:
+        if isinstance(content, bytes):
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+        elif isinstance(content, str):
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.writelines(content)
+        os.chmod(tmp_path, NEW_FILE_MODE)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
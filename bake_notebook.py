@@ -1,279 +1,663 @@
+import base64
+import hashlib
 import json
 import os
 import re
-from bs4 import BeautifulSoup
-from nbformat import write
-from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
+from concurrent import futures
+import nbformat
+from lxml import etree
+from nbformat.v4 import new_code_cell, new_markdown_cell
+
+from atomic_io import write_atomically
+
+
+def iter_notebook_cells(lines):
+    """Yields the (cell type, source) of each cell of a fenced response.
+
+    `lines` is any iterable of lines without their line breaks (e.g. a generator
+    over a large file) and is consumed once. Lines between a ```python fence and
+    the next fence become one code cell, lines in a ```text fence one fenced
+    markdown cell, and every other non-blank line its own markdown cell. The
+    lines of a fence are collected in a list and joined once, so long outputs
+    take linear time.
+    """
+    fence_type = None  # "code" or "markdown" while inside a fence
+    fence_lines = []
+
+    def fence_cell():
+        content = "\n".join(fence_lines).strip()
+        if not content:
+            return None
+        if fence_type == "code":
+            return "code", content
+        return "markdown", "```\n" + content + "\n```\n"
+
+    for line in lines:
+        if line.startswith("```"):
+            if fence_type is not None:
+                cell = fence_cell()
+                if cell is not None:
+                    yield cell
+                fence_lines = []
+                fence_type = None
+            if "python" in line:
+                fence_type = "code"
+            elif "text" in line:
+                fence_type = "markdown"
+        elif fence_type is not None:
+            fence_lines.append(line)
+        else:
+            text = line.strip()
+            if text:
+                yield "markdown", text
+
+    # A fence left open at the end still makes a cell
+    if fence_type is not None:
+        cell = fence_cell()
+        if cell is not None:
+            yield cell
+
+
+# Cell type of each kind of ICE flow event, by event tag
+EVENT_CELL_TYPES = {
+    'EVENT_TAG_CODE': 'code',
+    'EVENT_TAG_CODE_MSG_OUT': 'output',
+    'EVENT_TAG_CODE_ERROR_OUT': 'output',
+    'EVENT_TAG_OUTPUT_TO_USER': 'text',
+    'EVENT_TAG_CODE_GENERATED_IMAGE_OUT': 'text',
+}
+PLOT_TAG_REGEX = re.compile(r"\[(json-tag|image-tag): [^]]+\]")
+
+
+def iter_event_cells(events, base64_images=()):
+    """Yields the (cell type, source) of each cell of a turn's ICE flow events.
+
+    Code events become code cells and stdout and error events fenced markdown
+    cells, without going through a fenced response, so fences in code or in
+    what it prints cannot split its cells. Model text events are markdown, so
+    they are split into cells by iter_notebook_cells (fenced snippets become
+    their own cells, every other non-blank line its own markdown cell). Other
+    events are skipped. `base64_images` are the turn's rendered plots in
+    the order of their [json-tag: ...]/[image-tag: ...] tags in the events:
+    each is put right before its tag, or after the output of a code event, and
+    plots that failed to render (None) leave their tag as is.
+    """
+    image_index = 0
+
+    def plot_image():
+        nonlocal image_index
+        image = base64_images[image_index] if image_index < len(base64_images) else None
+        markdown = f"![Plot {image_index}](data:image/png;base64,{image})" if image is not None else None
+        image_index += 1
+        return markdown
+
+    def tag_with_image(match):
+        image = plot_image()
+        return match.group(0) if image is None else f"{image}\n{match.group(0)}"
+
+    for event in events:
+        cell_type = EVENT_CELL_TYPES.get(event.get('eventTag'))
+        if cell_type is None:
+            continue
+        message = event['eventMsg']
+        if cell_type == 'text':
+            if '-tag: ' in message:
+                message = PLOT_TAG_REGEX.sub(tag_with_image, message)
+            yield from iter_notebook_cells(message.split("\n"))
+            continue
+
+        content = message.strip()
+        if content:
+            yield ("code", content) if cell_type == 'code' else ("markdown", "```\n" + content + "\n```\n")
+        if '-tag: ' in message:
+            for _ in PLOT_TAG_REGEX.finditer(message):
+                image = plot_image()
+                if image is not None:
+                    yield "markdown", image
+
+
+HTML_CELL_TAGS = {'p', 'pre', 'h3', 'ol', 'ul', 'img'}
+# Rendered around the text of <code> and <strong> in paragraphs and list items
+INLINE_MARKERS = {'code': '`', 'strong': '**'}
+# Their text is not part of the page text
+NON_TEXT_TAGS = {'script', 'style', 'template'}
+IMG_SRC_REGEX = re.compile(r'<img[^>]*src="([^"]*)"')
+# Inline base64 images can be larger than libxml2's default limits
+HTML_PARSER = etree.HTMLParser(huge_tree=True)
+
+
+def escape_html_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def quote_html_attribute(value):
+    """Quotes an attribute value the way BeautifulSoup serializes it."""
+    value = escape_html_text(value)
+    if '"' not in value:
+        return '"' + value + '"'
+    if "'" not in value:
+        return "'" + value + "'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+class HTMLCellWalker:
+    """Turns a ChatGPT HTML response into notebook cells in one ordered walk.
+
+    The cells are the ones the BeautifulSoup converter made, which rewrote the
+    tree while it went: it replaced <code>/<strong> in paragraphs and list
+    items with backticks/asterisks, and moved nested lists to the end of their
+    list item, or dropped them. The lxml tree is never changed; those edits are
+    recorded here instead, and every text is read through them. A list inside
+    an emitted list (after those edits) is part of its cell, so it is skipped.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.moved = {}         # Nested list -> the <li> it was moved to, or None
+        self.appended = {}      # <li> -> nested lists moved to its end
+        self.unwrapped = set()  # <code>/<strong> rendered as markers
+        self.emitted = set()    # Lists that got their own cell
+
+    def content(self, elem):
+        """Yields the text and children of `elem`, after the recorded edits."""
+        if elem.text:
+            yield elem.text
+        for child in elem:
+            if child not in self.moved:
+                yield child
+            if child.tail:
+                yield child.tail
+        yield from self.appended.get(elem, ())
+
+    def descendants(self, elem):
+        for child in self.content(elem):
+            if not isinstance(child, str) and isinstance(child.tag, str):
+                yield child
+                yield from self.descendants(child)
+
+    def find(self, elem, tag):
+        return next((e for e in self.descendants(elem) if e.tag == tag), None)
+
+    def marker(self, elem):
+        return INLINE_MARKERS[elem.tag] if elem in self.unwrapped else ''
+
+    def text(self, elem, parts=None):
+        """Text of `elem` (BeautifulSoup's get_text), with inline markers."""
+        top = parts is None
+        if top:
+            parts = []
+        for child in self.content(elem):
+            if isinstance(child, str):
+                parts.append(child)
+            elif isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+                marker = self.marker(child)
+                parts.append(marker)
+                self.text(child, parts)
+                parts.append(marker)
+        return ''.join(parts) if top else parts
+
+    def parent(self, elem):
+        return self.moved[elem] if elem in self.moved else elem.getparent()
+
+    def in_emitted_list(self, elem):
+        parent = self.parent(elem)
+        while parent is not None:
+            if parent in self.emitted:
+                return True
+            parent = self.parent(parent)
+        return False
+
+    def unwrap_inline_tags(self, elem):
+        self.unwrapped.update(e for e in self.descendants(elem) if e.tag in INLINE_MARKERS)
+
+    def list_items(self, elem, level=0, ordered=False):
+        """Markdown of a (nested) list, one line per item."""
+        items = []
+        indent = '  ' * level
+        item_tags = [child for child in self.content(elem) if not isinstance(child, str) and child.tag == 'li']
+        for number, li in enumerate(item_tags, 1):
+            nested_ul = self.find(li, 'ul')
+            nested_ol = self.find(li, 'ol')
+            for nested_list in (nested_ul, nested_ol):
+                if nested_list is not None:
+                    self.moved[nested_list] = None
+
+            self.unwrap_inline_tags(li)
+            prefix = f'{number}. ' if ordered else '- '
+            items.append(indent + prefix + self.text(li).strip())
+
+            # One nested list stays under the item. A nested <ol> next to a
+            # nested <ul> is left out, and gets its own cell when reached.
+            nested_list = nested_ul if nested_ul is not None else nested_ol
+            if nested_list is not None:
+                items.append(self.list_items(nested_list, level + 1, ordered=nested_list is nested_ol))
+                self.appended.setdefault(li, []).append(nested_list)
+                self.moved[nested_list] = li
+        return '\n'.join(items)
+
+    def image_markdown(self, elem, number):
+        attributes = ''.join(f' {k}={quote_html_attribute(v)}' for k, v in elem.attrib.items())
+        match = IMG_SRC_REGEX.search(f'<img{attributes}/>')
+        if match:
+            return f'![Plot {number}](data:image/png;base64,{match.group(1)})'
+        return None
+
+    def cells(self):
+        """Yields the (cell type, source lines) of each cell, in document order."""
+        img_counter = 1
+        for elem in self.root.iter(*HTML_CELL_TAGS):
+            if elem.tag == 'p':
+                self.unwrap_inline_tags(elem)
+                yield "markdown", [self.text(elem) + "\n"]
+            elif elem.tag == 'pre':
+                code = next((e for e in self.descendants(elem) if e.tag == 'code' and e not in self.unwrapped), None)
+                if code is not None:
+                    yield "code", [line + '\n' for line in self.text(code).splitlines()]
+                else:
+                    yield "markdown", ["```\n" + self.text(elem) + "\n```\n"]
+            elif elem.tag == 'h3':
+                yield "markdown", ["### " + self.text(elem) + "\n"]
+            elif elem.tag in ('ol', 'ul'):
+                if not self.in_emitted_list(elem):
+                    yield "markdown", [self.list_items(elem, ordered=elem.tag == 'ol') + "\n"]
+                    self.emitted.add(elem)
+            elif elem.tag == 'img':
+                image = self.image_markdown(elem, img_counter)
+                if image is not None:
+                    yield "markdown", [image + "\n"]
+                    img_counter += 1
+
+
+# Set VALIDATE_NOTEBOOKS=1 to check every baked notebook against the nbformat
+# schema (slow on notebooks with many images, so off by default)
+VALIDATE_NOTEBOOKS = bool(os.getenv('VALIDATE_NOTEBOOKS'))
+# JSON string encoder of json.dumps(ensure_ascii=False), in C where available
+encode_json_string = json.encoder.encode_basestring
+
+
+def format_json(value, indent=""):
+    """`value` formatted as nbformat writes JSON (json.dumps with indent=1,
+    sort_keys=True and ensure_ascii=False), nested at `indent`.
+
+    json only has a pure Python encoder for indented output, which yields every
+    token separately; joining whole lists and dicts here is several times faster.
+    """
+    if isinstance(value, str):
+        return encode_json_string(value)
+    inner = indent + " "
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+        items = ",\n".join(f"{inner}{encode_json_string(key)}: {format_json(value[key], inner)}" for key in sorted(value))
+        return f"{{\n{items}\n{indent}}}"
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return "[]"
+        try:
+            # Lists of lines, the bulk of a notebook
+            items = inner + f",\n{inner}".join(map(encode_json_string, value))
+        except TypeError:
+            items = ",\n".join(inner + format_json(item, inner) for item in value)
+        return f"[\n{items}\n{indent}]"
+    return json.dumps(value)
+
+
+def split_lines(value):
+    """Text (or a list of text chunks) as the list of lines nbformat stores."""
+    if isinstance(value, list):
+        value = "".join(value)
+    return value.splitlines(True)
+
+
+def is_split_mime(mime):
+    """Mime types whose data nbformat splits into lines (base64 images stay whole)."""
+    return mime.startswith("text/") or mime in ("application/javascript", "image/svg+xml")
+
+
+def notebook_cell(cell, index):
+    """A copy of `cell` as nbformat writes it, with a deterministic id.
+
+    Multiline sources and text attachments are split into lists of lines, code
+    cells get their (empty) outputs, and the id is derived from the cell's
+    position and source, so the same cells always give the same notebook.
+    """
+    cell = dict(cell)
+    cell.setdefault("metadata", {})
+    source = cell["source"] if isinstance(cell["source"], str) else "".join(cell["source"])
+    cell["source"] = source.splitlines(True)
+    if "attachments" in cell:
+        cell["attachments"] = {
+            name: {mime: split_lines(data) if is_split_mime(mime) else data for mime, data in bundle.items()}
+            for name, bundle in cell["attachments"].items()
+        }
+    if cell["cell_type"] == "code":
+        cell.setdefault("execution_count", None)
+        cell.setdefault("outputs", [])
+    cell["id"] = hashlib.sha1(f"{index}\0{source}".encode("utf-8")).hexdigest()[:16]
+    return cell
+
+
+def write_notebook(filepath, cells, validate=None):
+    """Writes a notebook of `cells` byte for byte as nbformat.write would, only faster.
+
+    nbformat deep-copies the whole notebook and validates it against the
+    schema on every write. Here the cells are copied shallowly and the JSON is
+    streamed to the file (atomically); validation runs only if `validate` is
+    true (by default, if VALIDATE_NOTEBOOKS is set) and raises
+    nbformat.ValidationError for an invalid notebook.
+    """
+    cells = [notebook_cell(cell, index) for index, cell in enumerate(cells)]
+    if VALIDATE_NOTEBOOKS if validate is None else validate:
+        nbformat.validate({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5})
+
+    def chunks():
+        yield '{\n "cells": ['
+        for index, cell in enumerate(cells):
+            yield (",\n  " if index else "\n  ") + format_json(cell, "  ")
+        yield '\n ],\n "metadata": {},\n "nbformat": 4,\n "nbformat_minor": 5\n}\n' if cells else \
+            '],\n "metadata": {},\n "nbformat": 4,\n "nbformat_minor": 5\n}\n'
+
+    write_atomically(filepath, chunks())
+
+
+# How plot images are stored in baked notebooks: inline as base64 data URIs,
+# as cell attachments, or as PNG files next to the notebook
+NOTEBOOK_IMAGE_MODES = ('inline', 'attachments', 'sidecar')
+# Directory of sidecar images, relative to the notebook
+SIDECAR_IMAGE_DIR = 'images'
+# Plots inlined by replace_json_tags and the HTML converter
+INLINE_IMAGE_REGEX = re.compile(r'!\[([^\]]*)\]\(data:image/png;base64,([^)\s]*)\)')
+
+
+def externalize_cell_images(cell, image_mode, notebook_dir=None):
+    """Moves the inline PNG images of a markdown cell out of its source.
+
+    With 'attachments' each distinct image becomes one attachment of the cell,
+    named by the hash of its data. With 'sidecar' it is written once to
+    SIDECAR_IMAGE_DIR under `notebook_dir`, also named by hash, and linked by
+    relative path. 'inline' leaves the cell as it is.
+    """
+    if image_mode not in NOTEBOOK_IMAGE_MODES:
+        raise ValueError(f'Notebook image mode must be one of {NOTEBOOK_IMAGE_MODES}')
+    if image_mode == 'inline' or cell['cell_type'] != 'markdown':
+        return cell
+    source = cell['source']
+    text = ''.join(source) if isinstance(source, list) else source
+    attachments = {}
+
+    def externalize(match):
+        name = hashlib.sha256(match.group(2).encode('ascii')).hexdigest()[:16] + '.png'
+        if image_mode == 'attachments':
+            attachments[name] = {'image/png': match.group(2)}
+            return f'![{match.group(1)}](attachment:{name})'
+        image_dir = os.path.join(notebook_dir, SIDECAR_IMAGE_DIR)
+        image_path = os.path.join(image_dir, name)
+        if not os.path.exists(image_path):
+            os.makedirs(image_dir, exist_ok=True)
+            write_atomically(image_path, base64.b64decode(match.group(2)))
+        return f'![{match.group(1)}]({SIDECAR_IMAGE_DIR}/{name})'
+
+    text = INLINE_IMAGE_REGEX.sub(externalize, text)
+    cell['source'] = [text] if isinstance(source, list) else text
+    if attachments:
+        cell['attachments'] = attachments
+    return cell
+
+
+# Directory of the full text of cut down outputs, relative to the notebook
+SIDECAR_OUTPUT_DIR = 'outputs'
+TRACEBACK_START = 'Traceback (most recent call last):'
+
+
+class OutputBudget:
+    """How much of a long printed output baked notebooks keep.
+
+    Outputs are the fenced ```text blocks of a response (stdout and errors).
+    One longer than `max_lines` lines keeps its first `head_lines` and last
+    `tail_lines` lines, with a note of how many lines were left out between
+    them. Tracebacks (from their first line to the next blank line, as errors
+    are counted) are always kept whole. With `sidecar`, the full output is
+    also written to SIDECAR_OUTPUT_DIR next to the notebook, named by its hash,
+    and the note links to it.
+    """
+
+    def __init__(self, max_lines=400, head_lines=200, tail_lines=100, sidecar=False):
+        if head_lines + tail_lines > max_lines:
+            raise ValueError('An output budget must keep at most max_lines lines')
+        self.max_lines  = max_lines
+        self.head_lines = head_lines
+        self.tail_lines = tail_lines
+        self.sidecar    = sidecar
+
+    @classmethod
+    def from_config(cls, config):
+        """Budget of a jobs.json `notebook_output_budget`: a dict of the arguments
+        above. None (no budget, so outputs are kept whole) if it is missing,
+        null, false or empty."""
+        if not config:
+            return None
+        return cls(**config)
+
+    def shorten(self, lines, full_output_path=None):
+        """`lines` of an output, cut down to the budget."""
+        if len(lines) <= self.max_lines:
+            return lines
+        kept = set(range(self.head_lines)) | set(range(len(lines) - self.tail_lines, len(lines)))
+        in_traceback = False
+        for index, line in enumerate(lines):
+            if line.startswith(TRACEBACK_START):
+                in_traceback = True
+            elif not line.strip():
+                in_traceback = False
+            if in_traceback:
+                kept.add(index)
+
+        shortened = []
+        elided = 0
+        for index, line in enumerate(lines):
+            if index not in kept:
+                elided += 1
+                continue
+            if elided:
+                shortened.append(self.elision_note(elided, full_output_path))
+                elided = 0
+            shortened.append(line)
+        return shortened
+
+    @staticmethod
+    def elision_note(count, full_output_path=None):
+        note = f'... {count:,} more lines not shown'
+        if full_output_path:
+            note += f' (full output: {full_output_path})'
+        return note + ' ...'
+
+
+def budget_cell_output(cell, output_budget, notebook_dir=None):
+    """Cuts the printed output of a markdown cell down to `output_budget`.
+
+    Only fenced output cells (as made by iter_notebook_cells, or from <pre>
+    blocks by iter_html_cells) are changed; a None budget keeps everything.
+    """
+    if output_budget is None or cell['cell_type'] != 'markdown':
+        return cell
+    source = cell['source']
+    text = ''.join(source) if isinstance(source, list) else source
+    if not (text.startswith('```\n') and text.endswith('\n```\n')) or text.count('\n') <= output_budget.max_lines:
+        return cell
+    lines = text[len('```\n'):-len('\n```\n')].split('\n')
+    if len(lines) <= output_budget.max_lines:
+        return cell
+
+    full_output_path = None
+    if output_budget.sidecar:
+        output = '\n'.join(lines) + '\n'
+        name = hashlib.sha256(output.encode('utf-8')).hexdigest()[:16] + '.txt'
+        output_dir = os.path.join(notebook_dir, SIDECAR_OUTPUT_DIR)
+        output_path = os.path.join(output_dir, name)
+        if not os.path.exists(output_path):
+            os.makedirs(output_dir, exist_ok=True)
+            write_atomically(output_path, output)
+        full_output_path = f'{SIDECAR_OUTPUT_DIR}/{name}'
+
+    text = '```\n' + '\n'.join(output_budget.shorten(lines, full_output_path)) + '\n```\n'
+    cell['source'] = [text] if isinstance(source, list) else text
+    return cell
+
+
+def iter_html_cells(html_content):
+    """Yields the (cell type, source lines) of each cell of an HTML response."""
+    root = etree.HTML(html_content, HTML_PARSER)
+    if root is not None:
+        yield from HTMLCellWalker(root).cells()
 
 
 class IPYNBGenerator:
+    """Bakes the turns of a task into a notebook.
+
+    `text_to_notebook`/`html_to_notebook` write the notebook of every turn
+    given. While a task runs, `bake_turns` can be called after each turn: it
+    converts only the new turn and rewrites the notebook in a background
+    thread, so a crash later in the task still leaves a notebook with every
+    finished turn. The final call then only waits for it and writes what is
+    missing. Plot images are stored as `image_mode` says (one of
+    NOTEBOOK_IMAGE_MODES), and long printed outputs are cut down to
+    `output_budget` (an OutputBudget, or None to keep them whole).
+    """
+
+    # Appended to notebook file names (before .ipynb)
+    notebook_suffix = ""
+
     def __init__(self,
                  output_path: str,
                  rater_id:    str = "0", 
                  task_id:     str = "0",
                  nb_for:      str = "Gemini", 
+                 image_mode:  str = "inline",
+                 output_budget: OutputBudget = None,
         ) -> None:
         if rater_id == "0":
             raise ValueError('You need to provide a valid rater ID')
         if task_id == "0":
             raise ValueError('You need to provide a valid task ID')
+        if image_mode not in NOTEBOOK_IMAGE_MODES:
+            raise ValueError(f'Notebook image mode must be one of {NOTEBOOK_IMAGE_MODES}')
 
         self.nb_for      = nb_for
         self.rater_id    = rater_id
         self.task_id     = task_id
         self.output_path = output_path
-
-    def text_to_notebook(self, text_dict_list) -> None:
-        # Create a new notebook object
-        nb = new_notebook()
-
-        # List of cells to add to the notebook
-        cells = []
-
-        # Function to process a single notebook string and add its cells to the cells list
-        def process_notebook_string(notebook_string):
-            lines = notebook_string.split("\n")
-            
-            blocks = []
-            current_block = {"type": "", "content": ""}
-            inside_code_block = False
-            inside_text_block = False
-
-            for line in lines:
-                if line.startswith("```"):
-                    if inside_code_block or inside_text_block:
-                        if current_block["content"].strip():  # Only add block if content is not empty
-                            blocks.append(current_block)
-                        current_block = {"type": "", "content": ""}
-                        inside_code_block = False
-                        inside_text_block = False
-                    if "python" in line:
-                        current_block["type"] = "code"
-                        inside_code_block = True
-                    elif "text" in line:
-                        current_block["type"] = "markdown"
-                        inside_text_block = True
-                elif inside_code_block or inside_text_block:
-                    current_block["content"] += line + "\n"
-                else:
-                    if current_block["content"].strip():  # Only add block if content is not empty
-                        blocks.append(current_block)
-                    current_block = {"type": "text", "content": line + "\n"}
-                    blocks.append(current_block)
-                    current_block = {"type": "", "content": ""}
-
-            if current_block["content"].strip():
-                blocks.append(current_block)
-
-            for block in blocks:
-                if block["content"].strip():
-                    if block["type"] == "code":
-                        cells.append(new_code_cell(block["content"].strip()))
-                    elif block["type"] == "text":
-                        cells.append(new_markdown_cell(block["content"].strip()))
-                    elif block["type"] == "markdown":
-                        cells.append(new_markdown_cell( "```\n" + block["content"].strip()  + "\n```\n"))
-
-        # Loop through the list of dictionaries and process each one
-        for prompt_index, item in enumerate(text_dict_list):
-            user_query = item['prompt']
-            notebook_string = item['response_with_image']
-            prompt_files_str = ",".join([f.split('/')[-1] for f in item['prompt_files']])
-            prompt_file_urls = ", ".join(item["prompt_file_urls"])
-            
-            # Add a text cell for the user query
-            if prompt_index == 0:
-                cells.append(new_markdown_cell(f'**User Query:** {user_query}\n\nturn: {prompt_index+1}\n\nfile_name: "{prompt_files_str}"\n\nfile_path: "{prompt_file_urls}"'))
+        self.image_mode  = image_mode
+        self.output_budget = output_budget
+
+        self.turn_cells    = {}    # Turn key -> the cells it was converted to
+        self.saved_turns   = None  # Keys of the turns in the notebook on disk
+        self.bake_executor = None
+        self.pending_bakes = []
+
+    def notebook_name(self):
+        return f"{self.nb_for}_rater_{self.rater_id}_ID_{self.task_id}{self.notebook_suffix}.ipynb"
+
+    def text_turn_cells(self, prompt_index, item):
+        user_query = item['prompt']
+        prompt_files_str = ",".join([f.split('/')[-1] for f in item['prompt_files']])
+        prompt_file_urls = ", ".join(item["prompt_file_urls"])
+
+        # Add a text cell for the user query
+        if prompt_index == 0:
+            cells = [new_markdown_cell(f'**User Query:** {user_query}\n\nturn: {prompt_index+1}\n\nfile_name: "{prompt_files_str}"\n\nfile_path: "{prompt_file_urls}"')]
+        else:
+            cells = [new_markdown_cell(f"**User Query:** {user_query}\n\nturn: {prompt_index+1}")]
+
+        for cell_type, source in iter_notebook_cells(item['response_with_image'].split("\n")):
+            if cell_type == "code":
+                cells.append(new_code_cell(source))
             else:
-                cells.append(new_markdown_cell(f"**User Query:** {user_query}\n\nturn: {prompt_index+1}"))
-
-            # Process the notebook string and add its cells
-            process_notebook_string(notebook_string)
+                cells.append(new_markdown_cell(source))
+        return cells
+
+    def html_turn_cells(self, prompt_index, item):
+        user_query = item['prompt']
+        prompt_files_str = ",".join([f.split('/')[-1] for f in item['prompt_files']])
+        c_prompt_file_urls = ", ".join(item["prompt_file_urls"])
+
+        # Add a text cell for the user query
+        if prompt_index == 0:
+            source = f'**User Query:** {user_query}\n\nturn: {prompt_index+1}\n\nfile_name: "{prompt_files_str}"\n\nfile_path: "{c_prompt_file_urls}"\n'
+        else:
+            source = f"**User Query:** {user_query}\n\nturn: {prompt_index+1}\n"
+        cells = [{"cell_type": "markdown", "metadata": {}, "source": [source]}]
+
+        for cell_type, source in iter_html_cells(item['html_response']):
+            cells.append({
+                "cell_type": cell_type,
+                "metadata": {},
+                "source": source
+            })
+        return cells
+
+    def save_notebook(self, dict_list, html=False):
+        """Writes the notebook of `dict_list`, converting only turns not seen before.
+
+        Returns the path of the notebook, after rewriting it unless it already
+        holds exactly these turns.
+        """
+        filepath = os.path.join(self.output_path, self.notebook_name())
+        # A turn is identified by its position (the first one has a longer
+        # header) and its prompt and timestamp (re-runs replace the dict)
+        keys = [(html, prompt_index, item['prompt'], item.get('timestamp'))
+                for prompt_index, item in enumerate(dict_list)]
+        if keys == self.saved_turns and os.path.exists(filepath):
+            return filepath
+
+        turn_cells = {}
+        for key, item in zip(keys, dict_list):
+            if key not in self.turn_cells:
+                make_cells = self.html_turn_cells if html else self.text_turn_cells
+                self.turn_cells[key] = [
+                    externalize_cell_images(
+                        budget_cell_output(cell, self.output_budget, self.output_path),
+                        self.image_mode, self.output_path
+                    )
+                    for cell in make_cells(key[1], item)
+                ]
+            turn_cells[key] = self.turn_cells[key]
+        self.turn_cells = turn_cells
+        write_notebook(filepath, [cell for key in keys for cell in turn_cells[key]])
+        self.saved_turns = keys
+        return filepath
+
+    def bake_turns(self, dict_list, html=False):
+        """Updates the notebook with the turns finished so far, in the background.
+
+        Turns are baked in the order this is called. A failed bake is only
+        reported; the final `text_to_notebook`/`html_to_notebook` retries it.
+        """
+        if self.bake_executor is None:
+            self.bake_executor = futures.ThreadPoolExecutor(max_workers=1)
+        # The caller keeps appending turns to its list
+        future = self.bake_executor.submit(self.save_notebook, list(dict_list), html)
+        self.pending_bakes.append(future)
+        return future
+
+    def wait_for_bakes(self):
+        for future in self.pending_bakes:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[x] Baking the notebook after a turn failed: {e}")
+        self.pending_bakes = []
+        if self.bake_executor is not None:
+            self.bake_executor.shutdown()
+            self.bake_executor = None
 
-        # Assign cells to the notebook
-        nb['cells'] = cells
-
-        # Save the notebook to a file
-        filepath = os.path.join(self.output_path, f"{self.nb_for}_rater_{self.rater_id}_ID_{self.task_id}.ipynb")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            write(nb, f)
+    def text_to_notebook(self, text_dict_list) -> None:
+        self.wait_for_bakes()
+        filepath = self.save_notebook(text_dict_list)
         print(f"Notebook has been saved to {filepath}")
-        return f"{self.nb_for}_rater_{self.rater_id}_ID_{self.task_id}.ipynb"
+        return self.notebook_name()
 
     def html_to_notebook(self, html_dict_list):
-        notebook_cells = []
-
-        # Loop through the list of dictionaries and process each one
-        for prompt_index, item in enumerate(html_dict_list):
-            user_query = item['prompt']
-            html_content = item['html_response']
-            prompt_files_str = ",".join([f.split('/')[-1] for f in item['prompt_files']])
-            c_prompt_file_urls = ", ".join(item["prompt_file_urls"])
-
-            # Add a text cell for the user query
-            if prompt_index == 0:
-                notebook_cells.append({
-                        "cell_type": "markdown",
-                        "metadata": {},
-                        "source": [f'**User Query:** {user_query}\n\nturn: {prompt_index+1}\n\nfile_name: "{prompt_files_str}"\n\nfile_path: "{c_prompt_file_urls}"\n']
-                    })
-
-            else:
-                notebook_cells.append({
-                        "cell_type": "markdown",
-                        "metadata": {},
-                        "source": [f"**User Query:** {user_query}\n\nturn: {prompt_index+1}\n"]
-                    })
-
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            seen_li_elems = set()
-            img_counter = 1
-            for tag in soup.find_all(['p', 'pre', 'h3', 'ol', 'ul','img']):
-                if tag.name == 'p':
-                    # Find all <code> tags and replace them with backticks
-                    for code_tag in tag.find_all('code'):
-                        code_tag.insert_before('`')
-                        code_tag.insert_after('`')
-                        code_tag.unwrap()
-                    # Find all <strong> tags and replace them with astericks
-                    for code_tag in tag.find_all('strong'):
-                        code_tag.insert_before('**')
-                        code_tag.insert_after('**')
-                        code_tag.unwrap()
-                        
-                    notebook_cells.append({
-                        "cell_type": "markdown",
-                        "metadata": {},
-                        "source": [tag.get_text() + "\n"]
-                    })
-                elif tag.name == 'pre':
-                    code_content = tag.find('code')
-                    if code_content:
-                        notebook_cells.append({
-                            "cell_type": "code",
-                            "metadata": {},
-                            "source": [cl + '\n' for cl in code_content.get_text().splitlines()]
-                        })
-                    else:
-                         notebook_cells.append({
-                            "cell_type": "markdown",
-                            "metadata": {},
-                            "source": ["```\n" + tag.get_text() + "\n```\n"]
-                        })
-                elif tag.name == 'h3':
-                    notebook_cells.append({
-                        "cell_type": "markdown",
-                        "metadata": {},
-                        "source": ["### " + tag.get_text() + "\n"]
-                    })
-                elif tag.name == 'ol':
-                    duplicate = False
-                    for seen_li in seen_li_elems:
-                        if str(tag) in seen_li:
-                            duplicate = True
-
-                    if not duplicate:
-                        list_items = self.process_nested_list(tag, ordered=True)
-                        notebook_cells.append({
-                            "cell_type": "markdown",
-                            "metadata": {},
-                            "source": [list_items + "\n"]
-                        })
-                        seen_li_elems.add(str(tag))
-
-                elif tag.name == 'ul':
-                    duplicate = False
-                    for seen_li in seen_li_elems:
-                        if str(tag) in seen_li:
-                            duplicate = True
-
-                    if not duplicate:
-                        list_items = self.process_nested_list(tag, ordered=False)
-                        notebook_cells.append({
-                            "cell_type": "markdown",
-                            "metadata": {},
-                            "source": [list_items + "\n"]
-                        })
-                        seen_li_elems.add(str(tag))
-
-                elif tag.name == 'img':
-                    pattern = r'<img[^>]*src="([^"]*)"'
-                    # Search for the pattern
-                    match = re.search(pattern, str(tag))
-
-                    # Check if a match was found and print the src value
-                    if match:
-                        base64_image = match.group(1)                    
-                        img_base64_str = f'![Plot {img_counter}](data:image/png;base64,{base64_image})'
-                        notebook_cells.append({
-                                "cell_type": "markdown",
-                                "metadata": {},
-                                "source": [img_base64_str + "\n"]
-                            })
-                        img_counter += 1
-
-        # Notebook JSON structure
-        notebook = {
-            "cells": notebook_cells,
-            "metadata": {},
-            "nbformat": 4,
-            "nbformat_minor": 4
-        }
-        notebook_str = json.dumps(notebook, indent=0)
-
-        # Save the notebook to a file
-        filepath = os.path.join(self.output_path, f"{self.nb_for}_rater_{self.rater_id}_ID_{self.task_id}.ipynb")
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(notebook_str)
+        self.wait_for_bakes()
+        filepath = self.save_notebook(html_dict_list, html=True)
         print(f"[x] Notebook has been saved to {filepath}")
-        return f"{self.nb_for}_rater_{self.rater_id}_ID_{self.task_id}.ipynb"
-
-    def process_nested_list(self, tag, level=0, ordered=False):
-        items = []
-        indent = '  ' * level
-        prefix_no = 0
-        seen_list_elems = set()
-
-        for li in tag.find_all('li', recursive=False):
-            nested_ul = li.find('ul')
-            nested_ol = li.find('ol')
-
-            # Temporarily remove nested lists
-            if nested_ul:
-                nested_ul.extract()
-            if nested_ol:
-                nested_ol.extract()
-
-            # Get the text for the current list item
-            prefix = f'{prefix_no+1}. ' if ordered else '- '
-
-            # Find all <code> tags and replace them with backticks
-            for code_tag in li.find_all('code'):
-                code_tag.insert_before('`')
-                code_tag.insert_after('`')
-                code_tag.unwrap()
-
-            # # Find all <strong> tags and replace them with astericks
-            for code_tag in li.find_all('strong'):
-                code_tag.insert_before('**')
-                code_tag.insert_after('**')
-                code_tag.unwrap()
-
-            items.append(indent + prefix + li.get_text().strip())
-            seen_list_elems.add(indent + prefix + li.get_text().strip())
-
-            # Reinsert and process nested lists
-            if nested_ul and nested_ul not in seen_list_elems:
-                items.append(self.process_nested_list(nested_ul, level + 1, ordered=False))
-                li.append(nested_ul)
-                seen_list_elems.add(nested_ul)
-
-            if nested_ol and nested_ul not in seen_list_elems:
-                items.append(self.process_nested_list(nested_ol, level + 1, ordered=True))
-                li.append(nested_ol)
-                seen_list_elems.add(nested_ol)
-            prefix_no += 1
-        return '\n'.join(items)
-
-
+        return self.notebook_name()
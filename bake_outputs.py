@@ -0,0 +1,182 @@
+"""Bakes the notebooks of saved outputs files without rerunning any prompts.
+
+Reads the turns recorded by the scripts (the gemini-outputs.sqlite3 and
+gpt-outputs.sqlite3 stores and their lti- variants, or outputs JSON files in
+their format), and bakes the notebook of every selected task into
+notebooks/ID_[task_id]/, exactly as the script that recorded it would, across
+a pool of processes. GPT outputs (turns with an
+`html_response`) are baked as HTML, the others as text; files whose name
+starts with `lti-` get the GN8K notebook names.
+
+A manifest next to the notebooks records a hash of every notebook's turns,
+settings and baking code, so tasks that did not change since they were last
+baked are skipped. Editing bake_notebook.py rebakes everything:
+
+    python bake_outputs.py gemini-outputs.sqlite3 gpt-outputs.sqlite3
+    python bake_outputs.py gpt-outputs.sqlite3 --tasks 100 101 --image-mode sidecar
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent import futures
+
+import bake_notebook
+import lti_bake_notebook
+from atomic_io import write_atomically
+from bake_notebook import NOTEBOOK_IMAGE_MODES, OutputBudget
+from prompt_outputs import STORE_SUFFIX, PromptOutputStore
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_NOTEBOOKS_DIR = os.path.join(BASE_DIR, 'notebooks')
+MANIFEST_NAME = '.bake-manifest.json'
+DEFAULT_NUM_WORKERS = os.cpu_count() or 1
+
+
+def baking_code_hash():
+    """Hash of the modules notebooks are baked with, so changing them rebakes everything."""
+    digest = hashlib.sha256()
+    for module in (bake_notebook, lti_bake_notebook):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_outputs(path):
+    """Yields the (task ID, turns) of an outputs store or JSON file, one task at a time."""
+    if path.endswith(STORE_SUFFIX):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No outputs store at {path}')
+        store = PromptOutputStore(os.path.splitext(path)[0] + '.json')
+        try:
+            yield from store.items()
+        finally:
+            store.close()
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from json.load(f).items()
+
+
+def rater_id_from_jobs():
+    for jobs_path in ('jobs.json', 'reproducible-jobs.json'):
+        try:
+            with open(jobs_path, 'r', encoding='utf-8') as f:
+                return json.load(f)['rater_id']
+        except (OSError, ValueError, KeyError):
+            continue
+    return None
+
+
+def bake_task(job):
+    """Bakes one task's notebook in a worker process, returning its path."""
+    generator_class = lti_bake_notebook.IPYNBGenerator if job['lti'] else bake_notebook.IPYNBGenerator
+    os.makedirs(job['output_path'], exist_ok=True)
+    ipynb_gen = generator_class(
+        output_path = job['output_path'],
+        rater_id    = job['rater_id'],
+        task_id     = job['task_id'],
+        nb_for      = 'GPT' if job['html'] else 'Gemini',
+        image_mode  = job['image_mode'],
+        output_budget = OutputBudget.from_config(job['output_budget'])
+    )
+    return ipynb_gen.save_notebook(job['turns'], html=job['html'])
+
+
+def make_jobs(outputs_paths, rater_id, image_mode, output_budget, notebooks_dir, task_ids=None):
+    code_hash = baking_code_hash()
+    for outputs_path in outputs_paths:
+        lti = os.path.basename(outputs_path).startswith('lti-')
+        for task_id, turns in load_outputs(outputs_path):
+            if not turns or (task_ids and task_id not in task_ids):
+                continue
+            job = {
+                'task_id': task_id,
+                'turns': turns,
+                'html': 'html_response' in turns[0],
+                'lti': lti,
+                'rater_id': rater_id,
+                'image_mode': image_mode,
+                'output_budget': vars(output_budget) if output_budget else None,
+                'output_path': os.path.join(notebooks_dir, f'ID_{task_id}'),
+            }
+            digest = hashlib.sha256(code_hash.encode())
+            digest.update(json.dumps(job, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+            job['hash'] = digest.hexdigest()
+            yield job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('outputs', nargs='+', help='Outputs stores (or JSON files) saved by the scripts')
+    parser.add_argument('--tasks', nargs='+', help='Task IDs to bake (default: every task)')
+    parser.add_argument('--rater-id', help='Rater ID for notebook names (default: from jobs.json)')
+    parser.add_argument('--image-mode', choices=NOTEBOOK_IMAGE_MODES, default='inline')
+    parser.add_argument('--output-max-lines', type=int, default=0,
+                        help='Cut down printed outputs longer than this (default: keep them whole)')
+    parser.add_argument('--full-outputs', action='store_true',
+                        help='Also write cut down outputs in full next to the notebooks')
+    parser.add_argument('--notebooks-dir', default=DEFAULT_NOTEBOOKS_DIR)
+    parser.add_argument('--workers', type=int, default=DEFAULT_NUM_WORKERS)
+    parser.add_argument('--force', action='store_true', help='Rebake tasks even if they did not change')
+    args = parser.parse_args()
+
+    rater_id = args.rater_id or rater_id_from_jobs()
+    if not rater_id:
+        parser.error('Pass --rater-id, or run from the directory of your jobs.json')
+
+    output_budget = None
+    if args.output_max_lines > 0:
+        output_budget = OutputBudget(
+            max_lines=args.output_max_lines,
+            head_lines=args.output_max_lines // 2,
+            tail_lines=args.output_max_lines // 4,
+            sidecar=args.full_outputs,
+        )
+
+    manifest_path = os.path.join(args.notebooks_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    start = time.perf_counter()
+    skipped = 0
+    failed = 0
+    baked = {}
+    with futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        pending = {}
+        for job in make_jobs(args.outputs, rater_id, args.image_mode, output_budget, args.notebooks_dir,
+                             set(args.tasks or ())):
+            key = f"{'lti-' if job['lti'] else ''}{'gpt' if job['html'] else 'gemini'}:{job['task_id']}"
+            recorded = manifest.get(key)
+            if (not args.force and recorded and recorded['hash'] == job['hash']
+                    and os.path.exists(recorded['notebook'])):
+                skipped += 1
+                continue
+            pending[executor.submit(bake_task, job)] = (key, job['hash'])
+
+        for future in futures.as_completed(pending):
+            key, job_hash = pending[future]
+            try:
+                notebook_path = future.result()
+            except Exception as e:
+                print(f'[x] Could not bake {key}: {e}')
+                failed += 1
+                continue
+            baked[key] = {'hash': job_hash, 'notebook': notebook_path}
+            print(f'[x] Baked {notebook_path}')
+
+    if baked:
+        manifest.update(baked)
+        os.makedirs(args.notebooks_dir, exist_ok=True)
+        write_atomically(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+    print(f'[x] {len(baked)} notebooks baked, {skipped} unchanged, {failed} failed'
+          f' in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmarks PNG render times of large line and scatter charts, with and
+without `downsample_spec`.
+
+First checks that charts whose positions are not both quantitative or
+temporal, or whose lines are not drawn along x, are left alone. Exits with
+status 1 if any of them is downsampled.
+
+Usage: python benchmark_downsampling.py [max_points]
+"""
+
+import sys
+import time
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import vl_convert as vlc
+
+from altair_post_processing import DEFAULT_MAX_POINTS
+from spec_post_processing import downsample_spec
+
+
+ROW_COUNTS = [10_000, 100_000, 500_000]
+SERIES = ['a', 'b', 'c', 'd']
+
+
+def line_chart(rows, rng):
+    dates = pd.date_range('2020-01-01', periods=rows // len(SERIES), freq='min')
+    data = pd.DataFrame({
+        'date': np.tile(dates, len(SERIES)),
+        'value': np.cumsum(rng.normal(size=len(dates) * len(SERIES))),
+        'series': np.repeat(SERIES, len(dates)),
+    })
+    return alt.Chart(data).mark_line().encode(x='date:T', y='value:Q', color='series:N')
+
+
+def scatter_chart(rows, rng):
+    data = pd.DataFrame({
+        'x': rng.normal(size=rows),
+        'y': rng.normal(size=rows),
+        'series': rng.choice(SERIES, rows),
+    })
+    return alt.Chart(data).mark_circle().encode(x='x:Q', y='y:Q', color='series:N')
+
+
+def line_data(rows, rng):
+    return pd.DataFrame({
+        'date': pd.date_range('2020-01-01', periods=rows, freq='min'),
+        'value': np.cumsum(rng.normal(size=rows)),
+        'day': np.arange(rows) % 7,
+    })
+
+
+# Name -> function building a chart that must not be downsampled from its data
+UNSUPPORTED_CHARTS = {
+    'ordinal_x': lambda data: alt.Chart(data).mark_line().encode(x='day:O', y='value:Q'),
+    'nominal_y': lambda data: alt.Chart(data).mark_point().encode(x='date:T', y='day:N'),
+    'vertical_line': lambda data: alt.Chart(data).mark_line().encode(x='value:Q', y='date:T'),
+    'set_orient': lambda data: alt.Chart(data).mark_line(orient='vertical').encode(x='date:T', y='value:Q'),
+    'sorted_x': lambda data: alt.Chart(data).mark_line().encode(x=alt.X('date:T', sort='descending'), y='value:Q'),
+}
+
+
+def check_unsupported(max_points, rng):
+    """Problems with the charts that must not be downsampled, empty if none is."""
+    data = line_data(2 * max_points, rng)
+    problems = []
+    for name, make_chart in UNSUPPORTED_CHARTS.items():
+        if downsample_spec(make_chart(data).to_dict(), max_points):
+            problems.append(f'{name} was downsampled')
+    return problems
+
+
+def time_render(spec):
+    start = time.perf_counter()
+    vlc.vegalite_to_png(spec, scale=2)
+    return time.perf_counter() - start
+
+
+def main():
+    max_points = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_POINTS
+    alt.data_transformers.disable_max_rows()
+    rng = np.random.default_rng(0)
+    problems = check_unsupported(max_points, rng)
+    for problem in problems:
+        print(f'FAIL {problem}')
+    if problems:
+        return 1
+
+    time_render(line_chart(100, rng).to_dict())  # Warm up the renderer.
+
+    print(f'{"chart":<10}{"rows":>10}{"render":>10}{"sample":>10}{"render":>10}{"speedup":>10}')
+    for make_chart in [line_chart, scatter_chart]:
+        for rows in ROW_COUNTS:
+            spec = make_chart(rows, rng).to_dict()
+            full_time = time_render(spec)
+
+            start = time.perf_counter()
+            downsample_spec(spec, max_points)
+            sample_time = time.perf_counter() - start
+            sampled_time = time_render(spec)
+
+            name = make_chart.__name__.replace('_chart', '')
+            print(f'{name:<10}{rows:>10}{full_time:>9.2f}s{sample_time:>9.2f}s{sampled_time:>9.2f}s'
+                  f'{full_time / (sample_time + sampled_time):>9.1f}x')
+            print(f'[x] {spec["description"]}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Benchmarks building cbrfo5 notebook cells straight from ICE flow events.
+
+Compares `iter_event_cells` with the previous path (kept below as a
+reference), which wrote the events into a fenced response, inserted the plot
+images with a regex and tokenized the result with `iter_notebook_cells`, on
+random turns. Turns mix code, printed outputs, errors, model text with plot
+tags and fenced snippets, and events that are skipped, and both paths must
+give the same cells. Outputs that print fences, which the previous path split
+into the wrong cells, must stay one cell. Exits with status 1 if any check
+fails.
+
+Usage: python benchmark_event_cells.py [num_turns]
+"""
+
+import random
+import re
+import sys
+import time
+
+from bake_notebook import iter_event_cells, iter_notebook_cells
+
+
+DEFAULT_NUM_TURNS = 3000
+EVENT_TAGS = [
+    'EVENT_TAG_CODE',
+    'EVENT_TAG_CODE_MSG_OUT',
+    'EVENT_TAG_CODE_ERROR_OUT',
+    'EVENT_TAG_OUTPUT_TO_USER',
+    'EVENT_TAG_CODE_GENERATED_IMAGE_OUT',
+    'EVENT_TAG_THOUGHT',
+]
+TEXT_EVENT_TAGS = {'EVENT_TAG_OUTPUT_TO_USER', 'EVENT_TAG_CODE_GENERATED_IMAGE_OUT'}
+LINES = ['  x = 1', '', 'print(df.head())', ' 3  4.5 ', 'The mean is 4.2.', '  ']
+FENCED_SNIPPETS = [
+    'Here is how:\n```python\nimport pandas as pd\ndf = pd.read_csv("data.csv")\n```',
+    'It prints:\n```text\n   a  b\n0  1  2\n```\nas expected.',
+    '```\nplain fence\n```',
+]
+IMAGE = 'iVBORw0KGgo='
+
+
+def reference_replace_json_tags(notebook_str, base64_images):
+    """The previous utils.replace_json_tags."""
+    counter = 0
+
+    def replacement_func(match):
+        nonlocal counter
+        replacement_text = match.group(0)
+        if counter < len(base64_images) and base64_images[counter] is not None:
+            replacement_text = f"![Plot {counter}](data:image/png;base64,{base64_images[counter]})\n{match.group(0)}"
+        counter += 1
+        return replacement_text
+
+    return re.sub(r"\[(json-tag|image-tag): [^]]+\]", replacement_func, notebook_str)
+
+
+def reference_event_cells(events, base64_images):
+    """The previous path: events to a fenced response, plots by regex, then cells."""
+    notebook_str = ""
+    for event in events:
+        if event['eventTag'] == 'EVENT_TAG_CODE':
+            notebook_str += f"```python?code_reference&code_event_index=2\n{event['eventMsg']}\n```\n"
+        elif event['eventTag'] in ['EVENT_TAG_CODE_MSG_OUT', 'EVENT_TAG_CODE_ERROR_OUT']:
+            notebook_str += f"```text?code_stdout&code_event_index=2\n{event['eventMsg']}\n```\n"
+        elif event['eventTag'] in TEXT_EVENT_TAGS:
+            notebook_str += event['eventMsg'] + "\n"
+    notebook_str = reference_replace_json_tags(notebook_str, base64_images)
+    return list(iter_notebook_cells(notebook_str.split("\n")))
+
+
+def random_turn(rng):
+    """Events of a random turn, and the rendered images of its plot tags."""
+    events = []
+    num_tags = 0
+    for _ in range(rng.randint(0, 12)):
+        tag = rng.choice(EVENT_TAGS)
+        lines = [rng.choice(LINES) for _ in range(rng.randint(0, 6))]
+        if tag in TEXT_EVENT_TAGS:
+            if rng.random() < 0.4:
+                lines.insert(rng.randint(0, len(lines)), f'See [json-tag: code-generated-json-{num_tags}] above')
+                num_tags += 1
+            if rng.random() < 0.3:
+                lines.insert(rng.randint(0, len(lines)), rng.choice(FENCED_SNIPPETS))
+        events.append({'eventTag': tag, 'eventMsg': '\n'.join(lines)})
+    images = [rng.choice([None, IMAGE]) for _ in range(rng.randint(0, num_tags + 1))]
+    return events, images
+
+
+def check_fenced_output():
+    """Problems with an output that prints fences, empty if it stays one cell."""
+    output = 'Rendered markdown:\n```\nprint(1)\n```'
+    cells = list(iter_event_cells([{'eventTag': 'EVENT_TAG_CODE_MSG_OUT', 'eventMsg': output}]))
+    expected = [('markdown', '```\n' + output + '\n```\n')]
+    return [] if cells == expected else [f'printed fences split the output: {cells}']
+
+
+def main():
+    num_turns = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_TURNS
+    rng = random.Random(0)
+    turns = [random_turn(rng) for _ in range(num_turns)]
+
+    problems = check_fenced_output()
+    for index, (events, images) in enumerate(turns):
+        if list(iter_event_cells(events, images)) != reference_event_cells(events, images):
+            problems.append(f'turn {index} differs from the previous path: {events}')
+            if len(problems) >= 5:
+                break
+
+    timings = {}
+    for name, build_cells in [('before', reference_event_cells), ('after', lambda *turn: list(iter_event_cells(*turn)))]:
+        start = time.perf_counter()
+        for events, images in turns:
+            build_cells(events, images)
+        timings[name] = time.perf_counter() - start
+    print(f'{num_turns} turns: {timings["before"]:.3f}s before, {timings["after"]:.3f}s after'
+          f' ({timings["before"] / timings["after"]:.1f}x)')
+
+    for problem in problems:
+        print(f'FAIL {problem}')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""Benchmarks turning ChatGPT HTML responses into notebook cells.
+
+Compares `iter_html_cells` with the previous BeautifulSoup converter (kept
+below as a reference, with the same ancestry-based de-duplication of nested
+lists) on synthetic responses of growing size, written with
+the markup ChatGPT uses (paragraphs, highlighted code blocks, nested lists,
+output images, and a copy of every code block as in its "overflow-hidden"
+blocks), and checks both give the same cells. Pass a recorded outputs file to
+also check every response in it:
+
+    python benchmark_html_to_notebook.py --recorded gpt-outputs.json
+"""
+
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+from bake_notebook import iter_html_cells
+
+
+DEFAULT_BLOCK_COUNTS = [10, 100, 1000]
+
+
+def reference_nested_list(tag, level=0, ordered=False):
+    items = []
+    indent = '  ' * level
+    prefix_no = 0
+
+    for li in tag.find_all('li', recursive=False):
+        nested_ul = li.find('ul')
+        nested_ol = li.find('ol')
+        if nested_ul:
+            nested_ul.extract()
+        if nested_ol:
+            nested_ol.extract()
+
+        prefix = f'{prefix_no+1}. ' if ordered else '- '
+        for code_tag in li.find_all('code'):
+            code_tag.insert_before('`')
+            code_tag.insert_after('`')
+            code_tag.unwrap()
+        for code_tag in li.find_all('strong'):
+            code_tag.insert_before('**')
+            code_tag.insert_after('**')
+            code_tag.unwrap()
+
+        items.append(indent + prefix + li.get_text().strip())
+
+        if nested_ul:
+            items.append(reference_nested_list(nested_ul, level + 1, ordered=False))
+            li.append(nested_ul)
+        elif nested_ol:
+            items.append(reference_nested_list(nested_ol, level + 1, ordered=True))
+            li.append(nested_ol)
+        prefix_no += 1
+    return '\n'.join(items)
+
+
+def reference_html_cells(html_content):
+    """The previous converter, returning (cell type, source) tuples."""
+    cells = []
+    soup = BeautifulSoup(html_content, 'html.parser')
+    emitted_lists = set()
+    img_counter = 1
+    for tag in soup.find_all(['p', 'pre', 'h3', 'ol', 'ul', 'img']):
+        if tag.name == 'p':
+            for code_tag in tag.find_all('code'):
+                code_tag.insert_before('`')
+                code_tag.insert_after('`')
+                code_tag.unwrap()
+            for code_tag in tag.find_all('strong'):
+                code_tag.insert_before('**')
+                code_tag.insert_after('**')
+                code_tag.unwrap()
+            cells.append(("markdown", [tag.get_text() + "\n"]))
+        elif tag.name == 'pre':
+            code_content = tag.find('code')
+            if code_content:
+                cells.append(("code", [cl + '\n' for cl in code_content.get_text().splitlines()]))
+            else:
+                cells.append(("markdown", ["```\n" + tag.get_text() + "\n```\n"]))
+        elif tag.name == 'h3':
+            cells.append(("markdown", ["### " + tag.get_text() + "\n"]))
+        elif tag.name in ('ol', 'ul'):
+            if not any(id(parent) in emitted_lists for parent in tag.parents):
+                list_items = reference_nested_list(tag, ordered=tag.name == 'ol')
+                cells.append(("markdown", [list_items + "\n"]))
+                emitted_lists.add(id(tag))
+        elif tag.name == 'img':
+            match = re.search(r'<img[^>]*src="([^"]*)"', str(tag))
+            if match:
+                cells.append(("markdown", [f'![Plot {img_counter}](data:image/png;base64,{match.group(1)})\n']))
+                img_counter += 1
+    return cells
+
+
+WORDS = ['data', 'column', 'value', 'mean', 'rows', 'chart', 'the', 'of', 'sales', 'region', 'plot', 'missing']
+
+
+def sentence(rng, inline=True):
+    words = list(rng.choice(WORDS, int(rng.integers(4, 14))))
+    if inline:
+        i = int(rng.integers(len(words)))
+        words[i] = rng.choice([f'<code>{words[i]}</code>', f'<strong>{words[i]}</strong>',
+                               f'<em>{words[i]}</em>', f'<a href="https://example.com/?a=1&amp;b=2">{words[i]}</a>'])
+    return ' '.join(words).capitalize() + '.'
+
+
+def code_block(rng):
+    lines = ['<span class="hljs-keyword">import</span> pandas <span class="hljs-keyword">as</span> pd',
+             'df = pd.read_csv(<span class="hljs-string">&#x27;data.csv&#x27;</span>)']
+    lines += [f'df[<span class="hljs-string">&#x27;col_{i}&#x27;</span>] = df[<span class="hljs-string">&#x27;value&#x27;</span>] * {i}'
+              for i in range(int(rng.integers(1, 30)))]
+    return ('<pre class="!overflow-visible"><div class="dark bg-gray-950 rounded-md">'
+            '<div class="flex items-center relative px-4 py-2 text-xs"><span>python</span>'
+            '<div class="flex items-center"><button class="flex gap-1 items-center">'
+            '<svg width="24" height="24" viewBox="0 0 24 24"><path fill="currentColor" d="M7 5C7 3.34"></path></svg>'
+            'Copy code</button></div></div><div class="overflow-y-auto p-4" dir="ltr">'
+            '<code class="!whitespace-pre hljs language-python">' + '\n'.join(lines) + '\n</code></div></div></pre>')
+
+
+def nested_list(rng, depth=0):
+    tag = 'ol' if rng.random() < 0.5 else 'ul'
+    items = []
+    for _ in range(int(rng.integers(1, 5))):
+        item = f'<p>{sentence(rng)}</p>' if rng.random() < 0.5 else sentence(rng)
+        if depth < 2 and rng.random() < 0.4:
+            item += nested_list(rng, depth + 1)
+        items.append(f'<li>{item}</li>')
+    return f'<{tag}>' + ''.join(items) + f'</{tag}>'
+
+
+def make_response(num_blocks, rng):
+    """Assistant message markup with `num_blocks` paragraphs, lists, code blocks and images."""
+    blocks = []
+    code_copies = []
+    for _ in range(num_blocks):
+        kind = rng.choice(['p', 'p', 'h3', 'list', 'code', 'img'])
+        if kind == 'p':
+            blocks.append(f'<p>{sentence(rng)} {sentence(rng)}</p>')
+        elif kind == 'h3':
+            blocks.append(f'<h3>{sentence(rng, inline=False)}</h3>')
+        elif kind == 'list':
+            blocks.append(nested_list(rng))
+        elif kind == 'code':
+            code = code_block(rng)
+            blocks.append(code)
+            code_copies.append(f'<div class="overflow-hidden">{code}</div>')
+        else:
+            pixels = rng.integers(0, 256, 3000, dtype=np.uint8).tobytes().hex()
+            blocks.append(f'<div class="mb-3 max-w-[80%]"><img alt="Output image" src="{pixels}"/></div>')
+    message = ('<div class="flex w-full flex-col gap-1"><div class="markdown prose w-full break-words">'
+               + ''.join(blocks) + '</div></div>')
+    return '\n' + '\n'.join([message] + code_copies)
+
+
+def recorded_responses(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        outputs = json.load(f)
+    for task_id, turns in outputs.items():
+        for turn in turns:
+            if 'html_response' in turn:
+                yield task_id, turn['html_response']
+
+
+def best_time(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, nargs='+', default=DEFAULT_BLOCK_COUNTS)
+    parser.add_argument('--recorded', help='gpt-outputs.json style file of recorded responses')
+    args = parser.parse_args()
+
+    if args.recorded:
+        checked = 0
+        for task_id, html_content in recorded_responses(args.recorded):
+            if list(iter_html_cells(html_content)) != reference_html_cells(html_content):
+                raise AssertionError(f'Cells differ for a response of task {task_id}')
+            checked += 1
+        print(f'[x] {checked} recorded responses give the same cells')
+
+    rng = np.random.default_rng(0)
+    print(f'{"blocks":>8}{"size":>10}{"before":>10}{"after":>10}{"speedup":>10}')
+    for num_blocks in args.blocks:
+        response = make_response(num_blocks, rng)
+        before, reference_cells = best_time(reference_html_cells, response)
+        after, cells = best_time(lambda html: list(iter_html_cells(html)), response)
+        if cells != reference_cells:
+            raise AssertionError(f'Cells differ for a {num_blocks} block response')
+        print(f'{num_blocks:>8}{len(response) / 2**10:>8.0f}KB{before:>9.3f}s{after:>9.3f}s{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmarks the PNG optimization stage on rendered charts and screenshots.
+
+Renders synthetic charts with vl-convert at the scale cbrfo5.py uses (bars,
+scatter plots, lines, heatmaps and oversized concatenations), adds
+screenshot-like images with metadata, optimizes them all through an
+`ImageOptimizer` and reports the size reduction per image and in total. Every
+image that keeps its size is checked to have exactly the same pixels.
+
+Usage: python benchmark_image_optimization.py [num_workers]
+"""
+
+import io
+import sys
+import time
+
+import numpy as np
+import vl_convert as vlc
+from PIL import Image, PngImagePlugin
+
+from image_optimization import DEFAULT_NUM_WORKERS, ImageOptimizer
+
+
+RENDER_SCALE = 2
+CATEGORIES = [f'Category {i}' for i in range(12)]
+
+
+def bar_spec(rng):
+    values = [{'category': c, 'value': float(v)} for c, v in zip(CATEGORIES, rng.gamma(2.0, 50.0, len(CATEGORIES)))]
+    return {'data': {'values': values}, 'mark': 'bar',
+            'encoding': {'x': {'field': 'category', 'type': 'nominal'}, 'y': {'field': 'value', 'type': 'quantitative'}}}
+
+
+def scatter_spec(rng):
+    values = [{'x': float(x), 'y': float(y), 'group': CATEGORIES[i % 5]} for i, (x, y) in enumerate(rng.normal(size=(3000, 2)))]
+    return {'data': {'values': values}, 'mark': {'type': 'point', 'opacity': 0.5},
+            'encoding': {'x': {'field': 'x', 'type': 'quantitative'}, 'y': {'field': 'y', 'type': 'quantitative'},
+                         'color': {'field': 'group', 'type': 'nominal'}}}
+
+
+def line_spec(rng):
+    values = [{'day': i, 'value': float(v), 'group': CATEGORIES[i % 3]} for i, v in enumerate(rng.normal(size=900).cumsum())]
+    return {'data': {'values': values}, 'mark': 'line',
+            'encoding': {'x': {'field': 'day', 'type': 'quantitative'}, 'y': {'field': 'value', 'type': 'quantitative'},
+                         'color': {'field': 'group', 'type': 'nominal'}}}
+
+
+def heatmap_spec(rng):
+    values = [{'x': x, 'y': y, 'value': float(rng.random())} for x in CATEGORIES for y in CATEGORIES]
+    return {'data': {'values': values}, 'mark': 'rect',
+            'encoding': {'x': {'field': 'x', 'type': 'nominal'}, 'y': {'field': 'y', 'type': 'nominal'},
+                         'color': {'field': 'value', 'type': 'quantitative'}}}
+
+
+def concatenated_spec(rng):
+    return {'hconcat': [bar_spec(rng), scatter_spec(rng), line_spec(rng), heatmap_spec(rng)]}
+
+
+CHARTS = {
+    'bar': bar_spec,
+    'scatter': scatter_spec,
+    'line': line_spec,
+    'heatmap': heatmap_spec,
+    'concatenated': concatenated_spec,
+}
+
+
+def screenshot(rng, width=1200, height=800):
+    """RGBA screenshot of a plot area with an ICC profile and text chunks, as Chrome saves them."""
+    pixels = np.full((height, width, 4), 255, dtype=np.uint8)
+    for _ in range(40):
+        x, y = rng.integers(0, width - 100), rng.integers(0, height - 100)
+        pixels[y:y + 80, x:x + 80, :3] = rng.integers(0, 256, 3)
+    # Anti-aliased gradient, so the screenshot has too many colors for a palette
+    pixels[:, :, 0] = np.minimum(pixels[:, :, 0], np.linspace(0, 255, width, dtype=np.uint8))
+    info = PngImagePlugin.PngInfo()
+    info.add_text('Software', 'Chrome screenshot ' * 20)
+    output = io.BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(output, format='PNG', pnginfo=info, icc_profile=b'\0' * 3000, dpi=(144, 144))
+    return output.getvalue()
+
+
+def same_pixels(original, optimized):
+    original = Image.open(io.BytesIO(original))
+    optimized = Image.open(io.BytesIO(optimized))
+    if original.size != optimized.size:
+        return None
+    return np.array_equal(np.asarray(original.convert('RGBA')), np.asarray(optimized.convert('RGBA')))
+
+
+def main():
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_WORKERS
+    rng = np.random.default_rng(0)
+    images = {name: vlc.vegalite_to_png(make_spec(rng), scale=RENDER_SCALE) for name, make_spec in CHARTS.items()}
+    images['screenshot'] = screenshot(rng)
+
+    with ImageOptimizer(num_workers=num_workers) as optimizer:
+        start = time.perf_counter()
+        pending = {name: optimizer.submit(png) for name, png in images.items()}
+        optimized = {name: future.result() for name, future in pending.items()}
+        seconds = time.perf_counter() - start
+
+    print(f'{"image":<14}{"size":>12}{"before":>10}{"after":>10}{"saved":>8}  pixels')
+    for name, png in images.items():
+        size = Image.open(io.BytesIO(png)).size
+        identical = same_pixels(png, optimized[name])
+        if identical is False:
+            raise AssertionError(f'Optimizing the {name} image changed its pixels')
+        print(f'{name:<14}{size[0]:>6}x{size[1]:<5}{len(png) / 2**10:>8.0f}KB{len(optimized[name]) / 2**10:>8.0f}KB'
+              f'{1 - len(optimized[name]) / len(png):>8.0%}  {"same" if identical else "resized"}')
+    print(f'[x] {optimizer.stats.summary()} in {seconds:.2f}s with {num_workers} workers')
+
+
+if __name__ == '__main__':
+    main()
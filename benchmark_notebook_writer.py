@@ -0,0 +1,131 @@
+"""Benchmarks writing baked notebooks with and without nbformat.
+
+Builds text (Gemini) and HTML (GPT) notebooks of growing size, with prose,
+code cells and embedded plot images (inline and as attachments), and times
+the previous writers (nbformat.writes for text notebooks, json.dumps for HTML
+ones) against `write_notebook`, with and without validation. Every notebook
+written is checked to be byte-identical to what nbformat writes for it, to be
+valid, and to come out the same when written again.
+
+Usage: python benchmark_notebook_writer.py [num_cells ...]
+"""
+
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import nbformat
+import numpy as np
+from nbformat.v4 import new_notebook
+from PIL import Image
+
+from bake_notebook import IPYNBGenerator, externalize_cell_images, write_notebook
+from benchmark_html_to_notebook import make_response as html_response
+
+
+DEFAULT_CELL_COUNTS = [100, 500, 2000]
+# Share of text turns' blocks that are plots
+IMAGE_SHARE = 0.1
+
+
+def plot_image(rng):
+    pixels = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='PNG')
+    return base64.b64encode(output.getvalue()).decode('ascii')
+
+
+def text_response(num_blocks, rng, images):
+    """Fenced response of `num_blocks` prose lines, code blocks, outputs and plots."""
+    lines = []
+    for i in range(num_blocks):
+        kind = rng.random()
+        if kind < IMAGE_SHARE:
+            lines.append(f'![Plot {i}](data:image/png;base64,{images[i % len(images)]})')
+        elif kind < 0.4:
+            lines += ['```python', 'import pandas as pd', "df = pd.read_csv('data.csv')", f'df.head({i})', '```']
+        elif kind < 0.6:
+            lines += ['```text', '\n'.join(f'{r:>6} {rng.normal():>10.4f}' for r in range(20)), '```']
+        else:
+            lines.append(f'The mean of column {i} is {rng.normal():.3f}, see the table above.')
+    return '\n'.join(lines)
+
+
+def turns(num_cells, rng, html):
+    images = [plot_image(rng) for _ in range(8)]
+    items = []
+    for i in range(max(1, num_cells // 50)):
+        item = {'prompt': f'Question {i}', 'prompt_files': ['data/data.csv'], 'prompt_file_urls': [''],
+                'timestamp': str(i)}
+        if html:
+            item['html_response'] = html_response(50, rng)
+        else:
+            item['response_with_image'] = text_response(50, rng, images)
+        items.append(item)
+    return items
+
+
+def notebook_cells(items, html, image_mode, notebook_dir):
+    generator = IPYNBGenerator(notebook_dir, rater_id='1', task_id='1', image_mode=image_mode)
+    make_cells = generator.html_turn_cells if html else generator.text_turn_cells
+    return [externalize_cell_images(cell, image_mode, notebook_dir)
+            for index, item in enumerate(items) for cell in make_cells(index, item)]
+
+
+def previous_writer(filepath, cells, html):
+    if html:
+        notebook_str = json.dumps({'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4}, indent=0)
+    else:
+        nb = new_notebook()
+        nb['cells'] = cells
+        notebook_str = nbformat.writes(nb) + '\n'
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(notebook_str)
+
+
+def best_time(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def read_bytes(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def main():
+    cell_counts = [int(count) for count in sys.argv[1:]] or DEFAULT_CELL_COUNTS
+    rng = np.random.default_rng(0)
+    print(f'{"notebook":<20}{"cells":>7}{"size":>10}{"before":>10}{"after":>10}{"validated":>11}{"speedup":>9}')
+    with tempfile.TemporaryDirectory() as notebook_dir:
+        filepath = os.path.join(notebook_dir, 'notebook.ipynb')
+        for num_cells in cell_counts:
+            for html, image_mode in [(False, 'inline'), (False, 'attachments'), (True, 'inline')]:
+                cells = notebook_cells(turns(num_cells, rng, html), html, image_mode, notebook_dir)
+                before = best_time(previous_writer, filepath, cells, html)
+                validated = best_time(write_notebook, filepath, cells, True)
+                after = best_time(write_notebook, filepath, cells, False)
+
+                written = read_bytes(filepath)
+                expected = nbformat.writes(nbformat.reads(written.decode('utf-8'), as_version=4)) + '\n'
+                if written != expected.encode('utf-8'):
+                    raise AssertionError(f'Notebook of {len(cells)} cells differs from what nbformat writes')
+                write_notebook(filepath, cells)
+                if read_bytes(filepath) != written:
+                    raise AssertionError(f'Notebook of {len(cells)} cells differs when written again')
+
+                name = f'{"html" if html else "text"} {image_mode}'
+                print(f'{name:<20}{len(cells):>7}{len(written) / 2**20:>8.1f}MB{before:>9.3f}s{after:>9.3f}s'
+                      f'{validated:>10.3f}s{before / after:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""Benchmark corpus and regression check for baking notebooks.
+
+The corpus is a directory of outputs files (in the format of
+gemini-outputs.json and gpt-outputs.json) in several size classes, from a few
+KB to multi-MB responses with many plot images and deeply nested lists:
+
+- gemini-[size].json: fenced markdown responses, baked as text notebooks
+- gpt-[size].json: ChatGPT HTML responses, baked as HTML notebooks
+- gpt-lists-[size].json: HTML responses made only of deeply nested lists,
+  converted to cells on their own (the nested list converter)
+- [gemini|gpt]-recorded.json: anonymized copies of recorded outputs files
+
+Synthetic responses are generated from a fixed seed, so a corpus built from
+the same code is always the same. Recorded responses are anonymized: every
+word and number that is not a Python keyword, builtin or error name is
+replaced by a pseudo-word of the same length, files and URLs are renamed,
+and the markup, fences and plot images are kept.
+
+For every corpus file, the runner reports cells/s, input MB/s and peak memory
+of its converter, and hashes the notebooks (or cells) made. Record the hashes
+on a known good commit, then check that a change does not alter any notebook:
+
+    python benchmark_notebooks.py --build-corpus --recorded gemini-outputs.json gpt-outputs.json
+    python benchmark_notebooks.py --update-expected
+    python benchmark_notebooks.py --check
+"""
+
+import argparse
+import builtins
+import glob
+import hashlib
+import json
+import keyword
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from lxml import etree
+
+from bake_notebook import HTML_PARSER, IPYNBGenerator, iter_html_cells
+from benchmark_html_to_notebook import code_block, sentence
+from benchmark_notebook_writer import plot_image
+
+
+DEFAULT_CORPUS_DIR = 'benchmark_corpus'
+EXPECTED_NAME = 'expected.json'
+# Approximate size of every response of a size class
+SIZE_CLASSES = {
+    'small': 20 * 2**10,
+    'medium': 250 * 2**10,
+    'large': 2 * 2**20,
+    'xlarge': 6 * 2**20,
+}
+TASKS_PER_CLASS = 2
+TURNS_PER_TASK = 2
+# Nested lists of list responses go this deep
+MAX_LIST_DEPTH = 6
+
+# Kept by the anonymizer, so fences, code and tracebacks keep their structure
+KEPT_WORDS = set(keyword.kwlist) | set(dir(builtins)) | {
+    'python', 'text', 'code_stdout', 'code_stderr', 'Traceback', 'most', 'recent', 'call', 'last',
+    'File', 'line', 'module', 'import', 'pandas', 'pd', 'numpy', 'np', 'df', 'print', 'data', 'image', 'png', 'base64',
+}
+ANONYMIZED_REGEX = re.compile(r'(data:image/[a-z]+;base64,[A-Za-z0-9+/=]+)|[A-Za-z]+|[0-9]+')
+
+
+def gemini_response(size, rng, images):
+    """Fenced markdown response of about `size` bytes: prose, code, printed tables, errors and plots."""
+    parts = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.1:
+            part = f'![Chart shown as an image](data:image/png;base64,{images[int(rng.integers(len(images)))]})'
+        elif kind < 0.35:
+            part = '\n'.join(['```python', 'import pandas as pd', "df = pd.read_csv('data.csv')",
+                              f"print(df.groupby('region')['value_{int(rng.integers(100))}'].describe())", '```'])
+        elif kind < 0.55:
+            rows = [f'{i:>6} {"abcde"[i % 5] * 6:>10} {rng.normal():>11.4f}' for i in range(int(rng.integers(5, 400)))]
+            part = '\n'.join(['```text?code_stdout', '      id   category       value'] + rows + ['```'])
+        elif kind < 0.6:
+            part = '\n'.join(['```text?code_stderr', 'Traceback (most recent call last):',
+                              '  File "<string>", line 3, in <module>', "KeyError: 'value'", '```'])
+        else:
+            part = f'{sentence(rng, inline=False)} {sentence(rng, inline=False)}'
+        parts.append(part)
+        length += len(part) + 1
+    return '\n'.join(parts)
+
+
+def nested_list(rng, max_depth, depth=0):
+    tag = 'ol' if rng.random() < 0.5 else 'ul'
+    items = []
+    for _ in range(int(rng.integers(1, 5))):
+        item = f'<p>{sentence(rng)}</p>' if rng.random() < 0.5 else sentence(rng)
+        if depth < max_depth and rng.random() < 0.5:
+            item += nested_list(rng, max_depth, depth + 1)
+        items.append(f'<li>{item}</li>')
+    return f'<{tag}>' + ''.join(items) + f'</{tag}>'
+
+
+def gpt_response(size, rng, images, lists_only=False):
+    """ChatGPT message markup of about `size` bytes, as chatgpt.py records it."""
+    blocks = []
+    length = 0
+    while length < size:
+        kind = 'list' if lists_only else rng.choice(['p', 'p', 'h3', 'list', 'code', 'img'])
+        if kind == 'p':
+            block = f'<p>{sentence(rng)} {sentence(rng)}</p>'
+        elif kind == 'h3':
+            block = f'<h3>{sentence(rng, inline=False)}</h3>'
+        elif kind == 'list':
+            block = nested_list(rng, MAX_LIST_DEPTH if lists_only else 2)
+        elif kind == 'code':
+            block = code_block(rng)
+        else:
+            block = f'<img alt="Output image" src="{images[int(rng.integers(len(images)))]}">'
+        blocks.append(block)
+        length += len(block)
+    return ('<div class="flex w-full flex-col gap-1"><div class="markdown prose w-full break-words">'
+            + ''.join(blocks) + '</div></div>')
+
+
+def synthetic_outputs(kind, size, rng, images):
+    outputs = {}
+    for task in range(TASKS_PER_CLASS):
+        turns = []
+        for turn in range(TURNS_PER_TASK):
+            item = {'prompt': sentence(rng, inline=False), 'prompt_files': ['data/data.csv'],
+                    'prompt_file_urls': ['https://example.com/data.csv'], 'timestamp': f'2024-01-01 00:00:0{turn}'}
+            if kind == 'gemini':
+                item['response_with_image'] = gemini_response(size, rng, images)
+            else:
+                item['html_response'] = gpt_response(size, rng, images, lists_only=kind == 'gpt-lists')
+            turns.append(item)
+        outputs[str(1000 + task)] = turns
+    return outputs
+
+
+def pseudo_word(match):
+    word = match.group(0)
+    if match.group(1) or word in KEPT_WORDS or word.endswith(('Error', 'Exception')):
+        return word
+    digest = hashlib.sha256(word.encode('utf-8')).digest()
+    if word.isdigit():
+        return ''.join(str(digest[i % len(digest)] % 10) for i in range(len(word)))
+    letters = [chr(ord('a') + digest[i % len(digest)] % 26) for i in range(len(word))]
+    return ''.join(letter.upper() if char.isupper() else letter for letter, char in zip(letters, word))
+
+
+def anonymize_text(text):
+    return ANONYMIZED_REGEX.sub(pseudo_word, text)
+
+
+def anonymize_html(html_content):
+    root = etree.HTML(html_content, HTML_PARSER)
+    if root is None:
+        return html_content
+    for elem in root.iter():
+        if elem.text:
+            elem.text = anonymize_text(elem.text)
+        if elem.tail:
+            elem.tail = anonymize_text(elem.tail)
+    return etree.tostring(root, encoding='unicode', method='html')
+
+
+def anonymize_outputs(outputs):
+    anonymized = {}
+    for task_number, turns in enumerate(outputs.values()):
+        anonymized_turns = []
+        for item in turns:
+            anonymized_item = {
+                'prompt': anonymize_text(item['prompt']),
+                'prompt_files': [f'data/file_{i}{os.path.splitext(f)[1]}' for i, f in enumerate(item['prompt_files'])],
+                'prompt_file_urls': [f'https://example.com/file_{i}' for i in range(len(item['prompt_file_urls']))],
+                'timestamp': item.get('timestamp'),
+            }
+            if 'html_response' in item:
+                anonymized_item['html_response'] = anonymize_html(item['html_response'])
+            else:
+                # Fence lines keep their language, the rest of the text is anonymized
+                anonymized_item['response_with_image'] = '\n'.join(
+                    line if line.startswith('```') else anonymize_text(line)
+                    for line in item['response_with_image'].split('\n')
+                )
+            anonymized_turns.append(anonymized_item)
+        anonymized[f'{9000 + task_number}'] = anonymized_turns
+    return anonymized
+
+
+def write_json(path, value):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+
+
+def build_corpus(corpus_dir, recorded_paths):
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    images = [plot_image(rng) for _ in range(8)]
+    for size_class, size in SIZE_CLASSES.items():
+        for kind in ('gemini', 'gpt', 'gpt-lists'):
+            path = os.path.join(corpus_dir, f'{kind}-{size_class}.json')
+            write_json(path, synthetic_outputs(kind, size, rng, images))
+            print(f'[x] Wrote {path}')
+
+    recorded = {'gemini': {}, 'gpt': {}}
+    for recorded_path in recorded_paths:
+        with open(recorded_path, 'r', encoding='utf-8') as f:
+            outputs = json.load(f)
+        for turns in anonymize_outputs(outputs).values():
+            kind = 'gpt' if turns and 'html_response' in turns[0] else 'gemini'
+            recorded[kind][str(9000 + len(recorded[kind]))] = turns
+    for kind, outputs in recorded.items():
+        if outputs:
+            path = os.path.join(corpus_dir, f'{kind}-recorded.json')
+            write_json(path, outputs)
+            print(f'[x] Wrote {path} ({len(outputs)} anonymized tasks)')
+
+
+def bake_outputs(outputs, html, notebook_dir):
+    """Bakes every task's notebook, returning the number of cells and a hash of the notebooks."""
+    num_cells = 0
+    digest = hashlib.sha256()
+    for task_id, turns in sorted(outputs.items()):
+        output_path = os.path.join(notebook_dir, task_id)
+        os.makedirs(output_path, exist_ok=True)
+        ipynb_gen = IPYNBGenerator(output_path, rater_id='1', task_id=task_id, nb_for='GPT' if html else 'Gemini')
+        filepath = ipynb_gen.save_notebook(turns, html=html)
+        num_cells += sum(len(cells) for cells in ipynb_gen.turn_cells.values())
+        with open(filepath, 'rb') as f:
+            digest.update(f.read())
+    return num_cells, digest.hexdigest()
+
+
+def convert_lists(outputs, notebook_dir):
+    num_cells = 0
+    digest = hashlib.sha256()
+    for _, turns in sorted(outputs.items()):
+        for item in turns:
+            cells = list(iter_html_cells(item['html_response']))
+            num_cells += len(cells)
+            digest.update(json.dumps(cells).encode('utf-8'))
+    return num_cells, digest.hexdigest()
+
+
+def converter_for(name):
+    if name.startswith('gpt-lists-'):
+        return 'lists', convert_lists
+    if name.startswith('gpt-'):
+        return 'html', lambda outputs, notebook_dir: bake_outputs(outputs, True, notebook_dir)
+    return 'text', lambda outputs, notebook_dir: bake_outputs(outputs, False, notebook_dir)
+
+
+def input_bytes(outputs):
+    return sum(len(item.get('html_response', item.get('response_with_image', '')).encode('utf-8'))
+               for turns in outputs.values() for item in turns)
+
+
+def benchmark_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        outputs = json.load(f)
+    name = os.path.splitext(os.path.basename(path))[0]
+    converter_name, convert = converter_for(name)
+    with tempfile.TemporaryDirectory() as notebook_dir:
+        start = time.perf_counter()
+        num_cells, digest = convert(outputs, notebook_dir)
+        seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as notebook_dir:
+        tracemalloc.start()
+        convert(outputs, notebook_dir)
+        _, peak_memory_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'corpus': name,
+        'converter': converter_name,
+        'bytes': input_bytes(outputs),
+        'cells': num_cells,
+        'seconds': seconds,
+        'peak_memory_bytes': peak_memory_bytes,
+        'digest': digest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--build-corpus', action='store_true', help='(Re)build the corpus before running')
+    parser.add_argument('--recorded', nargs='+', default=[], help='Outputs files to anonymize into the corpus')
+    parser.add_argument('--classes', nargs='+', help='Only run corpus files of these size classes (or "recorded")')
+    parser.add_argument('--check', action='store_true', help='Fail if a notebook differs from the expected ones')
+    parser.add_argument('--update-expected', action='store_true', help='Record the notebooks made as the expected ones')
+    args = parser.parse_args()
+
+    if args.build_corpus or args.recorded:
+        build_corpus(args.corpus_dir, args.recorded)
+
+    paths = sorted(glob.glob(os.path.join(args.corpus_dir, '*-*.json')))
+    if args.classes:
+        paths = [path for path in paths if os.path.splitext(path)[0].rsplit('-', 1)[1] in args.classes]
+    if not paths:
+        parser.error(f'No corpus in {args.corpus_dir}, build it with --build-corpus')
+
+    expected_path = os.path.join(args.corpus_dir, EXPECTED_NAME)
+    try:
+        with open(expected_path, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+    except (OSError, ValueError):
+        expected = {}
+
+    print(f'{"corpus":<20}{"converter":<10}{"size":>9}{"cells":>8}{"time":>9}{"cells/s":>10}{"MB/s":>8}{"peak":>10}  notebooks')
+    mismatches = []
+    for path in paths:
+        result = benchmark_file(path)
+        recorded_digest = expected.get(result['corpus'])
+        if recorded_digest is None:
+            status = 'no expected'
+        elif recorded_digest == result['digest']:
+            status = 'same'
+        else:
+            status = 'DIFFERENT'
+            mismatches.append(result['corpus'])
+        if args.update_expected:
+            expected[result['corpus']] = result['digest']
+        seconds = max(result['seconds'], 1e-9)
+        print(f'{result["corpus"]:<20}{result["converter"]:<10}{result["bytes"] / 2**20:>7.2f}MB{result["cells"]:>8}'
+              f'{result["seconds"]:>8.3f}s{result["cells"] / seconds:>10.0f}{result["bytes"] / 2**20 / seconds:>8.1f}'
+              f'{result["peak_memory_bytes"] / 2**20:>7.1f}MiB  {status}')
+
+    if args.update_expected:
+        write_json(expected_path, expected)
+        print(f'[x] Expected notebooks recorded in {expected_path}')
+    if args.check and mismatches:
+        raise SystemExit(f'[x] Notebooks changed for: {", ".join(mismatches)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Benchmarks chart post-processing on synthetic charts of growing size.
+
+Every chart type exercises a different set of post-processors (bars, boxplots,
+pies with and without labels, labeled heatmaps, binned histograms, layered and
+concatenated charts). Each is run at every row/column count combination,
+reporting total time, per-processor time and peak memory. Results are saved
+as JSON so they can be compared between commits:
+
+    python benchmark_post_processing.py --output before.json
+    python benchmark_post_processing.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from altair_post_processing import post_process_chart
+from check_post_processing import (
+    bar_chart, boxplot_chart, concatenated_chart, histogram_chart, labeled_heatmap_chart, labeled_pie_chart,
+    layered_chart, make_data, pie_chart,
+)
+from spec_post_processing import post_process_spec
+
+
+DEFAULT_ROW_COUNTS = [100, 1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_COLUMN_COUNTS = [3, 20, 200]
+# Combinations above this many cells are skipped.
+DEFAULT_MAX_CELLS = 20_000_000
+CHARTS = {
+    'bar': bar_chart,
+    'boxplot': boxplot_chart,
+    'pie': pie_chart,
+    'labeled_pie': labeled_pie_chart,
+    'labeled_heatmap': labeled_heatmap_chart,
+    'histogram': histogram_chart,
+    'layered': layered_chart,
+    'concatenated': concatenated_chart,
+}
+
+
+def run_post_processing(engine, make_chart, data, instrument=False):
+    """Builds a fresh chart and post-processes it, returning the report."""
+    chart = make_chart(data)
+    if engine == 'spec':
+        spec = chart.to_dict()
+        return post_process_spec(spec, instrument=instrument)
+    return post_process_chart(chart, instrument=instrument)
+
+
+def benchmark_case(engine, make_chart, data):
+    # Total time, without any instrumentation overhead.
+    start = time.perf_counter()
+    run_post_processing(engine, make_chart, data)
+    total_seconds = time.perf_counter() - start
+
+    report = run_post_processing(engine, make_chart, data, instrument=True)
+
+    tracemalloc.start()
+    run_post_processing(engine, make_chart, data)
+    _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'total_seconds': total_seconds,
+        'peak_memory_bytes': peak_memory_bytes,
+        'bytes_pruned': report.bytes_pruned,
+        'bytes_compacted': report.bytes_compacted,
+        'processor_seconds': {name: stats.seconds for name, stats in report.processors.items()},
+        'processor_exceptions': {
+            name: dict(stats.exceptions) for name, stats in report.processors.items() if stats.exceptions
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline):
+    baseline_cases = {(r['chart'], r['rows'], r['columns']): r for r in baseline['results']}
+    print(f'\nCompared to {baseline.get("commit")}:')
+    for result in results:
+        old = baseline_cases.get((result['chart'], result['rows'], result['columns']))
+        if old is None:
+            continue
+        time_ratio = result['total_seconds'] / old['total_seconds'] if old['total_seconds'] else float('nan')
+        memory_ratio = result['peak_memory_bytes'] / old['peak_memory_bytes'] if old['peak_memory_bytes'] else float('nan')
+        print(f'{result["chart"]:<16}{result["rows"]:>9}{result["columns"]:>5}'
+              f'  time x{time_ratio:.2f}  memory x{memory_ratio:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=['altair', 'spec'], default='altair',
+                        help='post_process_chart (altair) or post_process_spec (spec)')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROW_COUNTS)
+    parser.add_argument('--columns', type=int, nargs='+', default=DEFAULT_COLUMN_COUNTS)
+    parser.add_argument('--charts', nargs='+', choices=list(CHARTS), default=list(CHARTS))
+    parser.add_argument('--max-cells', type=int, default=DEFAULT_MAX_CELLS)
+    parser.add_argument('--output', default='post_processing_benchmark.json')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    alt.data_transformers.disable_max_rows()
+    rng = np.random.default_rng(0)
+    results = []
+    for rows in args.rows:
+        for columns in args.columns:
+            if rows * columns > args.max_cells:
+                print(f'[x] Skipping {rows} rows x {columns} columns (over --max-cells)')
+                continue
+            data = make_data(rows, columns, rng)
+            for chart_name in args.charts:
+                result = benchmark_case(args.engine, CHARTS[chart_name], data)
+                result.update(chart=chart_name, rows=rows, columns=columns)
+                results.append(result)
+                slowest = max(result['processor_seconds'].items(), key=lambda item: item[1], default=('-', 0))
+                print(f'{chart_name:<16}{rows:>9}{columns:>5}  {result["total_seconds"]:8.3f}s'
+                      f'  {result["peak_memory_bytes"] / 2**20:8.1f}MiB  slowest: {slowest[0]} ({slowest[1]:.3f}s)')
+
+    output = {
+        'commit': git_commit(),
+        'engine': args.engine,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'altair': alt.__version__,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f'[x] Results saved to {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
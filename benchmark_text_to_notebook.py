@@ -0,0 +1,125 @@
+"""Benchmarks turning fenced model responses into notebook cells.
+
+Compares `iter_notebook_cells` with the previous tokenizer (kept below as a
+reference), which grew every fenced block with `+=`, on synthetic responses of
+growing size dominated by long printed outputs, and checks both give the same
+cells.
+
+Usage: python benchmark_text_to_notebook.py [size_in_mb ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from bake_notebook import iter_notebook_cells
+
+
+DEFAULT_SIZES_MB = [1, 4, 16]
+
+
+def reference_notebook_cells(notebook_string):
+    """The previous tokenizer, returning (cell type, source) tuples."""
+    lines = notebook_string.split("\n")
+
+    blocks = []
+    current_block = {"type": "", "content": ""}
+    inside_code_block = False
+    inside_text_block = False
+
+    for line in lines:
+        if line.startswith("```"):
+            if inside_code_block or inside_text_block:
+                if current_block["content"].strip():
+                    blocks.append(current_block)
+                current_block = {"type": "", "content": ""}
+                inside_code_block = False
+                inside_text_block = False
+            if "python" in line:
+                current_block["type"] = "code"
+                inside_code_block = True
+            elif "text" in line:
+                current_block["type"] = "markdown"
+                inside_text_block = True
+        elif inside_code_block or inside_text_block:
+            current_block["content"] += line + "\n"
+        else:
+            if current_block["content"].strip():
+                blocks.append(current_block)
+            current_block = {"type": "text", "content": line + "\n"}
+            blocks.append(current_block)
+            current_block = {"type": "", "content": ""}
+
+    if current_block["content"].strip():
+        blocks.append(current_block)
+
+    cells = []
+    for block in blocks:
+        if block["content"].strip():
+            if block["type"] == "code":
+                cells.append(("code", block["content"].strip()))
+            elif block["type"] == "text":
+                cells.append(("markdown", block["content"].strip()))
+            elif block["type"] == "markdown":
+                cells.append(("markdown", "```\n" + block["content"].strip() + "\n```\n"))
+    return cells
+
+
+def printed_dataframe(rows, rng):
+    lines = ['      id   category       value        date']
+    for i in range(rows):
+        lines.append(f'{i:>8} {"abcde"[i % 5] * 6:>10} {rng.normal():>11.4f}  2024-01-{i % 28 + 1:02d}')
+    return '\n'.join(lines)
+
+
+def make_response(size_mb, rng):
+    """Prose, code and mostly huge printed outputs, about `size_mb` MB."""
+    parts = []
+    size = 0
+    while size < size_mb * 2**20:
+        turn = [
+            'Here is the analysis of the uploaded file.',
+            '',
+            '```python',
+            'import pandas as pd',
+            "df = pd.read_csv('data.csv')",
+            'print(df.to_string())',
+            '```',
+            '```text',
+            printed_dataframe(int(rng.integers(5_000, 30_000)), rng),
+            '```',
+            'The table above shows every row.',
+            '* Values are roughly normal.',
+        ]
+        part = '\n'.join(turn)
+        parts.append(part)
+        size += len(part)
+    return '\n'.join(parts)
+
+
+def best_time(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    sizes = [float(size) for size in sys.argv[1:]] or DEFAULT_SIZES_MB
+    rng = np.random.default_rng(0)
+    print(f'{"size":>8}{"lines":>10}{"before":>10}{"after":>10}{"speedup":>10}')
+    for size_mb in sizes:
+        response = make_response(size_mb, rng)
+        before, reference_cells = best_time(reference_notebook_cells, response)
+        after, cells = best_time(lambda text: list(iter_notebook_cells(text.split('\n'))), response)
+        if cells != reference_cells:
+            raise AssertionError(f'Cells differ for a {size_mb}MB response')
+        print(f'{len(response) / 2**20:>6.1f}MB{response.count(chr(10)):>10}'
+              f'{before:>9.3f}s{after:>9.3f}s{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,18 +12,29 @@ import base64
 from PIL import Image
 from pprint import pprint
 from dotenv import load_dotenv
-from nbformat import write
-from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
+from nbformat.v4 import new_code_cell, new_markdown_cell
 from collections import defaultdict
-from altair_post_processing import post_process_chart
-from utils import ensure_directory_exists, replace_json_tags, update_prompt_output
-import altair as alt
-import vl_convert as vlc
+from altair_post_processing import PostProcessingMetrics, SharedDataCache
+from bake_notebook import OutputBudget, budget_cell_output, externalize_cell_images, iter_event_cells, write_notebook
+from image_optimization import ImageOptimizer
+from spec_post_processing import post_process_specs, pre_aggregate_spec
+from render_cache import CachedRender, RenderCache, render_key
+from render_service import RenderError, RenderService
+from utils import ensure_directory_exists, update_prompt_output
 
 load_dotenv()
 
 api_key = os.getenv("API_KEY")
 model   = os.getenv("MODEL")
+# Set POST_PROCESSING_METRICS=1 to time every chart post-processor
+post_processing_metrics = PostProcessingMetrics() if os.getenv("POST_PROCESSING_METRICS") else None
+# Identical charts are only post-processed and rendered once (per run, or across
+# runs if RENDER_CACHE_DIR is set)
+render_cache = RenderCache(cache_dir=os.getenv("RENDER_CACHE_DIR"))
+# Altair charts are rendered in warm worker processes, in parallel
+render_service = RenderService()
+# Rendered PNGs are shrunk (losslessly where possible) before they are saved
+image_optimizer = ImageOptimizer()
 
 url = f"https://preprod-generativelanguage.googleapis.com/v1beta/{model}:generateContent?key={api_key}"
 headers = {
@@ -51,63 +62,21 @@ except json.decoder.JSONDecodeError:
 pprint(JOBS)
 
 RATER_ID = JOBS['rater_id']
+# How plots are stored in notebooks, one of bake_notebook.NOTEBOOK_IMAGE_MODES
+NOTEBOOK_IMAGE_MODE = JOBS.get('notebook_image_mode', 'inline')
+# How much of long printed outputs notebooks keep, see bake_notebook.OutputBudget
+OUTPUT_BUDGET = OutputBudget.from_config(JOBS.get('notebook_output_budget'))
+# Whether large bar/pie/heatmap data is aggregated by pandas before rendering
+PRE_AGGREGATE_CHARTS = JOBS.get('pre_aggregate_charts', False)
 
 # String to notebook generation function
 def text_to_notebook(output_path, copy_idx, rater_id, task_id, text_dict_list) -> None:
-    # Create a new notebook object
-    nb = new_notebook()
-
     # List of cells to add to the notebook
     cells = []
 
-    # Function to process a single notebook string and add its cells to the cells list
-    def process_notebook_string(notebook_string):
-        lines = notebook_string.split("\n")
-        
-        blocks = []
-        current_block = {"type": "", "content": ""}
-        inside_code_block = False
-        inside_text_block = False
-
-        for line in lines:
-            if line.startswith("```"):
-                if inside_code_block or inside_text_block:
-                    if current_block["content"].strip():  # Only add block if content is not empty
-                        blocks.append(current_block)
-                    current_block = {"type": "", "content": ""}
-                    inside_code_block = False
-                    inside_text_block = False
-                if "python" in line:
-                    current_block["type"] = "code"
-                    inside_code_block = True
-                elif "text" in line:
-                    current_block["type"] = "markdown"
-                    inside_text_block = True
-            elif inside_code_block or inside_text_block:
-                current_block["content"] += line + "\n"
-            else:
-                if current_block["content"].strip():  # Only add block if content is not empty
-                    blocks.append(current_block)
-                current_block = {"type": "text", "content": line + "\n"}
-                blocks.append(current_block)
-                current_block = {"type": "", "content": ""}
-
-        if current_block["content"].strip():
-            blocks.append(current_block)
-
-        for block in blocks:
-            if block["content"].strip():
-                if block["type"] == "code":
-                    cells.append(new_code_cell(block["content"].strip()))
-                elif block["type"] == "text":
-                    cells.append(new_markdown_cell(block["content"].strip()))
-                elif block["type"] == "markdown":
-                    cells.append(new_markdown_cell( "```\n" + block["content"].strip()  + "\n```\n"))
-
     # Loop through the list of dictionaries and process each one
     for prompt_index, item in enumerate(text_dict_list):
         user_query = item['prompt']
-        notebook_string = item['response']
         prompt_files_str = ",".join([f.split('/')[-1] for f in item['prompt_files']])
         
         # Add a text cell for the user query
@@ -116,18 +85,21 @@ def text_to_notebook(output_path, copy_idx, rater_id, task_id, text_dict_list) -
         else:
             cells.append(new_markdown_cell(f"**User Query:** {user_query}\n\nturn: {prompt_index+1}"))
 
-        # Process the notebook string and add its cells
-        process_notebook_string(notebook_string)
-
-    # Assign cells to the notebook
-    nb['cells'] = cells
+        # Add the cells built from the turn's events
+        for cell_type, source in item['cells']:
+            if cell_type == "code":
+                cells.append(new_code_cell(source))
+            else:
+                cells.append(new_markdown_cell(source))
 
     # Save the notebook to a file
-    ensure_directory_exists(os.path.join(output_dir, f"copy_{copy_idx+1}"))
+    notebook_dir = os.path.join(output_path, f"copy_{copy_idx+1}")
+    ensure_directory_exists(notebook_dir)
 
-    filepath = os.path.join(output_path, f"copy_{copy_idx+1}", f"Gemini_rater_{rater_id}_ID_{task_id}.ipynb")
-    with open(filepath, 'w', encoding='utf-8') as f:
-        write(nb, f)
+    # Write the cells with long outputs cut down and plots stored as configured
+    cells = [budget_cell_output(cell, OUTPUT_BUDGET, notebook_dir) for cell in cells]
+    filepath = os.path.join(notebook_dir, f"Gemini_rater_{rater_id}_ID_{task_id}.ipynb")
+    write_notebook(filepath, [externalize_cell_images(cell, NOTEBOOK_IMAGE_MODE, notebook_dir) for cell in cells])
     print(f"Notebook has been saved to {filepath}")
 
 
@@ -146,6 +118,9 @@ for task in JOBS['tasks']:
 
     for copy_index in range(5):
         print(f'[x] Started Task ID: {task_id} {copy_index+1}/5.')
+        # Charts of the conversation mostly plot the same uploaded files, so their
+        # parsed data and column types are shared across turns
+        shared_chart_data = SharedDataCache()
 
         # Create a new dict object
         data = {
@@ -171,7 +146,6 @@ for task in JOBS['tasks']:
         files_uploaded = False
 
         for p_idx, prompt in enumerate(task['prompts']):
-            notebook_str = """"""
             is_first_turn = p_idx==0
 
             # Copy output dir
@@ -262,25 +236,11 @@ for task in JOBS['tasks']:
                 except Exception:
                     pass
             try:
-                for i in response.json()["candidates"][0]["content"]["parts"][part_idx]["structuredData"]["advancedIceFlow"]["iceFlowState"]["events"]:
-                    if i['eventTag'] in [
-                        'EVENT_TAG_CODE',
-                        'EVENT_TAG_CODE_MSG_OUT',
-                        'EVENT_TAG_CODE_ERROR_OUT',
-                        'EVENT_TAG_OUTPUT_TO_USER',
-                        'EVENT_TAG_CODE_GENERATED_IMAGE_OUT'
-                    ]:
-                        if i['eventTag'] == 'EVENT_TAG_CODE':
-                            notebook_str += f"```python?code_reference&code_event_index=2\n{i['eventMsg']}\n```\n"
-
-                        elif i['eventTag'] in ['EVENT_TAG_CODE_MSG_OUT','EVENT_TAG_CODE_ERROR_OUT']:
-                            notebook_str += f"```text?code_stdout&code_event_index=2\n{i['eventMsg']}\n```\n"
-                        else:
-                            notebook_str += i['eventMsg'] + "\n"
+                events = response.json()["candidates"][0]["content"]["parts"][part_idx]["structuredData"]["advancedIceFlow"]["iceFlowState"]["events"]
             except IndexError:
                 # Model probably encountered an error when executing prompt
                 event_msg = response.json()["candidates"][0]["content"]["parts"][0]['text']
-                notebook_str += event_msg
+                events = [{'eventTag': 'EVENT_TAG_OUTPUT_TO_USER', 'eventMsg': event_msg}]
 
             
             # Save Images For this Turn (if any)
@@ -306,24 +266,66 @@ for task in JOBS['tasks']:
              if "fileData" in part and part["fileData"].get("mimeType") == "application/json"]
             alt_links = [x["fileData"]["fileUri"] for x in alt_images]
             alt_base64_images = []
-            for im_idx, l in enumerate(alt_links):
+            # Post-process every chart of the turn and queue it on the render workers...
+            pending_renders = []
+            new_charts = []
+            for l in alt_links:
                 altair_json = requests.get(l).json()
-                altair_chart_object = alt.Chart.from_dict(altair_json)
-                post_process_chart(altair_chart_object)
+                cache_key = render_key(altair_json, scale=2, pre_aggregate=PRE_AGGREGATE_CHARTS, optimized=True)
+                cached = render_cache.get(cache_key)
+                if cached is not None:
+                    print('[x] Reusing previously rendered chart')
+                    pending_renders.append([cache_key, altair_json, cached.png])
+                    continue
+                pending_renders.append([cache_key, altair_json, None])
+                new_charts.append(pending_renders[-1])
+
+            # Post-process the Vega-Lite dicts directly (no altair objects needed), as
+            # one batch so charts of the same data share the work
+            reports = post_process_specs(
+                [altair_json for _, altair_json, _ in new_charts],
+                instrument=post_processing_metrics is not None,
+                shared_cache=shared_chart_data,
+            )
+            for pending_render, report in zip(new_charts, reports):
+                altair_json = pending_render[1]
+                if report.bytes_pruned:
+                    print(f'[x] Pruned ~{report.bytes_pruned} bytes of unused chart data')
+                if post_processing_metrics is not None:
+                    post_processing_metrics.observe(report)
+                # Let pandas aggregate large bar/pie/heatmap data instead of the renderer
+                if PRE_AGGREGATE_CHARTS and pre_aggregate_spec(altair_json):
+                    print('[x] Pre-aggregated chart data')
+                pending_render[2] = render_service.submit(altair_json, scale=2)
+
+            # ...then queue the rendered PNGs for optimization as they come in...
+            for pending_render in new_charts:
+                try:
+                    pending_render[2] = image_optimizer.submit(pending_render[2].result())
+                except RenderError as e:
+                    pending_render[2] = e
+
+            # ...and collect them in order
+            for im_idx, (cache_key, altair_json, png_data) in enumerate(pending_renders):
+                if isinstance(png_data, RenderError):
+                    print(f'[x] Could not render Altair chart {im_idx+1}: {png_data}')
+                    # Keep the remaining images aligned with their json tags
+                    alt_base64_images.append(None)
+                    continue
+                if not isinstance(png_data, bytes):
+                    png_data = png_data.result()
+                    # Cached once optimized, so reused charts skip both steps
+                    render_cache.put(cache_key, CachedRender(spec=altair_json, png=png_data))
 
                 # Save the Altair chart as an image (PNG format)
                 ensure_directory_exists(os.path.join(output_dir, f"copy_{copy_index+1}"))
                 filepath = f"{output_dir}/copy_{copy_index+1}/Gemini_userquery{p_idx+1}_altair_plot{im_idx+1}.png"
-                png_data = vlc.vegalite_to_png(altair_chart_object.to_json(), scale=2)
                 with open(filepath, "wb") as f:
                     f.write(png_data)
                     alt_base64_images.append(base64.b64encode(png_data).decode('utf-8'))
 
-            # Perform the insertion of plot images into notebook string
-            notebook_str = replace_json_tags(
-                notebook_str=notebook_str,
-                base64_images=alt_base64_images
-            )
+            # Build the turn's cells from its events, with the plot images by their json tags
+            turn_cells = list(iter_event_cells(events, alt_base64_images))
 
             # Update the local backup data with latest prompt data if already exists, else add as new
             update_prompt_output(
@@ -331,7 +333,7 @@ for task in JOBS['tasks']:
                 id_key          = task_id,
                 new_prompt_dict =   {
                     'prompt': prompt,
-                    'response': notebook_str,
+                    'cells': turn_cells,
                     'prompt_files': prompt_files,
                     'prompt_file_urls': []
                 }
@@ -351,8 +353,17 @@ for task in JOBS['tasks']:
             text_dict_list  = OUTPUT[task_id]
         )
 
+        print(f'[x] Shared chart data: {shared_chart_data.summary()}')
+        print(f'[x] Plot images: {image_optimizer.take_stats().summary()}')
         print(f'[x] Completed Task ID: {task_id} {copy_index+1}/5.')
 
 
+render_service.close()
+image_optimizer.close()
 
+stats = render_cache.stats
+print(f'[x] Chart render cache: {stats.memory_hits + stats.disk_hits} hits, {stats.misses} misses')
 
+if post_processing_metrics is not None:
+    print('[x] Chart post-processing metrics:')
+    print(post_processing_metrics.summary())
@@ -13,8 +13,10 @@ from pathlib import Path
 from pprint import pprint
 from datetime import datetime
 from selenium import webdriver
-from collections import defaultdict
-from bake_notebook import IPYNBGenerator
+from bake_notebook import IPYNBGenerator, OutputBudget
+from image_optimization import ImageOptimizer
+from prompt_outputs import PromptOutputStore
+from time_tracksheet import TimeTrackSheet
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from pynput.keyboard import Key as PyKey, Controller
@@ -22,7 +24,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service as ChromeService
-from utils import GPTSpecificTextInLastElement, append_to_excel, ensure_directory_exists, update_prompt_output
+from utils import GPTSpecificTextInLastElement, ensure_directory_exists
 
 # Ensure the jobs.json file is added before proceeding.
 # You can also check README.md  file to see how the "jobs.json" 
@@ -31,6 +33,8 @@ from utils import GPTSpecificTextInLastElement, append_to_excel, ensure_director
 ''' SAMPLE `jobs.json` file template
 {
     "rater_id": "000", # Your unique rater id
+    "notebook_image_mode": "inline", # Optional: "inline", "attachments" or "sidecar"
+    "notebook_output_budget": {"max_lines": 400, "head_lines": 200, "tail_lines": 100, "sidecar": false}, # Optional, outputs are kept whole without it
     "tasks": [
         {
             "task_id": "100", # ID assigned to that row on google sheet
@@ -67,13 +71,18 @@ except json.decoder.JSONDecodeError:
 
 pprint(JOBS)
 
-try:
-    with open('gpt-outputs.json', 'r') as of:
-        OUTPUT = defaultdict(list, json.loads(of.read())) # Convert to defaultdict type
-except Exception:
-    OUTPUT = defaultdict(list)
+# Turns of every task run so far, by task
+OUTPUTS = PromptOutputStore('gpt-outputs.json')
 
 RATER_ID = JOBS['rater_id']
+# How plots are stored in notebooks, one of bake_notebook.NOTEBOOK_IMAGE_MODES
+NOTEBOOK_IMAGE_MODE = JOBS.get('notebook_image_mode', 'inline')
+# How much of long printed outputs notebooks keep, see bake_notebook.OutputBudget
+OUTPUT_BUDGET = OutputBudget.from_config(JOBS.get('notebook_output_budget'))
+# Shrinks plot PNGs before they are saved and embedded
+image_optimizer = ImageOptimizer()
+# Time-track rows of every prompt, exported to the workbook after each task
+time_tracksheet = TimeTrackSheet('time-tracksheet/gpt-prompts-time-track-sheet.xlsx')
 
 print(platform.system())
 print(platform.machine())
@@ -176,6 +185,16 @@ for task in JOBS['tasks']:
         # Open GPT
         driver.get('https://chatgpt.com/?model=gpt-4o')
 
+        # Instantiate class for generating the notebook as prompts finish
+        ipynb_gen = IPYNBGenerator(
+            output_path = output_dir,
+            rater_id    = RATER_ID,
+            task_id     = task_id,
+            nb_for="GPT", # Need to override this from "Gemini" to "GPT"
+            image_mode  = NOTEBOOK_IMAGE_MODE,
+            output_budget = OUTPUT_BUDGET
+        )
+
         for idx, user_query in enumerate(task['prompts']):
             print(f'[x] {task_id} - Starting Prompt {idx+1}: {user_query}')
             # Find the input text field elem
@@ -308,6 +327,7 @@ for task in JOBS['tasks']:
             plot_images = gpt_reponse_elem.find_elements(By.TAG_NAME, 'img')
             plot_images = [i for i in plot_images if str(i.get_attribute('alt')).lower().strip() == "output image"]
             base64_plot_images = []
+            pending_plot_images = []
 
             if plot_images:
                 # Iterate through each plot image and save it
@@ -320,10 +340,8 @@ for task in JOBS['tasks']:
 
                     file_path = os.path.join(output_dir, f'GPT_userquery{idx+1}_plot{img_idx+1}.png')
 
-                    # Save the image to the specified path
-                    with open(file_path, 'wb') as file:
-                        file.write(response.content)
-                        base64_plot_images.append(base64.b64encode(response.content).decode('utf-8'))
+                    # Queue the image for optimization, it is saved below
+                    pending_plot_images.append((file_path, image_optimizer.submit(response.content)))
 
                 time.sleep(3)
             else:
@@ -347,9 +365,16 @@ for task in JOBS['tasks']:
                         img.screenshot(file_path)
 
                         with open(file_path, 'rb') as imgfile:
-                            base64_plot_images.append(base64.b64encode(imgfile.read()).decode('utf-8'))
+                            pending_plot_images.append((file_path, image_optimizer.submit(imgfile.read())))
                     time.sleep(3)
 
+            # Save the optimized images, in the order they were found
+            for file_path, optimized_image in pending_plot_images:
+                img_data = optimized_image.result()
+                with open(file_path, 'wb') as file:
+                    file.write(img_data)
+                base64_plot_images.append(base64.b64encode(img_data).decode('utf-8'))
+
             # Create a combined list of elements and images, including the order they appear
             all_elements = []
             element_positions = [(element, element.location['y']) for element in response_blocks]
@@ -379,22 +404,17 @@ for task in JOBS['tasks']:
 
 
 
-            update_prompt_output(
-                main_dict       = OUTPUT,
-                id_key          = task_id,
-                new_prompt_dict =   {
-                    'prompt': user_query,
-                    'end_to_end_time': end_to_end_time,
-                    'html_response': html_str,
-                    'prompt_files': prompt_files,
-                    'prompt_file_urls': prompt_file_urls,
-                    'timestamp': str(datetime.now())
-                }
-            )
+            OUTPUTS.upsert(task_id, {
+                'prompt': user_query,
+                'end_to_end_time': end_to_end_time,
+                'html_response': html_str,
+                'prompt_files': prompt_files,
+                'prompt_file_urls': prompt_file_urls,
+                'timestamp': str(datetime.now())
+            })
             
-            # Create local update/backup
-            with open('gpt-outputs.json', 'w') as out:
-                out.write(json.dumps(OUTPUT))
+            # Bake the notebook with the turns so far while the next turn runs
+            ipynb_gen.bake_turns(OUTPUTS.turns(task_id), html=True)
 
             new_data = pd.Series({
                 'rater_id': RATER_ID,
@@ -407,26 +427,18 @@ for task in JOBS['tasks']:
                 'timestamp': datetime.now()
             })
             
-            ensure_directory_exists('time-tracksheet/')
-            df_filepath = 'time-tracksheet/gpt-prompts-time-track-sheet.xlsx'
-            append_to_excel(df_filepath, new_data)
+            time_tracksheet.append(new_data)
         
         # To avoid getting logged out once in a while due to security reasons,
         # Will intentionally wait for a few more seconds before moving to next task 
         time.sleep(15)
 
-        # Instantiate class for generating notebook after all prompts are done
-        ipynb_gen = IPYNBGenerator(
-            output_path = output_dir,
-            rater_id    = RATER_ID,
-            task_id     = task_id,
-            nb_for="GPT" # Need to override this from "Gemini" to "GPT"
-        )
-
-        # Generate notebook
+        # Finish the notebook once all prompts are done
         ipynb_gen.html_to_notebook(
-            OUTPUT[task_id]
+            OUTPUTS.turns(task_id)
         )
+        print(f'[x] Plot images: {image_optimizer.take_stats().summary()}')
+        print(f'[x] Time-track sheet: {time_tracksheet.export_xlsx()}')
         print(f'[x] Completed Task ID: {task_id}.\n\n')
 
 
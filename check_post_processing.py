@@ -0,0 +1,244 @@
+"""Checks that both chart post-processing engines make the same charts.
+
+cbrfo5 post-processes Vega-Lite dicts with post_process_spec, the other
+scripts Altair charts with post_process_chart. Every case below is built from
+the same data and post-processed by post_process_spec, and by
+post_process_chart with and without string column compaction, and the three
+specs must be identical. Some cases also check what the processed chart must
+(still) show. Exits with status 1 if any case fails:
+
+    python check_post_processing.py
+
+It only needs the two engines, so it also runs against the commits since
+post_process_spec was added, e.g. from a worktree of one:
+
+    git show HEAD:check_post_processing.py > /tmp/check_post_processing.py
+    git worktree add /tmp/engines 2bb58f3
+    cd /tmp/engines && PYTHONPATH=. python /tmp/check_post_processing.py
+"""
+
+import inspect
+import sys
+import warnings
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from altair_post_processing import post_process_chart
+from spec_post_processing import post_process_spec
+
+
+NUM_ROWS = 2000
+NUM_COLUMNS = 20
+# More categories than pie wedges and vertical bars allowed, so wedges get
+# merged and bars get rotated.
+NUM_CATEGORIES = 30
+GROUPS = ['north', 'south', 'east', 'west', 'central']
+
+
+def make_data(rows, columns, rng):
+    """DataFrame with the columns the charts encode, padded with extra columns.
+
+    Besides plain numbers and strings, there are number, currency, percentage
+    and date columns stored as strings, for the type conversion processor.
+    """
+    categories = np.array([f'Category {i}' for i in range(NUM_CATEGORIES)])
+    base = {
+        'category': categories[rng.integers(0, NUM_CATEGORIES, rows)],
+        'group': np.array(GROUPS)[rng.integers(0, len(GROUPS), rows)],
+        'value': rng.gamma(2.0, 50.0, rows),
+    }
+    if columns > 3:
+        base['amount'] = [f'${v:,.2f}' for v in rng.gamma(2.0, 500.0, rows)]
+    if columns > 4:
+        base['date'] = (pd.Timestamp('2020-01-01') + pd.to_timedelta(np.arange(rows) % 3650, unit='D')).strftime('%Y-%m-%d')
+    data = pd.DataFrame(base)
+
+    extra_columns = {}
+    for i in range(columns - len(data.columns)):
+        kind = i % 4
+        if kind == 0:
+            extra_columns[f'measure_{i}'] = rng.normal(size=rows)
+        elif kind == 1:
+            extra_columns[f'label_{i}'] = categories[rng.integers(0, NUM_CATEGORIES, rows)]
+        elif kind == 2:
+            extra_columns[f'share_{i}'] = [f'{v:.1f}%' for v in rng.uniform(0, 100, rows)]
+        else:
+            extra_columns[f'count_{i}'] = [f'{v:,}' for v in rng.integers(0, 10**6, rows)]
+    return pd.concat([data, pd.DataFrame(extra_columns)], axis=1)
+
+
+def bar_chart(data):
+    return alt.Chart(data).mark_bar().encode(x='category:N', y='sum(value):Q', color='group:N')
+
+
+def boxplot_chart(data):
+    return alt.Chart(data).mark_boxplot().encode(x='group:N', y='value:Q')
+
+
+def pie_chart(data):
+    return alt.Chart(data).mark_arc().encode(theta='value:Q', color='category:N')
+
+
+def labeled_pie_chart(data):
+    base = alt.Chart(data).encode(theta=alt.Theta('value:Q', stack=True), color='category:N')
+    return base.mark_arc(outerRadius=120) + base.mark_text(radius=140).encode(text='category:N')
+
+
+def labeled_heatmap_chart(data):
+    base = alt.Chart(data).encode(x='category:N', y='group:N')
+    return base.mark_rect().encode(color='mean(value):Q') + base.mark_text().encode(text='mean(value):Q')
+
+
+def histogram_chart(data):
+    return alt.Chart(data).mark_bar().encode(x=alt.X('value:Q', bin=True), y='count():Q')
+
+
+def layered_chart(data):
+    x = 'date:T' if 'date' in data.columns else 'value:Q'
+    y = 'amount:Q' if 'amount' in data.columns else 'value:Q'
+    base = alt.Chart(data).encode(x=x, y=y, color='group:N')
+    return base.mark_line() + base.mark_point()
+
+
+def concatenated_chart(data):
+    return alt.hconcat(bar_chart(data), histogram_chart(data))
+
+
+
+def layers_with_own_data_chart(data):
+    lines = alt.Chart(data).mark_line().encode(x='value:Q', y='amount:Q')
+    points = alt.Chart(data.head(100)).mark_point().encode(x='value:Q', y='share_2:Q', color='group:N')
+    return alt.layer(lines, points)
+
+
+def duplicate_selectors_chart(data):
+    brush = alt.selection_interval(name='brush')
+    base = alt.Chart(data).encode(x='value:Q', y='amount:Q').add_selection(brush)
+    return alt.layer(base.mark_point(), base.mark_line())
+
+
+def sanitized_names_chart(data):
+    data = data.rename(columns={'value': 'value.usd [k]', 'category': "owner's category"})
+    return alt.Chart(data).mark_bar().encode(x="owner's category:N", y='mean(value.usd [k]):Q')
+
+
+def pie_with_label_column_chart(data):
+    # Labels from another column than the wedges' colors (compacted to categories)
+    base = alt.Chart(data).encode(theta=alt.Theta('value:Q', stack=True), color='category:N')
+    return base.mark_arc(outerRadius=120) + base.mark_text(radius=140).encode(text='label_1:N')
+
+
+def pie_with_repeated_index_chart(data):
+    # Concatenated DataFrames repeat their index labels
+    halves = [data.head(NUM_ROWS // 2), data.tail(NUM_ROWS // 2).reset_index(drop=True)]
+    return pie_chart(pd.concat(halves))
+
+
+def compacted_string_types_chart(data):
+    # Few distinct values, so compaction stores these string columns as categories
+    codes = data['category'].str.slice(len('Category ')).astype(int)
+    data = data.assign(
+        price=[f'${code * 125:,.2f}' for code in codes],
+        day=[f'2021-03-{code % 28 + 1:02d}' for code in codes],
+        share=[f'{code * 2.5:.1f}%' for code in codes],
+    )
+    return alt.Chart(data).mark_point().encode(x='day:T', y='price:Q', color='share:Q', shape='group:N')
+
+
+def count_only_chart(data):
+    return alt.Chart(data).mark_bar().encode(y='count():Q')
+
+
+def string_types_chart(data):
+    return alt.Chart(data).mark_point().encode(x='date:T', y='amount:Q', size='count_3:Q', color='share_2:Q')
+
+
+# Name -> function building the chart from the data
+CASES = {
+    'rotated_bars': bar_chart,
+    'boxplot': boxplot_chart,
+    'pie': pie_chart,
+    'labeled_pie': labeled_pie_chart,
+    'pie_with_label_column': pie_with_label_column_chart,
+    'pie_with_repeated_index': pie_with_repeated_index_chart,
+    'labeled_heatmap': labeled_heatmap_chart,
+    'binned_histogram': histogram_chart,
+    'concatenated': concatenated_chart,
+    'layered': layered_chart,
+    'layers_with_own_data': layers_with_own_data_chart,
+    'duplicate_selectors': duplicate_selectors_chart,
+    'sanitized_names': sanitized_names_chart,
+    'string_types': string_types_chart,
+    'compacted_string_types': compacted_string_types_chart,
+    'count_only': count_only_chart,
+}
+
+
+def dataset_rows(spec):
+    """Number of rows of each inline dataset of a spec."""
+    return [len(values) for values in spec.get('datasets', {}).values()]
+
+
+def keeps_all_rows(spec):
+    # Charts encoding no field (e.g. only count()) still need every row
+    if dataset_rows(spec) != [NUM_ROWS]:
+        return f'dataset rows {dataset_rows(spec)}, expected [{NUM_ROWS}]'
+    return None
+
+
+# Name -> function returning what is wrong with a case's processed spec, if anything
+EXPECTATIONS = {
+    'count_only': keeps_all_rows,
+}
+
+
+def processed_specs(make_chart, data):
+    """Spec of the chart post-processed by each engine, by engine name."""
+    specs = {}
+    # Engines from before string column compaction (e.g. where post_process_spec
+    # was added) are checked without it
+    compaction_options = [True, False] if 'compact_columns' in inspect.signature(post_process_chart).parameters else [None]
+    for compact_columns in compaction_options:
+        chart = make_chart(data.copy())
+        if compact_columns is None:
+            post_process_chart(chart)
+            specs['chart'] = chart.to_dict()
+            continue
+        post_process_chart(chart, compact_columns=compact_columns)
+        specs[f'chart (compact_columns={compact_columns})'] = chart.to_dict()
+    spec = make_chart(data.copy()).to_dict()
+    post_process_spec(spec)
+    specs['spec'] = spec
+    return specs
+
+
+def check_case(name, data):
+    """Problems with a case, empty if it passes."""
+    specs = processed_specs(CASES[name], data)
+    (reference_name, reference), *others = specs.items()
+    problems = [f'{engine} differs from {reference_name}' for engine, spec in others if spec != reference]
+    expectation = EXPECTATIONS.get(name)
+    if expectation is not None:
+        problems += [f'{engine}: {problem}' for engine, spec in specs.items() for problem in [expectation(spec)] if problem]
+    return problems
+
+
+def main():
+    warnings.simplefilter('ignore', FutureWarning)
+    alt.data_transformers.disable_max_rows()
+    data = make_data(NUM_ROWS, NUM_COLUMNS, np.random.default_rng(0))
+    failed = 0
+    for name in CASES:
+        problems = check_case(name, data)
+        print(f'{"FAIL" if problems else "ok":<6}{name}')
+        for problem in problems:
+            print(f'      {problem}')
+        failed += bool(problems)
+    print(f'{len(CASES) - failed} of {len(CASES)} cases passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,12 +22,17 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service as ChromeService
 from pynput.keyboard import Key as PyKey, Controller
 from pprint import pprint
-from bake_notebook import IPYNBGenerator
-from utils import LastFooterElement, TextInLastElement, GeminiSpecificTextInLastElement, append_to_excel, ensure_directory_exists, replace_json_tags, update_error_code_counts, update_prompt_output
+from bake_notebook import IPYNBGenerator, OutputBudget
+from image_optimization import ImageOptimizer
+from prompt_outputs import PromptOutputStore
+from time_tracksheet import TimeTrackSheet
+from utils import LastFooterElement, TextInLastElement, GeminiSpecificTextInLastElement, ensure_directory_exists, replace_json_tags, update_error_code_counts
 
 ''' SAMPLE `jobs.json` file template
 {
     "rater_id": "000", # Your unique rater id
+    "notebook_image_mode": "inline", # Optional: "inline", "attachments" or "sidecar"
+    "notebook_output_budget": {"max_lines": 400, "head_lines": 200, "tail_lines": 100, "sidecar": false}, # Optional, outputs are kept whole without it
     "tasks": [
         {
             "task_id": "100", # ID assigned to that row on google sheet
@@ -64,13 +69,18 @@ except json.decoder.JSONDecodeError:
 
 pprint(JOBS)
 
-try:
-    with open('gemini-outputs.json', 'r') as of:
-        OUTPUT = defaultdict(list, json.loads(of.read()))  # Convert to defaultdict type
-except Exception:
-    OUTPUT = defaultdict(list)
+# Turns of every task run so far, by task
+OUTPUTS = PromptOutputStore('gemini-outputs.json')
 
 RATER_ID = JOBS['rater_id']
+# How plots are stored in notebooks, one of bake_notebook.NOTEBOOK_IMAGE_MODES
+NOTEBOOK_IMAGE_MODE = JOBS.get('notebook_image_mode', 'inline')
+# How much of long printed outputs notebooks keep, see bake_notebook.OutputBudget
+OUTPUT_BUDGET = OutputBudget.from_config(JOBS.get('notebook_output_budget'))
+# Shrinks plot PNGs before they are saved and embedded
+image_optimizer = ImageOptimizer()
+# Time-track rows of every prompt, exported to the workbook after each task
+time_tracksheet = TimeTrackSheet('time-tracksheet/gemini-prompts-time-track-sheet.xlsx')
 
 print("OS:\t",platform.system())
 print("Type:\t",platform.machine())
@@ -194,6 +204,15 @@ for task in JOBS['tasks']:
         except Exception:
             main_container_tag_name = 'mat'
 
+        # Instantiate class for generating the notebook as prompts finish
+        ipynb_gen = IPYNBGenerator(
+            output_path = output_dir,
+            rater_id    = RATER_ID,
+            task_id     = task_id,
+            image_mode  = NOTEBOOK_IMAGE_MODE,
+            output_budget = OUTPUT_BUDGET
+        )
+
         for idx, user_query in enumerate(task['prompts']):
             print(f'[x] {task_id} - Starting Prompt {idx+1}: {user_query}')
             # Find the input text field elem
@@ -365,6 +384,7 @@ for task in JOBS['tasks']:
                     ("image" in str(i.get_attribute('class')).lower().strip() and "ng-star-inserted" in str(i.get_attribute('class')).lower().strip())
             ]
             base64_plot_images = []
+            pending_plot_images = []
             
             # Extract cookies from the Selenium session
             selenium_cookies = driver.get_cookies()
@@ -412,8 +432,14 @@ for task in JOBS['tasks']:
                         'base64_src': base64_data
                     })
 
-                # Decode the base64 data and save the image
+                # Decode the base64 data and queue the image for optimization
                 img_data = base64.b64decode(base64_data)
+                pending_plot_images.append(image_optimizer.submit(img_data))
+
+            # Save the optimized images and embed them instead of the originals
+            for img_idx, (img_dict, optimized_image) in enumerate(zip(base64_plot_images, pending_plot_images)):
+                img_data = optimized_image.result()
+                img_dict['base64_src'] = base64.b64encode(img_data).decode('utf-8')
                 file_path = os.path.join(output_dir, f'Gemini_userquery{idx+1}_plot{img_idx+1}.png')
 
                 with open(file_path, 'wb') as file:
@@ -442,25 +468,20 @@ for task in JOBS['tasks']:
             )
 
             # Update the local backup data with latest prompt data if already exists, else add as new
-            update_prompt_output(
-                main_dict       = OUTPUT,
-                id_key          = task_id,
-                new_prompt_dict =   {
-                    'prompt': user_query,
-                    'time_to_ice': time_to_trigger_ice,
-                    'end_to_end_time': end_to_end_time,
-                    'response': notebook_response,
-                    'response_with_image': notebook_response_copy,
-                    'prompt_files': prompt_files,
-                    'prompt_file_urls': prompt_file_urls,
-                    'timestamp': str(datetime.now()),
-                    **ERROR_COUNTS_DICT
-                }
-            )
+            OUTPUTS.upsert(task_id, {
+                'prompt': user_query,
+                'time_to_ice': time_to_trigger_ice,
+                'end_to_end_time': end_to_end_time,
+                'response': notebook_response,
+                'response_with_image': notebook_response_copy,
+                'prompt_files': prompt_files,
+                'prompt_file_urls': prompt_file_urls,
+                'timestamp': str(datetime.now()),
+                **ERROR_COUNTS_DICT
+            })
             
-            # Create local update/backup
-            with open('gemini-outputs.json', 'w') as out:
-                out.write(json.dumps(OUTPUT))
+            # Bake the notebook with the turns so far while the next turn runs
+            ipynb_gen.bake_turns(OUTPUTS.turns(task_id))
 
             new_data = pd.Series({
                 'rater_id': RATER_ID,
@@ -475,23 +496,15 @@ for task in JOBS['tasks']:
                 'timestamp': datetime.now(),
                 **ERROR_COUNTS_DICT
             })
-            ensure_directory_exists('time-tracksheet/')
-
-            df_filepath = 'time-tracksheet/gemini-prompts-time-track-sheet.xlsx'
-            append_to_excel(df_filepath, new_data)
+            time_tracksheet.append(new_data)
 
 
-        # Instantiate class for generating notebook after all prompts are done
-        ipynb_gen = IPYNBGenerator(
-            output_path = output_dir,
-            rater_id    = RATER_ID,
-            task_id     = task_id
-        )
-
-        # Generate notebook
+        # Finish the notebook once all prompts are done
         ipynb_gen.text_to_notebook(
-            OUTPUT[task_id]
+            OUTPUTS.turns(task_id)
         )
+        print(f'[x] Plot images: {image_optimizer.take_stats().summary()}')
+        print(f'[x] Time-track sheet: {time_tracksheet.export_xlsx()}')
         print(f'[x] Completed Task ID: {task_id}.\n\n')
 
 
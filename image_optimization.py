@@ -0,0 +1,185 @@
+"""Shrinks plot PNGs before they are embedded in notebooks or uploaded.
+
+Plots arrive as screenshots, downloads or renders, usually as RGBA PNGs with
+metadata and default compression. Each one is re-encoded:
+
+- Images with at most 256 distinct colors (most charts) become palette PNGs.
+  The palette holds exactly those colors, so no pixel changes.
+- An alpha channel that is fully opaque is dropped.
+- Images larger than a maximum dimension are scaled down.
+- Metadata chunks (text, ICC profile, EXIF, DPI) are not copied.
+- zlib runs at the highest compression level.
+
+The smaller of the original and the re-encoded PNG is kept. Anything that is
+not an 8-bit PNG (e.g. 16-bit grayscale, which Pillow can only re-encode by
+dropping bits) is left as is. Optimization runs in a pool of threads (Pillow and
+zlib release the GIL while they work), like rendering, so it never re-imports
+the calling script.
+"""
+
+from concurrent import futures
+import dataclasses
+import io
+import os
+import threading
+from typing import Union
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_NUM_WORKERS = min(4, os.cpu_count() or 1)
+# Larger images are scaled down to this many pixels on their longest side.
+DEFAULT_MAX_DIMENSION = 2048
+DEFAULT_COMPRESS_LEVEL = 9
+MAX_PALETTE_COLORS = 256
+# Modes of PNGs with at most 8 bits per channel, which re-encode losslessly
+EIGHT_BIT_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA'}
+# Offset of the bit depth in a PNG: after the signature, the IHDR chunk's length
+# and type, and the image width and height
+PNG_BIT_DEPTH_OFFSET = 24
+
+
+@dataclasses.dataclass
+class ImageOptimizationStats:
+  images: int = 0
+  optimized: int = 0
+  original_bytes: int = 0
+  optimized_bytes: int = 0
+
+  @property
+  def bytes_saved(self) -> int:
+    return self.original_bytes - self.optimized_bytes
+
+  def summary(self) -> str:
+    reduction = self.bytes_saved / max(self.original_bytes, 1)
+    return (
+        f'{self.optimized}/{self.images} images smaller,'
+        f' {self.original_bytes / 2**20:.2f}MiB ->'
+        f' {self.optimized_bytes / 2**20:.2f}MiB (-{reduction:.0%})'
+    )
+
+
+def exact_palette_image(image: Image.Image) -> Union[Image.Image, None]:
+  """`image` with the same pixels in palette mode, or None if over 256 colors."""
+  rgba = np.asarray(image.convert('RGBA'))
+  colors, indices = np.unique(
+      rgba.reshape(-1, 4).view(np.uint32), return_inverse=True
+  )
+  if len(colors) > MAX_PALETTE_COLORS:
+    return None
+  palette = colors.view(np.uint8).reshape(-1, 4)
+  paletted = Image.fromarray(
+      indices.astype(np.uint8).reshape(rgba.shape[:2]), mode='P'
+  )
+  paletted.putpalette(palette[:, :3].tobytes())
+  alpha = palette[:, 3]
+  if (alpha < 255).any():
+    paletted.info['transparency'] = alpha.tobytes()
+  return paletted
+
+
+def optimize_png(
+    data: bytes,
+    max_dimension: Union[int, None] = DEFAULT_MAX_DIMENSION,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+) -> bytes:
+  """Re-encodes a PNG as small as it losslessly gets (after any downscaling).
+
+  Args:
+    data: Image file contents. Anything but an 8-bit PNG is returned
+      unchanged.
+    max_dimension: Longest side in pixels; larger images are scaled down.
+      None keeps every size.
+    compress_level: zlib compression level (0-9).
+
+  Returns:
+    The smaller of `data` and its re-encoded version.
+  """
+  try:
+    image = Image.open(io.BytesIO(data))
+    if image.format != 'PNG':
+      return data
+    # Pillow reads 16-bit RGB(A) PNGs as 8-bit modes, so check the header too
+    if image.mode not in EIGHT_BIT_MODES or data[PNG_BIT_DEPTH_OFFSET] > 8:
+      return data
+    image.load()
+  except (OSError, ValueError, Image.DecompressionBombError):
+    return data
+
+  if max_dimension and max(image.size) > max_dimension:
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+      image = image.convert('RGBA')
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+  paletted = exact_palette_image(image)
+  if paletted is not None:
+    image = paletted
+  elif image.mode not in ('RGB', 'RGBA'):
+    image = image.convert('RGBA')
+  if image.mode == 'RGBA' and image.getextrema()[3][0] == 255:
+    image = image.convert('RGB')
+
+  output = io.BytesIO()
+  save_options = {'compress_level': compress_level, 'icc_profile': None}
+  if 'transparency' in image.info:
+    save_options['transparency'] = image.info['transparency']
+  # Saved from a fresh info dict, so no metadata chunks are copied
+  image.info = {}
+  image.save(output, format='PNG', **save_options)
+  optimized = output.getvalue()
+  return optimized if len(optimized) < len(data) else data
+
+
+class ImageOptimizer:
+  """Pool of threads optimizing PNGs, keeping totals of the bytes saved.
+
+  Use as a context manager, or call `close` when done:
+
+    with ImageOptimizer() as optimizer:
+      png = optimizer.submit(png).result()
+      print(optimizer.take_stats().summary())
+  """
+
+  def __init__(
+      self,
+      num_workers: int = DEFAULT_NUM_WORKERS,
+      max_dimension: Union[int, None] = DEFAULT_MAX_DIMENSION,
+      compress_level: int = DEFAULT_COMPRESS_LEVEL,
+  ):
+    self.max_dimension = max_dimension
+    self.compress_level = compress_level
+    self.stats = ImageOptimizationStats()
+    self._lock = threading.Lock()
+    self._executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+
+  def submit(self, data: bytes) -> futures.Future:
+    """Queues `data` for optimization; the future gives the optimized bytes."""
+    return self._executor.submit(self._optimize, data)
+
+  def optimize(self, data: bytes) -> bytes:
+    return self.submit(data).result()
+
+  def take_stats(self) -> ImageOptimizationStats:
+    """Returns the totals since the last call (or the start) and resets them."""
+    with self._lock:
+      stats, self.stats = self.stats, ImageOptimizationStats()
+    return stats
+
+  def close(self) -> None:
+    self._executor.shutdown()
+
+  def __enter__(self) -> 'ImageOptimizer':
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.close()
+
+  def _optimize(self, data: bytes) -> bytes:
+    optimized = optimize_png(data, self.max_dimension, self.compress_level)
+    with self._lock:
+      self.stats.images += 1
+      self.stats.optimized += optimized is not data
+      self.stats.original_bytes += len(data)
+      self.stats.optimized_bytes += len(optimized)
+    return optimized
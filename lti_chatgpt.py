@@ -4,7 +4,6 @@
 import base64
 import os
 import time
-import json
 import random
 import platform
 import bs4
@@ -16,8 +15,10 @@ from pathlib import Path
 from pprint import pprint
 from datetime import datetime
 from selenium import webdriver
-from collections import defaultdict
 from lti_bake_notebook import IPYNBGenerator
+from image_optimization import ImageOptimizer
+from prompt_outputs import PromptOutputStore
+from time_tracksheet import TimeTrackSheet
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from pynput.keyboard import Key as PyKey, Controller
@@ -26,10 +27,21 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service as ChromeService
 from process_and_update_tracker import TaskProcessor
-from utils import GPTSpecificTextInLastElement, append_to_excel, ensure_directory_exists, update_prompt_output
-
-
-OUTPUT = defaultdict(list)
+from utils import GPTSpecificTextInLastElement, ensure_directory_exists
+
+
+# Turns of the tasks of this run, by task
+OUTPUTS = PromptOutputStore('lti-gpt-outputs.json', fresh=True)
+# Notebooks are uploaded to Drive and opened in Colab, which cannot show
+# images stored next to them, so plots go in cell attachments
+NOTEBOOK_IMAGE_MODE = 'attachments'
+# Printed outputs are kept whole; set to e.g. bake_notebook.OutputBudget() to
+# cut long ones down to their first and last lines
+OUTPUT_BUDGET = None
+# Shrinks plot PNGs before they are saved and embedded
+image_optimizer = ImageOptimizer()
+# Time-track rows of every prompt, exported to the workbook after each task
+time_tracksheet = TimeTrackSheet('time-tracksheet/gpt-prompts-time-track-sheet.xlsx')
 
 print(platform.system())
 print(platform.machine())
@@ -165,6 +177,16 @@ while XON:
                 # Open GPT
                 driver.get('https://chatgpt.com/?model=gpt-4o')
 
+                # Instantiate class for generating the notebook as prompts finish
+                ipynb_gen = IPYNBGenerator(
+                    output_path = output_dir,
+                    rater_id    = RATER_ID,
+                    task_id     = task_id,
+                    nb_for="GPT", # Need to override this from "Gemini" to "GPT"
+                    image_mode  = NOTEBOOK_IMAGE_MODE,
+                    output_budget = OUTPUT_BUDGET
+                )
+
                 for idx, user_query in enumerate(TASK_PROMPTS):
                     print(f'[x] {task_id} - Starting Prompt {idx+1}: {user_query}')
                     # Find the input text field elem
@@ -296,6 +318,7 @@ while XON:
                     plot_images = gpt_reponse_elem.find_elements(By.TAG_NAME, 'img')
                     plot_images = [i for i in plot_images if str(i.get_attribute('alt')).lower().strip() == "output image"]
                     base64_plot_images = []
+                    pending_plot_images = []
 
                     if plot_images:
                         # Iterate through each plot image and save it
@@ -308,10 +331,8 @@ while XON:
 
                             file_path = os.path.join(output_dir, f'GPT_userquery{idx+1}_plot{img_idx+1}.png')
 
-                            # Save the image to the specified path
-                            with open(file_path, 'wb') as file:
-                                file.write(response.content)
-                                base64_plot_images.append(base64.b64encode(response.content).decode('utf-8'))
+                            # Queue the image for optimization, it is saved below
+                            pending_plot_images.append((file_path, image_optimizer.submit(response.content)))
 
                         time.sleep(3)
                     else:
@@ -335,9 +356,16 @@ while XON:
                                 img.screenshot(file_path)
 
                                 with open(file_path, 'rb') as imgfile:
-                                    base64_plot_images.append(base64.b64encode(imgfile.read()).decode('utf-8'))
+                                    pending_plot_images.append((file_path, image_optimizer.submit(imgfile.read())))
                             time.sleep(3)
 
+                    # Save the optimized images, in the order they were found
+                    for file_path, optimized_image in pending_plot_images:
+                        img_data = optimized_image.result()
+                        with open(file_path, 'wb') as file:
+                            file.write(img_data)
+                        base64_plot_images.append(base64.b64encode(img_data).decode('utf-8'))
+
                     # Create a combined list of elements and images, including the order they appear
                     all_elements = []
                     element_positions = [(element, element.location['y']) for element in response_blocks]
@@ -365,22 +393,17 @@ while XON:
                         else:
                             html_str += '\n' + blk.get_attribute('innerHTML')
 
-                    update_prompt_output(
-                        main_dict       = OUTPUT,
-                        id_key          = task_id,
-                        new_prompt_dict =   {
-                            'prompt': user_query,
-                            'end_to_end_time': end_to_end_time,
-                            'html_response': html_str,
-                            'prompt_files': prompt_files,
-                            'prompt_file_urls': prompt_file_urls,
-                            'timestamp': str(datetime.now())
-                        }
-                    )
+                    OUTPUTS.upsert(task_id, {
+                        'prompt': user_query,
+                        'end_to_end_time': end_to_end_time,
+                        'html_response': html_str,
+                        'prompt_files': prompt_files,
+                        'prompt_file_urls': prompt_file_urls,
+                        'timestamp': str(datetime.now())
+                    })
                     
-                    # Create local update/backup
-                    with open('lti-gpt-outputs.json', 'w') as out:
-                        out.write(json.dumps(OUTPUT))
+                    # Bake the notebook with the turns so far while the next turn runs
+                    ipynb_gen.bake_turns(OUTPUTS.turns(task_id), html=True)
 
                     new_data = pd.Series({
                         'rater_id': RATER_ID,
@@ -393,25 +416,15 @@ while XON:
                         'timestamp': datetime.now()
                     })
                     
-                    ensure_directory_exists('time-tracksheet/')
-                    df_filepath = 'time-tracksheet/gpt-prompts-time-track-sheet.xlsx'
-                    append_to_excel(df_filepath, new_data)
+                    time_tracksheet.append(new_data)
 
                 # To avoid getting logged out once in a while due to security reasons,
                 # Will intentionally wait for a few more seconds before moving to next task 
                 time.sleep(8)
 
-                # Instantiate class for generating notebook after all prompts are done
-                ipynb_gen = IPYNBGenerator(
-                    output_path = output_dir,
-                    rater_id    = RATER_ID,
-                    task_id     = task_id,
-                    nb_for="GPT" # Need to override this from "Gemini" to "GPT"
-                )
-
-                # Generate notebook
+                # Finish the notebook once all prompts are done
                 nb_name = ipynb_gen.html_to_notebook(
-                    OUTPUT[task_id]
+                    OUTPUTS.turns(task_id)
                 )
 
                 # Notebook generated. Upload the folder to Google Drive and get the notebook link
@@ -430,6 +443,8 @@ while XON:
                     row_index = processor.get_task_row_index(task_id)
                     processor.sheet.update_cell(row_index, processor.sheet.find("GN8K Status").col, "Rater Added Query")
 
+                print(f'[x] Plot images: {image_optimizer.take_stats().summary()}')
+                print(f'[x] Time-track sheet: {time_tracksheet.export_xlsx()}')
                 print(f'[x] Completed Task ID: {task_id}.\n\n')
 
         except Exception as e:
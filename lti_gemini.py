@@ -5,7 +5,6 @@ import base64
 import os
 import re
 import time
-import json
 import random
 import requests
 import pyautogui
@@ -26,11 +25,25 @@ from selenium.webdriver.chrome.service import Service as ChromeService
 from pynput.keyboard import Key as PyKey, Controller
 from pprint import pprint
 from lti_bake_notebook import IPYNBGenerator
+from image_optimization import ImageOptimizer
+from prompt_outputs import PromptOutputStore
+from time_tracksheet import TimeTrackSheet
 from process_and_update_tracker import TaskProcessor
-from utils import LastFooterElement, TextInLastElement, GeminiSpecificTextInLastElement, append_to_excel, ensure_directory_exists, replace_json_tags, update_error_code_counts, update_prompt_output
-
-
-OUTPUT = defaultdict(list)
+from utils import LastFooterElement, TextInLastElement, GeminiSpecificTextInLastElement, ensure_directory_exists, replace_json_tags, update_error_code_counts
+
+
+# Turns of the tasks of this run, by task
+OUTPUTS = PromptOutputStore('lti-gemini-outputs.json', fresh=True)
+# Notebooks are uploaded to Drive and opened in Colab, which cannot show
+# images stored next to them, so plots go in cell attachments
+NOTEBOOK_IMAGE_MODE = 'attachments'
+# Printed outputs are kept whole; set to e.g. bake_notebook.OutputBudget() to
+# cut long ones down to their first and last lines
+OUTPUT_BUDGET = None
+# Shrinks plot PNGs before they are saved and embedded
+image_optimizer = ImageOptimizer()
+# Time-track rows of every prompt, exported to the workbook after each task
+time_tracksheet = TimeTrackSheet('time-tracksheet/gemini-prompts-time-track-sheet.xlsx')
 
 print("OS:\t",platform.system())
 print("Type:\t",platform.machine())
@@ -190,6 +203,15 @@ while XON:
                 except Exception:
                     main_container_tag_name = 'mat'
 
+                # Instantiate class for generating the notebook as prompts finish
+                ipynb_gen = IPYNBGenerator(
+                    output_path = output_dir,
+                    rater_id    = RATER_ID,
+                    task_id     = task_id,
+                    image_mode  = NOTEBOOK_IMAGE_MODE,
+                    output_budget = OUTPUT_BUDGET
+                )
+
                 for idx, user_query in enumerate(TASK_PROMPTS):
                     print(f'[x] {task_id} - Starting Prompt {idx+1}: {user_query}')
                     # Find the input text field elem
@@ -362,6 +384,7 @@ while XON:
                             ("image" in str(i.get_attribute('class')).lower().strip() and "ng-star-inserted" in str(i.get_attribute('class')).lower().strip())
                     ]
                     base64_plot_images = []
+                    pending_plot_images = []
             
                     # Extract cookies from the Selenium session
                     selenium_cookies = driver.get_cookies()
@@ -409,8 +432,14 @@ while XON:
                                 'base64_src': base64_data
                             })
 
-                        # Decode the base64 data and save the image
+                        # Decode the base64 data and queue the image for optimization
                         img_data = base64.b64decode(base64_data)
+                        pending_plot_images.append(image_optimizer.submit(img_data))
+
+                    # Save the optimized images and embed them instead of the originals
+                    for img_idx, (img_dict, optimized_image) in enumerate(zip(base64_plot_images, pending_plot_images)):
+                        img_data = optimized_image.result()
+                        img_dict['base64_src'] = base64.b64encode(img_data).decode('utf-8')
                         file_path = os.path.join(output_dir, f'Gemini_userquery{idx+1}_plot{img_idx+1}.png')
 
                         with open(file_path, 'wb') as file:
@@ -439,25 +468,20 @@ while XON:
                     )
 
                     # Update the local backup data with latest prompt data if already exists, else add as new
-                    update_prompt_output(
-                        main_dict       = OUTPUT,
-                        id_key          = task_id,
-                        new_prompt_dict =   {
-                            'prompt': user_query,
-                            'time_to_ice': time_to_trigger_ice,
-                            'end_to_end_time': end_to_end_time,
-                            'response': notebook_response,
-                            'response_with_image': notebook_response_copy,
-                            'prompt_files': prompt_files,
-                            'prompt_file_urls': prompt_file_urls,
-                            'timestamp': str(datetime.now()),
-                            **ERROR_COUNTS_DICT
-                        }
-                    )
+                    OUTPUTS.upsert(task_id, {
+                        'prompt': user_query,
+                        'time_to_ice': time_to_trigger_ice,
+                        'end_to_end_time': end_to_end_time,
+                        'response': notebook_response,
+                        'response_with_image': notebook_response_copy,
+                        'prompt_files': prompt_files,
+                        'prompt_file_urls': prompt_file_urls,
+                        'timestamp': str(datetime.now()),
+                        **ERROR_COUNTS_DICT
+                    })
                     
-                    # Create local update/backup
-                    with open('lti-gemini-outputs.json', 'w') as out:
-                        out.write(json.dumps(OUTPUT))
+                    # Bake the notebook with the turns so far while the next turn runs
+                    ipynb_gen.bake_turns(OUTPUTS.turns(task_id))
 
                     new_data = pd.Series({
                         'rater_id': RATER_ID,
@@ -472,10 +496,7 @@ while XON:
                         'timestamp': datetime.now(),
                         **ERROR_COUNTS_DICT
                     })
-                    ensure_directory_exists('time-tracksheet/')
-
-                    df_filepath = 'time-tracksheet/gemini-prompts-time-track-sheet.xlsx'
-                    append_to_excel(df_filepath, new_data)
+                    time_tracksheet.append(new_data)
 
                     # Update this task's row in the spreadsheet with prompt response
                     processor.update_task_row_data_in_tracker(
@@ -484,16 +505,9 @@ while XON:
                         notebook_response, 
                     )
 
-                # Instantiate class for generating notebook after all prompts are done
-                ipynb_gen = IPYNBGenerator(
-                    output_path = output_dir,
-                    rater_id    = RATER_ID,
-                    task_id     = task_id
-                )
-
-                # Generate notebook
+                # Finish the notebook once all prompts are done
                 nb_name = ipynb_gen.text_to_notebook(
-                    OUTPUT[task_id]
+                    OUTPUTS.turns(task_id)
                 )
 
                 # Notebook generated. Upload the folder to Google Drive and get the notebook link
@@ -512,6 +526,8 @@ while XON:
                     row_index = processor.get_task_row_index(task_id)
                     processor.sheet.update_cell(row_index, processor.sheet.find("GN8K Status").col, "Rater Added Query")
 
+                print(f'[x] Plot images: {image_optimizer.take_stats().summary()}')
+                print(f'[x] Time-track sheet: {time_tracksheet.export_xlsx()}')
                 print(f'[x] Completed Task ID: {task_id}.\n\n')
 
         except Exception as e:
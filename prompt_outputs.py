@@ -0,0 +1,126 @@
+"""Indexed store of the turns (prompt, response and timings) of every task.
+
+The turns of each task are kept in an SQLite database keyed by task ID and a
+hash of the turn's prompt, files and file URLs, so recording a turn takes the
+same time however many tasks there are. A rerun prompt replaces its turn in
+place, as update_prompt_output did, and each task's turns are read on their
+own. Writes go to the database's write-ahead log and are folded into it as it
+grows.
+
+The outputs JSON file the scripts used to rewrite after every turn is imported
+the first time its store is opened, and can still be written on demand:
+
+    python prompt_outputs.py export gemini-outputs.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+from atomic_io import write_atomically
+
+
+STORE_SUFFIX = '.sqlite3'
+
+
+def turn_key(turn):
+    """Hash of what identifies a turn across reruns: its prompt, files and file URLs."""
+    identity = json.dumps([turn['prompt'], turn['prompt_files'], turn['prompt_file_urls']], ensure_ascii=False)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+class PromptOutputStore:
+    """Turns of every task, in the order their prompts were first recorded.
+
+    `json_path` is the outputs JSON file of the turns; the store is kept next
+    to it with an .sqlite3 suffix, and the file is imported if the store does
+    not exist yet. A `fresh` store starts empty instead, like the LTI scripts'
+    outputs that only hold the tasks of the current run.
+    """
+
+    def __init__(self, json_path, fresh=False):
+        self.json_path = json_path
+        self.path = os.path.splitext(json_path)[0] + STORE_SUFFIX
+        is_new = not os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS turns ('
+                            'task_id TEXT NOT NULL, key TEXT NOT NULL, turn TEXT NOT NULL, '
+                            'PRIMARY KEY (task_id, key))')
+        if fresh:
+            with self.db:
+                self.db.execute('DELETE FROM turns')
+        elif is_new and os.path.exists(json_path):
+            count = self.import_json(json_path)
+            print(f'[x] Imported {count} turns of {json_path} into {self.path}')
+
+    def upsert(self, task_id, turn):
+        """Records a turn of a task, replacing the turn of the same prompt if it was recorded before."""
+        self.upsert_many([(task_id, turn)])
+
+    def upsert_many(self, task_turns):
+        with self.db:
+            # Updating (rather than replacing) a conflicting row keeps its rowid, and so its position
+            self.db.executemany(
+                'INSERT INTO turns (task_id, key, turn) VALUES (?, ?, ?) '
+                'ON CONFLICT (task_id, key) DO UPDATE SET turn = excluded.turn',
+                [(str(task_id), turn_key(turn), json.dumps(turn, ensure_ascii=False)) for task_id, turn in task_turns]
+            )
+
+    def turns(self, task_id):
+        """Turns of one task, oldest prompt first."""
+        rows = self.db.execute('SELECT turn FROM turns WHERE task_id = ? ORDER BY rowid', (str(task_id),))
+        return [json.loads(turn) for turn, in rows]
+
+    def task_ids(self):
+        """IDs of the recorded tasks, in the order they were first recorded."""
+        rows = self.db.execute('SELECT task_id FROM turns GROUP BY task_id ORDER BY MIN(rowid)')
+        return [task_id for task_id, in rows]
+
+    def items(self):
+        """Yields the (task ID, turns) of every task, reading one task at a time."""
+        for task_id in self.task_ids():
+            yield task_id, self.turns(task_id)
+
+    def import_json(self, json_path):
+        """Records the turns of an outputs JSON file, returning how many there were."""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            outputs = json.load(f)
+        task_turns = [(task_id, turn) for task_id, turns in outputs.items() for turn in turns]
+        self.upsert_many(task_turns)
+        return len(task_turns)
+
+    def export_json(self, json_path=None):
+        """Writes every task's turns to an outputs JSON file (by default the store's), returning its path."""
+        json_path = json_path or self.json_path
+        write_atomically(json_path, json.dumps(dict(self.items())))
+        return json_path
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Write the outputs JSON file of stored turns')
+    export_parser.add_argument('outputs', nargs='+', help='Outputs JSON files of the stores')
+    import_parser = subparsers.add_parser('import', help='Record the turns of an outputs JSON file')
+    import_parser.add_argument('json_file', help='Outputs JSON file to import')
+    import_parser.add_argument('--into', required=True, help='Outputs JSON file of the store to import into')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        for json_path in args.outputs:
+            print(f'[x] Exported {PromptOutputStore(json_path).export_json()}')
+    else:
+        store = PromptOutputStore(args.into)
+        print(f'[x] Imported {store.import_json(args.json_file)} turns into {store.path}')
+
+
+if __name__ == '__main__':
+    main()
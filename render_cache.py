@@ -0,0 +1,188 @@
+"""Memoizes post-processed Vega-Lite specs and their rendered PNGs.
+
+The same chart (same data, same encodings) is often post-processed and
+rendered again, e.g. across the copies of a task. Entries are keyed by a hash
+of the canonical JSON of the input spec plus the render options, and kept in an
+in-memory LRU and, optionally, in a size-bounded directory on disk.
+"""
+
+import collections
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+from typing import Union
+
+import vl_convert as vlc
+
+
+# Bump whenever post-processing changes what it produces, so stale on-disk
+# entries are not reused.
+CACHE_FORMAT_VERSION = 1
+DEFAULT_MAX_MEMORY_ENTRIES = 256
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+
+
+def render_key(spec: dict[str, Any], **render_options: Any) -> str:
+  """Hash of the canonical JSON of `spec` and `render_options`.
+
+  Args:
+    spec: Vega-Lite spec, before any post-processing.
+    **render_options: Anything else that changes the output, e.g. the PNG
+      scale or which optional post-processors run.
+
+  Returns:
+    Hex digest identifying the rendered output.
+  """
+  canonical = json.dumps(
+      {
+          'spec': spec,
+          'options': render_options,
+          'version': CACHE_FORMAT_VERSION,
+          'vl_convert': vlc.__version__,
+      },
+      sort_keys=True,
+      separators=(',', ':'),
+      ensure_ascii=False,
+      default=str,
+  )
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+@dataclasses.dataclass
+class CachedRender:
+  """Post-processed spec and the PNG it renders to."""
+
+  spec: dict[str, Any]
+  png: bytes
+
+
+@dataclasses.dataclass
+class RenderCacheStats:
+  memory_hits: int = 0
+  disk_hits: int = 0
+  misses: int = 0
+  disk_evictions: int = 0
+
+  @property
+  def hit_rate(self) -> float:
+    lookups = self.memory_hits + self.disk_hits + self.misses
+    return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class RenderCache:
+  """In-memory LRU of rendered charts, optionally backed by a directory.
+
+  Each on-disk entry is a `<key>.png` and a `<key>.json` file. Once the
+  directory holds more than `max_disk_bytes`, the least recently used entries
+  (by modification time, which hits refresh) are deleted.
+  """
+
+  def __init__(
+      self,
+      max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+      cache_dir: Union[str, None] = None,
+      max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+  ):
+    self.max_memory_entries = max_memory_entries
+    self.cache_dir = cache_dir
+    self.max_disk_bytes = max_disk_bytes
+    self.stats = RenderCacheStats()
+    self._memory = collections.OrderedDict()
+    self._disk_bytes = 0
+    if cache_dir:
+      os.makedirs(cache_dir, exist_ok=True)
+      self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+  def get(self, key: str) -> Union[CachedRender, None]:
+    """Returns the entry stored under `key`, or None (counted as a miss)."""
+    if key in self._memory:
+      self._memory.move_to_end(key)
+      self.stats.memory_hits += 1
+      return self._memory[key]
+
+    entry = self._read_disk_entry(key)
+    if entry is None:
+      self.stats.misses += 1
+      return None
+    self.stats.disk_hits += 1
+    self._remember(key, entry)
+    return entry
+
+  def put(self, key: str, entry: CachedRender) -> None:
+    self._remember(key, entry)
+    if self.cache_dir:
+      self._write_disk_entry(key, entry)
+
+  def _remember(self, key: str, entry: CachedRender) -> None:
+    self._memory[key] = entry
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.max_memory_entries:
+      self._memory.popitem(last=False)
+
+  def _paths(self, key: str) -> tuple[str, str]:
+    base = os.path.join(self.cache_dir, key)
+    return f'{base}.png', f'{base}.json'
+
+  def _read_disk_entry(self, key: str) -> Union[CachedRender, None]:
+    if not self.cache_dir:
+      return None
+    png_path, spec_path = self._paths(key)
+    try:
+      with open(png_path, 'rb') as f:
+        png = f.read()
+      with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+      # Mark the entry as recently used.
+      os.utime(png_path)
+      os.utime(spec_path)
+    except (OSError, ValueError):
+      return None
+    return CachedRender(spec=spec, png=png)
+
+  def _write_disk_entry(self, key: str, entry: CachedRender) -> None:
+    png_path, spec_path = self._paths(key)
+    for path, content in [
+        (png_path, entry.png),
+        (spec_path, json.dumps(entry.spec).encode('utf-8')),
+    ]:
+      if os.path.exists(path):
+        self._disk_bytes -= os.path.getsize(path)
+      # Write to a temporary file first, so readers never see partial files.
+      fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+      os.replace(tmp_path, path)
+      self._disk_bytes += len(content)
+    if self._disk_bytes > self.max_disk_bytes:
+      self._evict_disk_entries()
+
+  def _disk_entries(self) -> list[tuple[float, list[str], int]]:
+    """(last use time, paths, total size) of every entry on disk."""
+    entries = collections.defaultdict(lambda: [0.0, [], 0])
+    for file in os.scandir(self.cache_dir):
+      key, extension = os.path.splitext(file.name)
+      if file.is_file() and extension in {'.png', '.json'}:
+        stat = file.stat()
+        entry = entries[key]
+        entry[0] = max(entry[0], stat.st_mtime)
+        entry[1].append(file.path)
+        entry[2] += stat.st_size
+    return [tuple(entry) for entry in entries.values()]
+
+  def _evict_disk_entries(self) -> None:
+    """Deletes the least recently used entries until the directory fits."""
+    entries = sorted(self._disk_entries())
+    self._disk_bytes = sum(size for _, _, size in entries)
+    for _, paths, size in entries:
+      if self._disk_bytes <= self.max_disk_bytes:
+        break
+      for path in paths:
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+      self._disk_bytes -= size
+      self.stats.disk_evictions += 1
@@ -0,0 +1,252 @@
+"""Renders Vega-Lite specs in a pool of long-lived worker processes.
+
+Each worker is this file run as a script: it warms up vl_convert once, then
+renders the requests it reads from stdin (one JSON line each) and writes back
+a JSON header line followed by the PNG/SVG bytes. Workers run as plain
+subprocesses (rather than multiprocessing), so they never re-import the
+calling script.
+
+Jobs wait in a bounded queue, so `submit` blocks (backpressure) when every
+worker is busy and the queue is full. A render that exceeds its timeout gets
+its worker killed and replaced, so one pathological chart cannot hang a run,
+and a worker that does not warm up in time is killed the same way.
+"""
+
+from concurrent import futures
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+from typing import Any
+from typing import Union
+
+import vl_convert as vlc
+
+
+DEFAULT_NUM_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_RENDER_TIMEOUT_SECONDS = 120
+# Importing and warming up vl_convert normally takes a few seconds.
+DEFAULT_START_TIMEOUT_SECONDS = 60
+# Rendered at worker start-up so the first real render doesn't pay for
+# initializing vl_convert's JavaScript runtime.
+WARM_UP_SPEC = {
+    'data': {'values': [{'a': 1}]},
+    'mark': 'point',
+    'encoding': {'x': {'field': 'a', 'type': 'quantitative'}},
+}
+RENDER_FORMATS = {'png', 'svg'}
+READY_MESSAGE = b'ready\n'
+
+
+class RenderError(Exception):
+  """A spec could not be rendered."""
+
+
+class RenderTimeoutError(RenderError, TimeoutError):
+  """A render took longer than the service's timeout."""
+
+
+class RenderService:
+  """Pool of warm vl_convert worker processes fed from a bounded queue.
+
+  Use as a context manager, or call `close` when done:
+
+    with RenderService() as service:
+      png = service.render(spec, scale=2)
+  """
+
+  def __init__(
+      self,
+      num_workers: int = DEFAULT_NUM_WORKERS,
+      max_pending: Union[int, None] = None,
+      timeout: float = DEFAULT_RENDER_TIMEOUT_SECONDS,
+      start_timeout: float = DEFAULT_START_TIMEOUT_SECONDS,
+  ):
+    """Starts the workers.
+
+    Args:
+      num_workers: Number of worker processes (renders run in parallel).
+      max_pending: Number of submitted jobs that can wait for a worker before
+        `submit` blocks. Defaults to twice `num_workers`.
+      timeout: Seconds a single render may take before its worker is killed.
+      start_timeout: Seconds a worker may take to warm up before it is killed
+        (and the jobs it would have rendered fail).
+    """
+    self.timeout = timeout
+    self.start_timeout = start_timeout
+    self._jobs = queue.Queue(maxsize=max_pending or 2 * num_workers)
+    self._threads = [
+        threading.Thread(target=self._run_worker, daemon=True)
+        for _ in range(num_workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def submit(
+      self,
+      spec: Union[dict[str, Any], str],
+      fmt: str = 'png',
+      scale: float = 1,
+      block: bool = True,
+      timeout: Union[float, None] = None,
+  ) -> futures.Future:
+    """Queues `spec` for rendering.
+
+    Args:
+      spec: Vega-Lite spec, as a dict or JSON string.
+      fmt: 'png' or 'svg'.
+      scale: PNG scale factor.
+      block: Whether to wait for room in the queue when it is full.
+      timeout: Seconds to wait for room in the queue.
+
+    Returns:
+      Future of the rendered bytes. It raises `RenderError` (or
+      `RenderTimeoutError`) if the render fails.
+
+    Raises:
+      queue.Full: If the queue stayed full (only if `block` is False or
+        `timeout` is given).
+    """
+    if fmt not in RENDER_FORMATS:
+      raise ValueError(f'Unsupported render format: {fmt}')
+    if not isinstance(spec, str):
+      spec = json.dumps(spec)
+    request = json.dumps({'spec': spec, 'format': fmt, 'scale': scale})
+    future = futures.Future()
+    self._jobs.put((request.encode('utf-8') + b'\n', future), block, timeout)
+    return future
+
+  def render(
+      self, spec: Union[dict[str, Any], str], fmt: str = 'png', scale: float = 1
+  ) -> bytes:
+    """Renders `spec`, blocking until done."""
+    return self.submit(spec, fmt, scale).result()
+
+  def close(self) -> None:
+    """Lets queued jobs finish, then stops the workers."""
+    for _ in self._threads:
+      self._jobs.put(None)
+    for thread in self._threads:
+      thread.join()
+
+  def __enter__(self) -> 'RenderService':
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.close()
+
+  def _run_worker(self) -> None:
+    """Feeds queued jobs to one worker process, replacing it when it dies."""
+    process = start_worker_process(self.start_timeout)
+    while True:
+      job = self._jobs.get()
+      if job is None:
+        break
+      request, future = job
+      if not future.set_running_or_notify_cancel():
+        continue
+      if process is None or process.poll() is not None:
+        process = start_worker_process(self.start_timeout)
+      if process is None:
+        future.set_exception(RenderError('Could not start a render worker'))
+        continue
+      try:
+        future.set_result(self._call_worker(process, request))
+      except Exception as e:  # pylint: disable=broad-exception-caught
+        future.set_exception(e)
+    if process is not None:
+      process.stdin.close()
+      process.wait()
+
+  def _call_worker(self, process: subprocess.Popen, request: bytes) -> bytes:
+    timed_out = threading.Event()
+
+    def kill():
+      timed_out.set()
+      process.kill()
+
+    timer = threading.Timer(self.timeout, kill)
+    timer.start()
+    try:
+      process.stdin.write(request)
+      process.stdin.flush()
+      header = process.stdout.readline()
+      if header:
+        header = json.loads(header)
+        data = process.stdout.read(header.get('length', 0))
+    except (OSError, ValueError):
+      header = None
+    finally:
+      timer.cancel()
+
+    if timed_out.is_set():
+      process.wait()
+      raise RenderTimeoutError(f'Render took more than {self.timeout}s')
+    if not header:
+      process.kill()
+      process.wait()
+      raise RenderError('Render worker exited unexpectedly')
+    if not header['ok']:
+      raise RenderError(header['error'])
+    return data
+
+
+def start_worker_process(
+    timeout: float = DEFAULT_START_TIMEOUT_SECONDS,
+) -> Union[subprocess.Popen, None]:
+  """Starts a worker and waits until it has warmed up.
+
+  Args:
+    timeout: Seconds to wait for the worker to warm up before killing it.
+
+  Returns:
+    The worker process, or None if it failed or timed out warming up.
+  """
+  process = subprocess.Popen(
+      [sys.executable, os.path.abspath(__file__)],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+  )
+  # Killing the worker closes its stdout, which ends the readline below.
+  timer = threading.Timer(timeout, process.kill)
+  timer.start()
+  try:
+    ready = process.stdout.readline() == READY_MESSAGE
+  finally:
+    timer.cancel()
+  if not ready:
+    process.kill()
+    process.wait()
+    return None
+  return process
+
+
+def serve_worker() -> None:
+  """Worker loop: renders requests from stdin until it is closed."""
+  stdin = sys.stdin.buffer
+  # Keep the protocol on a private copy of stdout, and send anything else
+  # written to stdout (e.g. renderer logs) to stderr.
+  stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+  os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+  vlc.vegalite_to_png(WARM_UP_SPEC)
+  stdout.write(READY_MESSAGE)
+  stdout.flush()
+  for line in stdin:
+    request = json.loads(line)
+    try:
+      if request['format'] == 'svg':
+        data = vlc.vegalite_to_svg(request['spec']).encode('utf-8')
+      else:
+        data = vlc.vegalite_to_png(request['spec'], scale=request['scale'])
+      header = {'ok': True, 'length': len(data)}
+    except Exception as e:  # pylint: disable=broad-exception-caught
+      data = b''
+      header = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+    stdout.write(json.dumps(header).encode('utf-8') + b'\n' + data)
+    stdout.flush()
+
+
+if __name__ == '__main__':
+  serve_worker()
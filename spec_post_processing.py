@@ -0,0 +1,935 @@
+"""Vega-Lite post processor that works directly on plain Vega-Lite dicts.
+
+This mirrors `altair_post_processing.post_process_chart`, but never builds (or
+validates) altair objects. Inline data (either `data.values` or a named entry in
+the top-level `datasets`) is viewed as a pandas DataFrame, so the data-dependent
+processors can share their logic with the altair engine.
+"""
+
+import functools
+import hashlib
+import json
+import re
+from typing import Any
+from typing import Union
+
+from altair.utils import sanitize_dataframe
+import numpy as np
+import pandas as pd
+
+from altair_post_processing import COLUMN_NAME_CHARACTER_REPLACEMENTS
+from altair_post_processing import DEFAULT_MAX_BINS
+from altair_post_processing import DEFAULT_MAX_POINTS
+from altair_post_processing import DEFAULT_PIE_RADIUS
+from altair_post_processing import DISTANCE_OF_LABEL_FROM_WEDGE
+from altair_post_processing import MAX_HEATMAP_LABELED_X_VALUES
+from altair_post_processing import MAX_VERTICAL_BARS
+from altair_post_processing import MIN_ROWS_FOR_PRE_AGGREGATION
+from altair_post_processing import append_description
+from altair_post_processing import PostProcessingReport
+from altair_post_processing import downsample_data
+from altair_post_processing import frame_fingerprint
+from altair_post_processing import group_items_sharing_data
+from altair_post_processing import infer_field_conversion
+from altair_post_processing import is_continuous
+from altair_post_processing import map_groups_in_processes
+from altair_post_processing import merge_extra_wedges
+from altair_post_processing import pre_aggregate_data
+from altair_post_processing import prune_unused_columns
+from altair_post_processing import run_processor
+from altair_post_processing import SharedDataCache
+
+
+# Encoding channels that accept a `format` or an `axis` property (in altair,
+# `hasattr(encoding, 'format')` / `hasattr(encoding, 'axis')`).
+CHANNELS_WITH_FORMAT = {'description', 'href', 'text', 'tooltip', 'url'}
+CHANNELS_WITH_AXIS = {'x', 'y'}
+# altair serializes datetime columns with `isoformat()`, so these strings are
+# read back into datetime columns to match the DataFrame the chart was built
+# from.
+ISO_DATETIME_REGEX = re.compile(
+    r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?$'
+)
+
+ALTAIR_DATASET_NAME_REGEX = re.compile(r'^data-[0-9a-f]{32}$')
+
+Spec = dict[str, Any]
+
+
+def get_mark_type(spec: Spec) -> Union[str, None]:
+  mark = spec.get('mark')
+  if isinstance(mark, str):
+    return mark
+  if isinstance(mark, dict) and isinstance(mark.get('type'), str):
+    return mark['type']
+  return None
+
+
+def get_encoding(spec: Spec) -> Spec:
+  """Returns the encoding dict of `spec` (empty if it has none)."""
+  encoding = spec.get('encoding')
+  return encoding if isinstance(encoding, dict) else {}
+
+
+def dataset_name(values: list[Any]) -> str:
+  """Same dataset naming scheme as altair's `to_dict`."""
+  if values == [{}]:
+    return 'empty'
+  values_json = json.dumps(values, sort_keys=True)
+  return 'data-' + hashlib.md5(values_json.encode()).hexdigest()
+
+
+def values_to_frame(values: list[Any]) -> pd.DataFrame:
+  """Builds a columnar view of inline Vega-Lite `values`."""
+  data = pd.DataFrame.from_records(values)
+  for column in data.columns:
+    if data[column].dtype != 'object':
+      continue
+    first_valid = data[column].first_valid_index()
+    if first_valid is None:
+      continue
+    first_value = data[column][first_valid]
+    if not isinstance(first_value, str) or not ISO_DATETIME_REGEX.match(
+        first_value
+    ):
+      continue
+    try:
+      data[column] = pd.to_datetime(data[column], format='ISO8601')
+    except (ValueError, TypeError):
+      continue
+  return data
+
+
+def column_to_values(column: pd.Series) -> list[Any]:
+  """JSON-ready values of `column`, as `sanitize_dataframe` would produce.
+
+  Common dtypes are converted a whole column at a time; anything else goes
+  through `sanitize_dataframe`.
+  """
+  # Extension dtypes (nullable integers, categories...) also have a `kind`.
+  kind = column.dtype.kind if isinstance(column.dtype, np.dtype) else None
+  if kind in ('b', 'i', 'u'):
+    return column.tolist()
+  if kind == 'f':
+    values = column.tolist()
+    for i in np.flatnonzero(~np.isfinite(column.to_numpy())):
+      values[i] = None
+    return values
+  if kind == 'M':
+    datetimes = column.to_numpy()
+    missing = np.isnat(datetimes)
+    # isoformat() omits fractional seconds when they are zero, like
+    # datetime_as_string does at second precision.
+    seconds = datetimes.astype('datetime64[s]')
+    if (seconds == datetimes)[~missing].all():
+      values = np.datetime_as_string(seconds, unit='s').astype(object)
+      values[missing] = ''
+      return values.tolist()
+  if kind == 'O':
+    values = column.tolist()
+    # Arrays and numpy scalars need converting to python objects.
+    if pd.api.types.infer_dtype(column, skipna=True) in (
+        'string',
+        'empty',
+    ) or not any(
+        isinstance(value, (np.ndarray, np.generic)) for value in values
+    ):
+      for i in np.flatnonzero(column.isna().to_numpy()):
+        values[i] = None
+      return values
+  return sanitize_dataframe(column.to_frame()).to_dict(orient='list')[
+      column.name
+  ]
+
+
+def frame_to_values(data: pd.DataFrame) -> list[Any]:
+  """Serializes `data` the same way altair does for inline data.
+
+  Values are built column by column rather than row by row, which is much
+  faster for large frames.
+  """
+  # Validates the column names and dtypes, raising like altair does.
+  columns = sanitize_dataframe(data.iloc[:0]).columns.tolist()
+  values = [column_to_values(data.iloc[:, i]) for i in range(len(columns))]
+  return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+class SpecDataViews:
+  """Columnar views over the inline data referenced by a spec.
+
+  Each `data` entry gets its own DataFrame, just like the altair engine copies
+  every DataFrame it finds, and the DataFrames are written back into the spec
+  by `write_back` (only if they were modified).
+  """
+
+  def __init__(
+      self, spec: Spec, shared_cache: Union[SharedDataCache, None] = None
+  ):
+    self.spec = spec
+    self.datasets = spec.get('datasets', {})
+    self.shared_cache = shared_cache
+    self.frames_by_name = {}
+    # (spec node owning `data`, DataFrame, fingerprint) tuples.
+    self.views = []
+
+  def get(self, node: Spec) -> Union[pd.DataFrame, None]:
+    """Returns a new DataFrame view of `node['data']` (None if not inline)."""
+    data_spec = node['data']
+    if not isinstance(data_spec, dict):
+      return None
+    if 'values' in data_spec and isinstance(data_spec['values'], list):
+      data = self.to_frame(data_spec['values'])
+    elif data_spec.get('name') in self.datasets:
+      name = data_spec['name']
+      if name not in self.frames_by_name:
+        self.frames_by_name[name] = self.to_frame(self.datasets[name], name)
+        data = self.frames_by_name[name]
+      else:
+        data = self.frames_by_name[name].copy()
+    else:
+      return None
+    self.views.append((node, data, frame_fingerprint(data)))
+    return data
+
+  def to_frame(
+      self, values: list[Any], name: Union[str, None] = None
+  ) -> pd.DataFrame:
+    """`values_to_frame`, parsing each dataset once per shared cache."""
+    if self.shared_cache is None:
+      return values_to_frame(values)
+    if name is not None and ALTAIR_DATASET_NAME_REGEX.match(name):
+      # altair names datasets after a hash of their content.
+      key = name
+    else:
+      key = self.shared_cache.key(values, functools.partial(dataset_name, values))
+    return self.shared_cache.frame(key, lambda: values_to_frame(values))
+
+  def write_back(self) -> None:
+    """Writes modified DataFrames back into the spec."""
+    referenced_names = set()
+    for node, data, fingerprint in self.views:
+      data_spec = node['data']
+      if frame_fingerprint(data) != fingerprint:
+        values = frame_to_values(data)
+        if 'values' in data_spec:
+          data_spec['values'] = values
+        else:
+          name = dataset_name(values)
+          self.datasets[name] = values
+          data_spec['name'] = name
+      if 'name' in data_spec:
+        referenced_names.add(data_spec['name'])
+    # Drop datasets that were replaced by a modified copy.
+    for name in list(self.frames_by_name):
+      if name not in referenced_names:
+        del self.datasets[name]
+
+
+def flatten_nesting_recursive(
+    spec: Spec,
+    data: Union[pd.DataFrame, None],
+    nesting_attrs: list[str],
+    flattened_list: list[tuple[Spec, pd.DataFrame]],
+    views: SpecDataViews,
+) -> None:
+  """Recursively populates `flattened_list` with specs nested within `spec`.
+
+  Args:
+    spec: A spec somewhere in a nested spec structure.
+    data: The DataFrame view of the data referenced by `spec`.
+    nesting_attrs: List of nesting attribute names we are flattening over.
+      Contents could be any of "vconcat", "hconcat", or "layer".
+    flattened_list: Running flattened list of (non-nested spec, data) tuples.
+    views: Data views of the top-level spec.
+  """
+  bottom_level = True  # True if `spec` has no nesting below it.
+  for attr in nesting_attrs:
+    if isinstance(spec.get(attr), list):
+      bottom_level = False
+      for nested_spec in spec[attr]:
+        if 'data' in nested_spec:
+          nested_spec_data = views.get(nested_spec)
+        else:
+          nested_spec_data = data
+        flatten_nesting_recursive(
+            nested_spec, nested_spec_data, nesting_attrs, flattened_list, views
+        )
+  if bottom_level:  # Store only non-nested specs.
+    flattened_list.append((spec, data))
+
+
+def get_defined_encodings_with_field(spec: Spec) -> list[tuple[str, Spec]]:
+  """Gets flat list of (channel, encoding) pairs with a 'field' in `spec`."""
+  encodings = []
+  for channel, encoding in get_encoding(spec).items():
+    if isinstance(encoding, list):  # Common with e.g. tooltips.
+      for list_encoding_entry in encoding:
+        if isinstance(list_encoding_entry, dict) and isinstance(
+            list_encoding_entry.get('field'), str
+        ):
+          encodings.append((channel, list_encoding_entry))
+    elif isinstance(encoding, dict) and isinstance(encoding.get('field'), str):
+      encodings.append((channel, encoding))
+  return encodings
+
+
+def sanitize_column_name(name: str) -> str:
+  for prohibited, replacement in COLUMN_NAME_CHARACTER_REPLACEMENTS.items():
+    name = name.replace(prohibited, replacement)
+  return name
+
+
+def sanitize_column_names(spec: Spec, data: pd.DataFrame) -> None:
+  """Replaces characters in column names that Vega-Lite can't render with."""
+  renames = {
+      column: sanitize_column_name(column)
+      for column in data.columns
+      if sanitize_column_name(column) != column
+  }
+  if renames:
+    data.rename(columns=renames, inplace=True)
+
+  for _, encoding in get_defined_encodings_with_field(spec):
+    encoding['field'] = sanitize_column_name(encoding['field'])
+
+
+def remove_duplicate_selectors(
+    layers: list[tuple[Spec, pd.DataFrame]],
+) -> bool:
+  """Remove duplicate selectors (based on name) from the layers."""
+  modified_spec = False
+  selector_names = set()
+  for layer, _ in layers:
+    if not isinstance(layer.get('selection'), dict):
+      continue
+    for selector in list(layer['selection']):
+      if selector in selector_names:
+        del layer['selection'][selector]
+        modified_spec = True
+      else:
+        selector_names.add(selector)
+    if not layer['selection']:
+      del layer['selection']
+  return modified_spec
+
+
+def scale_axes(layers: list[tuple[Spec, pd.DataFrame]]) -> None:
+  """Adds axes scales based on min and max of x and y."""
+  deny_list_mark_types = {'arc', 'area', 'bar', 'rect', 'geoshape', 'rule'}
+  for layer, _ in layers:
+    if get_mark_type(layer) in deny_list_mark_types:
+      return
+
+  for layer, data in layers:
+    if 'encoding' not in layer:
+      continue
+
+    for channel in ['x', 'y']:
+      variable = layer['encoding'].get(channel)
+      if not isinstance(variable, dict) or 'field' not in variable:
+        continue
+      if variable.get('type') != 'quantitative':
+        continue
+      if 'scale' in variable:
+        # We should respect any scale deliberately added by the LLM code.
+        continue
+      if 'bin' in variable or 'aggregate' in variable:
+        continue
+
+      variable_min = data.min(numeric_only=True)[variable['field']]
+      variable_max = data.max(numeric_only=True)[variable['field']]
+      variable_mean = data.mean(numeric_only=True)[variable['field']]
+      lower_bound = variable_min - 0.15 * (variable_mean - variable_min)
+      upper_bound = variable_max + 0.15 * (variable_max - variable_mean)
+      if lower_bound < 0 and (data[variable['field']] >= 0).all():
+        lower_bound = 0
+      else:
+        lower_bound = float(lower_bound)
+      variable['scale'] = {'domain': [lower_bound, float(upper_bound)]}
+
+
+def remove_legend_none(spec: Spec) -> None:
+  """Removes legend=None from pie charts' and heatmaps' color property."""
+  if get_mark_type(spec) not in {'arc', 'rect'}:
+    return
+  color = get_encoding(spec).get('color')
+  if isinstance(color, dict) and 'legend' in color and color['legend'] is None:
+    del color['legend']
+
+
+def maybe_remove_legend_variables(
+    layers: list[tuple[Spec, pd.DataFrame]],
+) -> None:
+  """Conditionally removes colors, shapes & legend based on number of series."""
+  all_mark_types = {get_mark_type(layer[0]) for layer in layers}
+  if 'arc' in all_mark_types or 'rect' in all_mark_types:
+    return
+
+  for layer, data in layers:
+    encoding = get_encoding(layer)
+    for variable in ['color', 'shape']:
+      if not isinstance(encoding.get(variable), dict) or (
+          'field' not in encoding[variable]
+      ):
+        continue
+      if data[encoding[variable]['field']].nunique() == 1:
+        del encoding[variable]
+
+
+def format_labeled_pie_chart(layers: list[tuple[Spec, pd.DataFrame]]) -> None:
+  """For pie charts, format pie and text (if available)."""
+  pie_layers = [layer for layer in layers if get_mark_type(layer[0]) == 'arc']
+  text_layers = [layer for layer in layers if get_mark_type(layer[0]) == 'text']
+
+  if len(pie_layers) != 1:
+    return
+  pie_layer = pie_layers[0][0]
+
+  if len(text_layers) > 1:
+    return
+
+  # Set pie order to descending by value.
+  theta = pie_layer['encoding']['theta']
+  pie_layer['encoding']['order'] = {
+      key: theta[key] for key in ['field', 'type'] if key in theta
+  }
+  pie_layer['encoding']['order']['sort'] = 'descending'
+
+  uses_normalize = False
+  if theta.get('stack') == 'normalize':
+    uses_normalize = True
+  else:
+    theta['stack'] = True
+
+  if not text_layers:
+    return
+  text_layer = text_layers[0][0]
+
+  # If no explicit outerRadius was set for pie layer, set default outerRadius.
+  if isinstance(pie_layer['mark'], str):
+    pie_layer['mark'] = {'type': 'arc', 'outerRadius': DEFAULT_PIE_RADIUS}
+  elif 'outerRadius' not in pie_layer['mark']:
+    pie_layer['mark']['outerRadius'] = DEFAULT_PIE_RADIUS
+
+  # Set text radius to be slightly outside pie radius.
+  text_radius = pie_layer['mark']['outerRadius'] + DISTANCE_OF_LABEL_FROM_WEDGE
+  if isinstance(text_layer['mark'], str):
+    text_layer['mark'] = {'type': 'text'}
+  text_layer['mark']['radius'] = text_radius
+
+  text_layer['encoding']['order'] = dict(pie_layer['encoding']['order'])
+
+  if isinstance(text_layer['encoding'].get('theta'), dict):
+    text_layer['encoding']['theta']['stack'] = (
+        'normalize' if uses_normalize else True
+    )
+
+
+def remove_extra_wedges(layers: list[tuple[Spec, pd.DataFrame]]) -> None:
+  """Function to remove extra wedges of a pie chart."""
+  pie_layers = [layer for layer in layers if get_mark_type(layer[0]) == 'arc']
+  if len(pie_layers) != 1:
+    return
+  pie_layer, pie_data = pie_layers[0]
+
+  encoding = get_encoding(pie_layer)
+  theta_column = (encoding.get('theta') or {}).get('field')
+  color_column = (encoding.get('color') or {}).get('field')
+  if not theta_column or not color_column:
+    return
+
+  merge_extra_wedges(pie_data, theta_column, color_column)
+
+
+def maybe_make_bar_or_box_chart_horizontal(
+    layers: list[tuple[Spec, pd.DataFrame]],
+) -> None:
+  """Conditionally swaps x and y axes of `spec`."""
+
+  def should_rotate(spec, data):
+    if get_mark_type(spec) not in {'bar', 'boxplot'}:
+      return False
+    encoding = get_encoding(spec)
+    if 'x' not in encoding or 'y' not in encoding:
+      return False
+    if is_continuous(encoding['x'].get('type')):
+      return False
+
+    num_x_categories = data[encoding['x'].get('field')].nunique()
+    if not is_continuous(encoding['y'].get('type')):
+      num_y_categories = data[encoding['y'].get('field')].nunique()
+    else:
+      num_y_categories = 0
+
+    return (
+        num_x_categories > MAX_VERTICAL_BARS
+        and num_x_categories > num_y_categories
+    )
+
+  def rotate_spec(spec):
+    if 'encoding' not in spec:
+      return
+    encoding = spec['encoding']
+    x, y = encoding.pop('x', None), encoding.pop('y', None)
+    if y is not None:
+      encoding['x'] = y
+    if x is not None:
+      encoding['y'] = x
+
+    # We should not carry over the labelAngle when swapping the axes.
+    for encoding_var in [x, y]:
+      if not isinstance(encoding_var, dict):
+        continue
+      axis = encoding_var.get('axis')
+      if isinstance(axis, dict) and 'labelAngle' in axis:
+        del axis['labelAngle']
+        if not axis:
+          del encoding_var['axis']
+
+  if any([should_rotate(layer, data) for layer, data in layers]):
+    for layer, _ in layers:
+      rotate_spec(layer)
+
+
+def match_bar_grouping_with_orientation(spec: Spec) -> None:
+  """Make sure `column` or `row` matches bar orientation in grouped bars."""
+  if get_mark_type(spec) not in {'bar', 'boxplot'}:
+    return
+  encoding = get_encoding(spec)
+  if ('row' in encoding) == ('column' in encoding):
+    return
+  if 'x' not in encoding or 'y' not in encoding:
+    return
+  x_type, y_type = encoding['x'].get('type'), encoding['y'].get('type')
+  if not is_continuous(x_type) and not is_continuous(y_type):
+    return
+
+  is_horizontal_bar = is_continuous(x_type) and not is_continuous(y_type)
+  if is_horizontal_bar and 'column' in encoding:
+    encoding['row'] = encoding.pop('column')
+
+    header = encoding['row'].get('header')
+    if isinstance(header, dict):
+      for orient in ['titleOrient', 'labelOrient']:
+        if header.get(orient) == 'bottom':
+          header[orient] = 'left'
+
+
+def maybe_update_types_and_formats(
+    layers: list[tuple[Spec, pd.DataFrame]],
+    shared_cache: Union[SharedDataCache, None] = None,
+) -> None:
+  """Corrects type and updates format of mis-typed fields in `spec`."""
+  for layer, _ in layers:
+    if get_mark_type(layer) == 'rect':
+      return
+
+  # Each item is a (field name, original DataFrame, new DataFrame column, new
+  # type, new format) tuple.
+  fields_to_convert = []
+
+  def already_found_field(field, data):
+    for found_field, found_data, *_ in fields_to_convert:
+      if found_field == field and found_data is data:
+        return True
+    return False
+
+  for layer, data in layers:
+    if 'encoding' not in layer:
+      continue
+    for variable_name in ['x', 'y', 'theta', 'color']:
+      variable = layer['encoding'].get(variable_name)
+      if not isinstance(variable, dict) or 'field' not in variable:
+        continue
+      field = variable['field']
+
+      if already_found_field(field, data):
+        continue
+
+      new_column, new_type, new_format = infer_field_conversion(
+          field, data, shared_cache
+      )
+      if new_type:
+        fields_to_convert.append(
+            (field, data, new_column, new_type, new_format)
+        )
+
+  for (
+      field_to_convert,
+      data_to_update,
+      new_column,
+      new_type,
+      new_format,
+  ) in fields_to_convert:
+    data_to_update[field_to_convert] = new_column
+
+    for layer, data in layers:
+      if data is not data_to_update:
+        continue
+      for channel, encoding in get_defined_encodings_with_field(layer):
+        if encoding['field'] != field_to_convert:
+          continue
+
+        encoding['type'] = new_type
+        if new_format:
+          if channel in CHANNELS_WITH_FORMAT:
+            encoding['format'] = new_format
+          if channel in CHANNELS_WITH_AXIS:
+            encoding.setdefault('axis', {})['format'] = new_format
+
+
+def set_default_bins(spec: Spec) -> None:
+  """Set default maxbins for single-layer spec."""
+  encoding = get_encoding(spec)
+  for channel in ['x', 'y']:
+    variable = encoding.get(channel)
+    if isinstance(variable, dict) and variable.get('bin') is True:
+      variable['bin'] = {'maxbins': DEFAULT_MAX_BINS}
+
+
+def fix_binning(spec: Spec) -> None:
+  """Removes scale from binned vars and ensure binning is reflected in tooltips."""
+  encoding = get_encoding(spec)
+  for channel in ['x', 'y']:
+    variable = encoding.get(channel)
+    if not isinstance(variable, dict) or 'bin' not in variable:
+      continue
+
+    # Don't allow a scale type when the data is binned.
+    if isinstance(variable.get('scale'), dict):
+      variable['scale'].pop('type', None)
+
+    if (
+        variable['bin'] is not None
+        and variable['bin'] is not False
+        and 'field' in variable
+        and 'tooltip' in encoding
+    ):
+      tooltips = (
+          encoding['tooltip']
+          if isinstance(encoding['tooltip'], list)
+          else [encoding['tooltip']]
+      )
+      for tooltip in tooltips:
+        if (
+            isinstance(tooltip, dict)
+            and 'field' in tooltip
+            and tooltip['field'] == variable['field']
+        ):
+          tooltip['bin'] = variable['bin']
+          break
+
+
+def maybe_remove_heatmap_labels(
+    layers: list[tuple[Spec, pd.DataFrame]],
+    layered_spec: Spec,
+) -> None:
+  """For a labeled heatmap with too many x-values, remove label layer."""
+  heatmap_layers = [
+      layer for layer in layers if get_mark_type(layer[0]) == 'rect'
+  ]
+  text_layers = [layer for layer in layers if get_mark_type(layer[0]) == 'text']
+  if len(heatmap_layers) != 1 or len(text_layers) != 1:
+    return
+  heatmap_layer, heatmap_data = heatmap_layers[0]
+  text_layer, text_data = text_layers[0]
+
+  if heatmap_data is not text_data:
+    return
+
+  for layer in [heatmap_layer, text_layer]:
+    for variable in ['x', 'y']:
+      if 'field' not in (get_encoding(layer).get(variable) or {}):
+        return
+  heatmap_x = heatmap_layer['encoding']['x']['field']
+  heatmap_y = heatmap_layer['encoding']['y']['field']
+  if (
+      text_layer['encoding']['x']['field'] != heatmap_x
+      or text_layer['encoding']['y']['field'] != heatmap_y
+  ):
+    return
+
+  if heatmap_data[heatmap_x].nunique() > MAX_HEATMAP_LABELED_X_VALUES:
+    layers.remove(text_layers[0])
+    layered_spec['layer'].remove(text_layer)
+
+
+def layer_fingerprint(layer: Spec) -> str:
+  """Serialization of a non-nested spec, leaving out its data."""
+  return json.dumps(
+      {
+          key: value
+          for key, value in layer.items()
+          if key not in {'data', 'datasets'}
+      },
+      sort_keys=True,
+      default=str,
+  )
+
+
+def post_process_spec(
+    spec: Spec,
+    prune_columns: bool = True,
+    instrument: bool = False,
+    shared_cache: Union[SharedDataCache, None] = None,
+) -> PostProcessingReport:
+  """Calls all custom Vega-Lite post-processing, altering `spec` in place.
+
+  Equivalent to `altair_post_processing.post_process_chart` on the chart `spec`
+  was serialized from.
+
+  Args:
+    spec: Vega-Lite spec, as produced by altair's `to_dict`.
+    prune_columns: Whether to drop data columns the spec never references.
+    instrument: Whether to record each processor's wall time, exceptions and
+      whether it changed the spec.
+    shared_cache: Cache of work shared with other specs reading the same data
+      (see `post_process_specs`).
+
+  Returns:
+    Report of the post-processing.
+  """
+  report = PostProcessingReport(instrumented=instrument)
+  # Processors only record into the report when instrumented.
+  recorded_report = report if instrument else None
+
+  def fingerprint():
+    return [
+        (layer_fingerprint(layer), frame_fingerprint(data))
+        for layers in all_layers
+        for layer, data in layers
+    ]
+
+  # We don't want to block on any of the post-processing. So, if anything goes
+  # wrong in one post processor, just move on to the next one.
+  def try_or_continue(fn, *args):
+    run_processor(recorded_report, fingerprint, fn.__name__, fn, *args)
+
+  def try_or_continue_for_each(fn, spec_data_pairs, pass_data=True):
+    def for_each():
+      if pass_data:
+        for layer, data in spec_data_pairs:
+          fn(layer, data)
+      else:
+        for layer, _ in spec_data_pairs:
+          fn(layer)
+
+    run_processor(recorded_report, fingerprint, fn.__name__, for_each)
+
+  views = SpecDataViews(spec, shared_cache)
+  concats = []
+  flatten_nesting_recursive(
+      spec,
+      views.get(spec) if 'data' in spec else None,
+      ['vconcat', 'hconcat'],
+      concats,
+      views,
+  )
+  # Flatten every concat before processing any of them, so all data views are
+  # taken from the unmodified spec.
+  all_layers = []
+  for concat, data in concats:
+    layers = []
+    flatten_nesting_recursive(concat, data, ['layer'], layers, views)
+    all_layers.append(layers)
+
+  if prune_columns:
+
+    def prune_columns_and_record_bytes():
+      report.bytes_pruned = prune_unused_columns(
+          spec, [data for layers in all_layers for _, data in layers]
+      )
+
+    run_processor(
+        recorded_report,
+        fingerprint,
+        'prune_unused_columns',
+        prune_columns_and_record_bytes,
+    )
+
+  for layers in all_layers:
+    try_or_continue_for_each(sanitize_column_names, layers)
+    try_or_continue(remove_duplicate_selectors, layers)
+    try_or_continue(maybe_update_types_and_formats, layers, shared_cache)
+    try_or_continue(maybe_remove_heatmap_labels, layers, spec)
+    try_or_continue(scale_axes, layers)
+    try_or_continue_for_each(remove_legend_none, layers, pass_data=False)
+    try_or_continue(maybe_remove_legend_variables, layers)
+    try_or_continue(remove_extra_wedges, layers)
+    try_or_continue(format_labeled_pie_chart, layers)
+    if not any(
+        [layer for layer, _ in layers if get_mark_type(layer) == 'rect']
+    ):
+      try_or_continue_for_each(set_default_bins, layers, pass_data=False)
+    try_or_continue_for_each(fix_binning, layers, pass_data=False)
+    if len(concats) == 1:
+      # For now, we don't want to do this for multiple concatenated charts.
+      try_or_continue(maybe_make_bar_or_box_chart_horizontal, layers)
+    try_or_continue_for_each(
+        match_bar_grouping_with_orientation, layers, pass_data=False
+    )
+
+  views.write_back()
+  return report
+
+
+def spec_data_keys(spec: Any, keys: set[Any]) -> None:
+  """Adds a key for every inline dataset of `spec` to `keys`."""
+  if isinstance(spec, dict):
+    for key, value in spec.items():
+      if key == 'datasets' and isinstance(value, dict):
+        keys.update(value)
+      elif key == 'data' and isinstance(value, dict) and 'values' in value:
+        keys.add(id(value['values']))
+      else:
+        spec_data_keys(value, keys)
+  elif isinstance(spec, list):
+    for value in spec:
+      spec_data_keys(value, keys)
+
+
+def post_process_spec_group(
+    specs: list[Spec], prune_columns: bool, instrument: bool
+) -> list[tuple[Spec, PostProcessingReport]]:
+  """Post-processes `specs` (in a worker process) with one shared cache."""
+  shared_cache = SharedDataCache()
+  return [
+      (spec, post_process_spec(spec, prune_columns, instrument, shared_cache))
+      for spec in specs
+  ]
+
+
+def post_process_specs(
+    specs: list[Spec],
+    prune_columns: bool = True,
+    instrument: bool = False,
+    shared_cache: Union[SharedDataCache, None] = None,
+    num_processes: int = 1,
+) -> list[PostProcessingReport]:
+  """Post-processes a batch of specs, sharing work on the data they share.
+
+  Equivalent to `altair_post_processing.post_process_charts`.
+
+  Args:
+    specs: Vega-Lite specs, altered in place.
+    prune_columns: Whether to drop data columns the specs never reference.
+    instrument: Whether to record per-processor timings in the reports.
+    shared_cache: Cache to share with other batches (e.g. earlier turns of the
+      conversation). A new one is used by default.
+    num_processes: If more than 1, groups of specs that share no dataset are
+      post-processed in that many processes. Specs sharing a dataset (by name,
+      which altair derives from the content) always stay in the same group,
+      which shares its own cache (`shared_cache` is only used in this
+      process).
+
+  Returns:
+    Report of each spec's post-processing, in order.
+  """
+  if shared_cache is None:
+    shared_cache = SharedDataCache()
+
+  if num_processes > 1 and len(specs) > 1:
+    spec_keys = []
+    for spec in specs:
+      keys = set()
+      spec_data_keys(spec, keys)
+      spec_keys.append(keys)
+    groups = group_items_sharing_data(spec_keys)
+    results = None
+    if len(groups) > 1:
+      results = map_groups_in_processes(
+          post_process_spec_group,
+          [[specs[i] for i in group] for group in groups],
+          num_processes,
+          prune_columns,
+          instrument,
+      )
+    if results is not None:
+      reports = [None] * len(specs)
+      for group, group_results in zip(groups, results):
+        for i, (processed_spec, report) in zip(group, group_results):
+          # Specs come back as copies, so swap their content in.
+          specs[i].clear()
+          specs[i].update(processed_spec)
+          reports[i] = report
+      return reports
+
+  return [
+      post_process_spec(spec, prune_columns, instrument, shared_cache)
+      for spec in specs
+  ]
+
+
+def get_top_level_values(spec: Spec) -> Union[list[Any], None]:
+  """Returns the inline values of the top-level data of `spec`, if any."""
+  data_spec = spec.get('data')
+  if not isinstance(data_spec, dict):
+    return None
+  if isinstance(data_spec.get('values'), list):
+    return data_spec['values']
+  if data_spec.get('name') in spec.get('datasets', {}):
+    return spec['datasets'][data_spec['name']]
+  return None
+
+
+def set_top_level_values(spec: Spec, values: list[Any]) -> None:
+  """Replaces the inline values of the top-level data of `spec`."""
+  data_spec = spec['data']
+  if 'values' in data_spec:
+    data_spec['values'] = values
+  else:
+    del spec['datasets'][data_spec['name']]
+    data_spec['name'] = dataset_name(values)
+    spec['datasets'][data_spec['name']] = values
+
+
+def pre_aggregate_spec(
+    spec: Spec, min_rows: int = MIN_ROWS_FOR_PRE_AGGREGATION
+) -> bool:
+  """Optionally pre-aggregates a bar, pie or heatmap spec's data in place.
+
+  Equivalent to `altair_post_processing.pre_aggregate_chart`, meant to run
+  after `post_process_spec`.
+
+  Args:
+    spec: Vega-Lite spec with its data at the top level.
+    min_rows: Smallest number of rows worth pre-aggregating.
+
+  Returns:
+    True if `spec` now reads pre-aggregated data.
+  """
+  values = get_top_level_values(spec)
+  if values is None or len(values) < min_rows:
+    return False
+
+  aggregated = pre_aggregate_data(spec, values_to_frame(values), min_rows)
+  if aggregated is None:
+    return False
+  set_top_level_values(spec, frame_to_values(aggregated))
+  return True
+
+
+def downsample_spec(spec: Spec, max_points: int = DEFAULT_MAX_POINTS) -> bool:
+  """Optionally downsamples a line, area or scatter spec's data in place.
+
+  Equivalent to `altair_post_processing.downsample_chart`, meant to run after
+  `post_process_spec`.
+
+  Args:
+    spec: Vega-Lite spec with its data at the top level.
+    max_points: Point budget of the whole chart.
+
+  Returns:
+    True if `spec` now reads downsampled data.
+  """
+  values = get_top_level_values(spec)
+  if values is None or len(values) <= max_points:
+    return False
+
+  downsampled = downsample_data(spec, values_to_frame(values), max_points)
+  if downsampled is None:
+    return False
+  data, sentence = downsampled
+  set_top_level_values(spec, frame_to_values(data))
+  spec['description'] = append_description(spec.get('description'), sentence)
+  return True
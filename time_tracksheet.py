@@ -0,0 +1,141 @@
+"""Append-only store for the time-track rows of every prompt.
+
+Each row is appended as one JSON line to `<sheet name>.jsonl`, so recording a
+turn takes the same time however long the history is. The Excel workbook the
+rows used to be kept in is exported from the store instead, after each task
+by the scripts or on demand, and an existing workbook is imported into the
+store the first time it is opened:
+
+    python time_tracksheet.py export time-tracksheet/gemini-prompts-time-track-sheet.xlsx
+    python time_tracksheet.py import old-sheet.xlsx --into time-tracksheet/gpt-prompts-time-track-sheet.xlsx
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+
+import pandas as pd
+
+
+ROWS_SUFFIX = '.jsonl'
+# Columns parsed back into timestamps when exporting
+TIMESTAMP_COLUMNS = ('timestamp',)
+
+
+def json_value(value):
+    """JSON value of the row values json can't write itself."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # numpy and pandas scalars
+        return value.item()
+    raise TypeError(f'Cannot store {type(value).__name__} in a time-track row')
+
+
+def blank_to_none(value):
+    # Empty workbook cells are read as NaN
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class TimeTrackSheet:
+    """Time-track rows of one sheet, appended to a JSON lines file.
+
+    `xlsx_path` is the workbook the rows are exported to; the rows themselves
+    are kept next to it with a .jsonl suffix. If only the workbook exists
+    (sheets recorded before the store), its rows are imported first.
+    """
+
+    def __init__(self, xlsx_path):
+        self.xlsx_path = xlsx_path
+        self.rows_path = os.path.splitext(xlsx_path)[0] + ROWS_SUFFIX
+        self.checked_tail = False
+        if not os.path.exists(self.rows_path) and os.path.exists(self.xlsx_path):
+            count = self.import_xlsx(self.xlsx_path)
+            print(f'[x] Imported {count} rows of {self.xlsx_path} into {self.rows_path}')
+
+    def append(self, row):
+        """Appends one row, a dict or pandas Series of column values."""
+        if isinstance(row, pd.Series):
+            row = row.to_dict()
+        self.append_lines([json.dumps(row, default=json_value, ensure_ascii=False)])
+
+    def append_lines(self, lines):
+        directory = os.path.dirname(self.rows_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.rows_path, 'a+b') as f:
+            if not self.checked_tail:
+                # A row cut short by a crash is skipped when reading; start a new line after it
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        f.write(b'\n')
+                self.checked_tail = True
+            f.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+
+    def rows(self):
+        """Yields the stored rows as dicts, oldest first."""
+        try:
+            f = open(self.rows_path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def to_dataframe(self):
+        """The stored rows as a DataFrame, with the columns in the order they first appear."""
+        data = pd.DataFrame(list(self.rows()))
+        for column in TIMESTAMP_COLUMNS:
+            if column in data:
+                data[column] = pd.to_datetime(data[column], errors='coerce')
+        return data
+
+    def export_xlsx(self, xlsx_path=None):
+        """Writes every stored row to the sheet's workbook (or `xlsx_path`), returning its path."""
+        xlsx_path = xlsx_path or self.xlsx_path
+        data = self.to_dataframe()
+        temp_path = f'{xlsx_path}.tmp.xlsx'
+        data.to_excel(temp_path, index=False)
+        os.replace(temp_path, xlsx_path)
+        return xlsx_path
+
+    def import_xlsx(self, xlsx_path):
+        """Appends the rows of a workbook written by the scripts, returning how many there were."""
+        data = pd.read_excel(xlsx_path)
+        rows = [{column: blank_to_none(value) for column, value in row.items()}
+                for row in data.to_dict(orient='records')]
+        if rows:
+            self.append_lines([json.dumps(row, default=json_value, ensure_ascii=False) for row in rows])
+        return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Write the workbook of stored rows')
+    export_parser.add_argument('sheets', nargs='+', help='Workbook paths of the sheets')
+    import_parser = subparsers.add_parser('import', help='Append the rows of a workbook to a sheet')
+    import_parser.add_argument('workbook', help='Workbook to import')
+    import_parser.add_argument('--into', required=True, help='Workbook path of the sheet to import into')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        for xlsx_path in args.sheets:
+            print(f'[x] Exported {TimeTrackSheet(xlsx_path).export_xlsx()}')
+    else:
+        sheet = TimeTrackSheet(args.into)
+        print(f'[x] Imported {sheet.import_xlsx(args.workbook)} rows into {sheet.rows_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 import os
 import re
-import pandas as pd
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -38,28 +37,6 @@ def update_prompt_output(main_dict, id_key, new_prompt_dict):
         main_dict[id_key].append(new_prompt_dict)
 
 
-def append_to_excel(file_path, new_data):
-    """
-    Appends a new row of data to an existing Excel file or creates a new file with the appropriate headers.
-    
-    :param file_path: The path to the Excel file.
-    :param new_data: The new data to append as a pandas Series.
-    """
-    if os.path.exists(file_path):
-        # Load existing data
-        existing_data = pd.read_excel(file_path)
-        
-        # Append new data
-        new_df = pd.DataFrame([new_data], columns=existing_data.columns)
-        updated_data = pd.concat([existing_data, new_df], ignore_index=True)
-        
-        # Save to Excel
-        updated_data.to_excel(file_path, index=False)
-    else:
-        # Create a new file with headers and new data
-        new_df = pd.DataFrame([new_data])
-        new_df.to_excel(file_path, index=False)
-
 # Custom expected condition to wait for any text in the last element that holds Gemini's response
 class TextInLastElement:
     def __init__(self, locator):
@@ -145,7 +122,8 @@ def replace_json_tags(notebook_str, base64_images):
     def replacement_func(match):
         nonlocal counter
         replacement_text = f"{match.group(0)}"
-        if counter < len(base64_images):
+        # Images that failed to render are None, leaving their tag as is
+        if counter < len(base64_images) and base64_images[counter] is not None:
             replacement_text = f"![Plot {counter}](data:image/png;base64,{base64_images[counter]})\n{match.group(0)}"
         counter += 1
         return replacement_text